@@ -1,16 +1,30 @@
 from mubble import Dispatch, LoopWrapper, Mubble, logger
 
-from app.config import api, setup_database
+from app.config import LLM_ROUTES, SESSION_FLUSH_INTERVAL, api, setup_database
 from app.database.user import User
 from app.database.chat_history import ChatHistory
+from app.database.chat_message import ChatMessage
 from app.database.service import Service
 from app.database.master import Master
 from app.database.slot import Slot
 from app.database.appointment import Appointment
 from app.database.system import System
 from app.handlers import dps
-from app.llm.prompts import entry
-from app.utils.auto_cleaner import clean_chat_history_cool
+from app.llm.admission import admission
+from app.llm.assembler import prompt_cache
+from app.llm.prompts import reload_prompts, sync_prompt_versions
+from app.llm.resilience import resilience
+from app.llm.router import router
+from app.llm.wrapper import get_client
+from app.utils.answer_cache import answer_cache
+from app.utils.availability import availability, ensure_indexes
+from app.utils.history_cleaner import clean_dirty_histories, dirty_count
+from app.utils.history_store import flush_pending, migrate_legacy_histories
+from app.utils.media import media_pipeline
+from app.utils.metrics import metrics, start_metrics_server
+from app.utils.session_cache import sessions
+from app.utils.token_budget import token_budget
+from app.utils.tokens import get_encoding
 
 
 # LoopWrapper: для работы с асинхронными функциями
@@ -20,20 +34,14 @@ dispatch = Dispatch()
 # Загрузка всех наших команд в основной диспетчер, чтобы они добавились в обработку
 dispatch.load_many(*dps)
 
-
-async def update_entry_prompt():
-    """
-    Обновление системного промпта у всех пользователей
-    """
-    users = await User.all()
-    for user in users:
-        chat_history = await user.chat_history
-        chat_history.data[0] = {
-            "role": "system",
-            "content": entry,
-        }
-
-        await chat_history.save()
+# Значения, которые считываются при каждом запросе /metrics
+metrics.gauge("session_cache_size", lambda: sessions.stats()["size"], "Sessions in the session cache")
+metrics.gauge("answer_cache_size", lambda: answer_cache.stats()["size"], "Answers in the FAQ answer cache")
+metrics.gauge("prompt_cache_hit_rate", lambda: prompt_cache.hit_rate, "Share of prompt tokens read from the provider cache")
+metrics.gauge("dirty_histories", dirty_count, "Chat histories waiting for the cleaner")
+metrics.gauge("llm_in_flight", lambda: admission.in_flight, "LLM requests in flight")
+metrics.gauge("llm_queued", lambda: admission.queued, "LLM requests waiting for admission")
+metrics_server = None
 
 
 # Этот декоратор срабатывает при запуске бота
@@ -43,18 +51,63 @@ async def on_startup() -> None:
     logger.info("Database initialization...")
     await setup_database()
 
-    # Обновление системного промпта
-    logger.info("Updating entry prompt...")
-    await update_entry_prompt()
-    logger.info("Entry prompt updated!")
+    # Перенос старых историй чата (одно JSON-поле) в таблицу сообщений
+    logger.info("Migrating chat histories...")
+    await migrate_legacy_histories()
+
+    # Индекс свободных слотов
+    logger.info("Building availability index...")
+    await ensure_indexes()
+    await availability.rebuild()
+
+    # Загрузка системных промптов: истории чатов ссылаются на них, поэтому ничего не переписывается
+    reload_prompts()
+    await sync_prompt_versions()  # Закреплённые версии промптов - из базы
+
+    # Клиенты моделей и токенизатор не создаются при импорте, поэтому создаём их до первого сообщения
+    for model in set(LLM_ROUTES.values()):
+        get_client(model)
+    get_encoding()
+
+    # Эндпоинт /metrics (только если METRICS_ENABLED)
+    global metrics_server
+    metrics_server = await start_metrics_server()
+
+
+# Этот декоратор срабатывает при остановке бота
+@loop_wrapper.lifespan.on_shutdown
+async def on_shutdown() -> None:
+    # Записываем в базу сообщения, которые ещё не успели записаться
+    logger.info("Flushing pending chat messages...")
+    await flush_pending()
+    await token_budget.flush()
+    await media_pipeline.close()
+
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+# Этот декоратор срабатывает каждые SESSION_FLUSH_INTERVAL секунд
+@loop_wrapper.interval(seconds=SESSION_FLUSH_INTERVAL)
+async def flush_interval():
+    # Отложенные сообщения всех пользователей записываются одной транзакцией
+    with metrics.span("flush_pending"):
+        await flush_pending()
+    await token_budget.flush()  # Расход токенов пользователей - тоже одной транзакцией
+    logger.debug("Session cache: {}", sessions.stats())
+    logger.debug("Prompt cache: {}", prompt_cache.stats())
+    logger.debug("Answer cache: {}", answer_cache.stats())
+    logger.debug("LLM admission: {}", admission.stats())
+    logger.debug("LLM routes: {}", router.stats())
+    logger.debug("LLM resilience: {}", resilience.stats())
+    logger.debug("Media pipeline: {}", media_pipeline.stats())
 
 
 # Этот декоратор срабатывает каждых 10 секунд
 @loop_wrapper.interval(seconds=10)
 async def interval():
-    chat_histories = await ChatHistory.all()  # Получаем все истории чатов
-    for chat_history in chat_histories:  # Проходимся по каждой истории чата
-        await clean_chat_history_cool(chat_history)
+    # Очищаем только те истории чатов, которые изменились с прошлого прохода
+    await clean_dirty_histories()
 
 
 bot = Mubble(
@@ -1,23 +1,32 @@
 from tortoise import Model, fields
 
 from app.database.user import User
-from app.llm.prompts import entry
+from app.utils import codec
 
 
 # Модель для хранения истории чата.
 # У неё связь OnetoOne с моделью User, чтобы можно было получить историю чата по пользователю.
 # В поле user описана обратная связь с помощью типизации.
+# Сами сообщения хранятся в модели ChatMessage, по одной строке на сообщение.
+# Системный промпт в истории не хранится: история ссылается на него по типу и версии из app.llm.prompts.
 class ChatHistory(Model):
     id = fields.IntField(pk=True)  # ID истории чата
     data = fields.JSONField(
-        default=[{"role": "system", "content": entry}], null=True
-    )  # Данные истории чата (по умолчанию записывается изначальный промпт)
+        encoder=codec.dumps, decoder=codec.loads, null=True
+    )  # Устаревшее: вся история одним JSON, переносится в ChatMessage при запуске
+    prompt = fields.CharField(
+        max_length=32, default="ENTRY"
+    )  # Имя типа системного промпта (PromptType)
+    prompt_version = fields.CharField(
+        max_length=16, null=True
+    )  # Версия промпта на момент создания истории (хранится в PromptVersion), None - всегда текущая версия
+    next_seq = fields.IntField(default=0)  # Порядковый номер следующего сообщения
+    total_tokens = fields.IntField(
+        default=0
+    )  # Сумма токенов всех сообщений истории (без системного промпта)
     last_update = fields.DatetimeField(
         auto_now=True
     )  # Время последнего обновления истории чата (автоматически обновляется при сохранении)
 
     user: fields.ReverseRelation["User"]  # Обратная связь с моделью User
-
-    @property
-    def data_length(self) -> int:
-        return len(self.data)
+    messages: fields.ReverseRelation["ChatMessage"]  # type: ignore
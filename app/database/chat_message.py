@@ -0,0 +1,57 @@
+from typing import Any
+
+from tortoise import Model, fields
+
+from app.utils import codec
+
+# seq строки со сводкой удалённых сообщений: она всегда идёт первой, сразу после системного промпта
+SUMMARY_SEQ = -1
+
+
+# Модель для хранения одного сообщения истории чата.
+# Сообщения только добавляются в конец (seq растёт), поэтому каждый ход записывает
+# только свои новые сообщения, а не всю историю целиком.
+class ChatMessage(Model):
+    id = fields.BigIntField(pk=True)
+    chat_history = fields.ForeignKeyField(
+        "models.ChatHistory", related_name="messages", on_delete=fields.CASCADE
+    )
+    seq = fields.IntField()  # Порядковый номер сообщения в истории чата
+    role = fields.CharField(max_length=20)  # system/user/assistant/function/tool
+    content = fields.TextField(null=True)
+    name = fields.CharField(max_length=64, null=True)  # Название инструмента
+    tool_calls = fields.JSONField(
+        encoder=codec.dumps, decoder=codec.loads, null=True
+    )  # Вызовы инструментов ассистента
+    tool_call_id = fields.CharField(max_length=64, null=True)
+    tokens = fields.IntField(default=0)  # Количество токенов в сообщении
+
+    class Meta:
+        unique_together = (("chat_history", "seq"),)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Возвращает сообщение в том виде, в котором его принимает модель."""
+        message = {"role": self.role, "content": self.content}
+        if self.name is not None:
+            message["name"] = self.name
+        if self.tool_calls is not None:
+            message["tool_calls"] = self.tool_calls
+        if self.tool_call_id is not None:
+            message["tool_call_id"] = self.tool_call_id
+        return message
+
+    @classmethod
+    def from_dict(
+        cls, chat_history_id: int, seq: int, message: dict[str, Any], tokens: int
+    ) -> "ChatMessage":
+        """Создаёт (но не сохраняет) сообщение из словаря в формате модели."""
+        return cls(
+            chat_history_id=chat_history_id,
+            seq=seq,
+            role=message["role"],
+            content=message.get("content"),
+            name=message.get("name"),
+            tool_calls=message.get("tool_calls"),
+            tool_call_id=message.get("tool_call_id"),
+            tokens=tokens,
+        )
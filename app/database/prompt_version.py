@@ -0,0 +1,15 @@
+from tortoise import Model, fields
+
+
+# Модель для хранения версий системных промптов.
+# Версия - хэш содержимого (app.llm.prompts), одна строка на тип промпта и версию.
+# История чата с закреплённой версией получает этот же текст и после изменения файла промпта.
+class PromptVersion(Model):
+    id = fields.IntField(pk=True)
+    type = fields.CharField(max_length=32)  # Имя типа промпта (PromptType)
+    version = fields.CharField(max_length=16)
+    content = fields.TextField()
+    created_at = fields.DatetimeField(auto_now_add=True)  # Когда версия впервые загружена
+
+    class Meta:
+        unique_together = (("type", "version"),)
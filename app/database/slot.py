@@ -15,3 +15,10 @@ class Slot(Model):
     master = fields.ForeignKeyField("models.Master", related_name="slots")
 
     appointment: fields.ReverseRelation["Appointment"]  # type: ignore
+
+    class Meta:
+        # У мастера не может быть двух слотов на одно и то же время.
+        # Этот же уникальный индекс используется для поиска слотов мастера по дате.
+        unique_together = (("master", "date", "time"),)
+        # Поиск свободных слотов по статусу и дате
+        indexes = (("status", "date", "time"),)
@@ -1,7 +1,10 @@
 from tortoise import Model, fields
 
+from app.utils import codec
+
 
 # Модель для хранения системных данных
 class System(Model):
     id = fields.IntField(pk=True)
-    reports = fields.JSONField(default=[], null=True)
+    reports = fields.JSONField(encoder=codec.dumps, decoder=codec.loads, default=[], null=True)
+    fixtures_version = fields.IntField(default=0)  # Версия загруженных демо-данных
@@ -0,0 +1,13 @@
+from tortoise import Model, fields
+
+
+# Модель для хранения расхода токенов модели одним пользователем за день.
+# Строка на пользователя и день: по ней проверяется дневной бюджет токенов.
+class TokenUsage(Model):
+    id = fields.IntField(pk=True)
+    uid = fields.BigIntField()  # Telegram ID пользователя
+    day = fields.DateField()
+    tokens = fields.IntField(default=0)  # Токены запросов и ответов модели за день
+
+    class Meta:
+        unique_together = (("uid", "day"),)
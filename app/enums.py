@@ -5,7 +5,14 @@ class Info(StrEnum):
     TERMINATE_AFTER_ANSWER = (
         "LLM has already answered this question. You cannot answer it again."
     )
+    TOOL_LIMIT_REACHED = (
+        "Tool call limit for this turn is reached. "
+        "Answer the client with the information you already have, without calling tools."
+    )
 
 
 class Error(StrEnum):
     NO_CONTENT_IN_RESPONSE = "No content in response"
+    LLM_BUSY = "LLM request was not admitted"
+    DAILY_BUDGET_EXCEEDED = "Daily token budget exceeded"
+    TOOL_LIMIT_REACHED = "Tool call limit reached without an answer"
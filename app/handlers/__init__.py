@@ -1,5 +1,5 @@
 from app.handlers import photo
 from .middlewares import dps as middleware_dps
-from . import photo_caption, text
+from . import photo_caption, text, voice
 
-dps = [*middleware_dps, text.dp, photo_caption.dp, photo.dp]
+dps = [*middleware_dps, text.dp, photo_caption.dp, photo.dp, voice.dp]
@@ -1,7 +1,10 @@
+from pathlib import Path
+
 from mubble import Dispatch, Message
 
 from app.database.chat_history import ChatHistory
 from app.rules import HasPhoto
+from app.utils.media import largest_photo, media_pipeline
 
 
 dp = Dispatch()
@@ -10,10 +13,16 @@ dp = Dispatch()
 # Этот хендлер срабатывает, если сообщение содержит фото без подписи
 @dp.message(HasPhoto())
 async def photo_handler(message: Message, chat_history: ChatHistory):
-    photo_id = message.photo.unwrap()[-1].file_id  # Получаем ID фото (самое большое фото, так как индекс -1)
-    photo_path = (await message.ctx_api.get_file(photo_id)).unwrap().file_path.unwrap()  # Получаем путь к фото
-    photo_bytes: bytes = await message.ctx_api.download_file(photo_path)  # Скачиваем фото (получаем байты)
+    photo = largest_photo(message)  # Самое большое фото (последнее в списке)
+    if photo.file_size is not None:  # Для размера фото скачивать не нужно, он уже есть в сообщении
+        await message.answer(f"Photo without caption received! Size: {photo.file_size} bytes.")
+        return
+
+    async def on_ready(path: Path) -> None:  # Фото скачано в спул в фоне
+        await message.answer(f"Photo without caption received! Size: {path.stat().st_size} bytes.")
+
+    async def on_error(error: Exception) -> None:  # Фото не скачалось: сообщаем, а не молчим
+        await message.answer("Could not download the photo, please send it again.")
 
-    await message.answer(
-        f"Photo without caption received! Size: {len(photo_bytes)} bytes."
-    )
+    if not media_pipeline.submit(message.ctx_api, photo, on_ready, on_error):
+        await message.answer("Too many files right now, please send the photo again later.")
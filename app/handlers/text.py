@@ -4,22 +4,64 @@ from mubble.rules import HasText
 from app.database.chat_history import ChatHistory
 from app.enums import Error, Info
 from app.llm.wrapper import make_completion
+from app.config import STREAMING
+from app.utils.streaming import StreamingReply
+from app.utils.turn_scheduler import turns
 
 dp = Dispatch()
 
+# Ответы пользователю, когда модель не ответила по нашим ограничениям, а не из-за ошибки
+REPLIES = {
+    Error.LLM_BUSY: "Зараз дуже багато звернень 🙏 Напишіть, будь ласка, ще раз за хвилинку.",
+    Error.DAILY_BUDGET_EXCEEDED: "На сьогодні ліміт повідомлень вичерпано. Напишіть нам завтра, будь ласка 🌸",
+    Error.TOOL_LIMIT_REACHED: "Не вдалося обробити запит. Спробуйте, будь ласка, сформулювати його простіше.",
+}
+QUEUED_REPLY = "Зараз багато звернень, ваше повідомлення в черзі — відповім за хвилинку ⏳"
+
+
+def clean_answer(text: str) -> str:
+    """Убирает из ответа модели markdown-символы, которые Telegram не отображает."""
+    return text.replace("*", "").replace("#", "")
+
 
 # Этот хендлер срабатывает, если сообщение содержит текст
 @dp.message(HasText())
 async def text_handler(message: Message, chat_history: ChatHistory):
-    result = (
-        (await make_completion(chat_history, message)).replace("*", "").replace("#", "")
+    # Ход выполняется через планировщик: несколько сообщений подряд склеиваются в один ход,
+    # а у одного пользователя одновременно выполняется только один ход
+    reply = StreamingReply(message, clean_answer) if STREAMING else None
+
+    async def notify_queued() -> None:  # Запрос к модели долго ждёт в общей очереди
+        await message.answer(QUEUED_REPLY)
+
+    result = await turns.submit(
+        message.from_user.id,
+        message.text.unwrap(),
+        lambda text: make_completion(
+            chat_history,
+            message,
+            text,
+            on_delta=reply.update if reply else None,
+            on_queued=notify_queued,
+        ),
     )
+    if result is None:  # Сообщение ушло в модель вместе со следующим, ответ будет там
+        return
+    result = clean_answer(result)
 
     if result == Error.NO_CONTENT_IN_RESPONSE:
         logger.error(result)
-        return
-    if result == Info.TERMINATE_AFTER_ANSWER:
+        result = None
+    elif result == Info.TERMINATE_AFTER_ANSWER:  # Ответ уже отправил инструмент
         logger.debug(result)
-        return
+        result = None
+    elif result in REPLIES:
+        result = REPLIES[result]
 
-    await message.answer(result)
+    if reply is None:
+        if result is not None:
+            await message.answer(result)
+    elif result is not None:  # Уже показанный текст заменяется ответом
+        await reply.finish(result)
+    else:  # Ответа модели нет: показанный текст не должен остаться в чате
+        await reply.discard()
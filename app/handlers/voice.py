@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from mubble import Dispatch, Message
+
+from app.database.chat_history import ChatHistory
+from app.rules import HasVoice
+from app.utils.media import media_pipeline, voice_file
+
+
+dp = Dispatch()
+
+
+# Этот хендлер срабатывает, если сообщение содержит голосовое сообщение
+@dp.message(HasVoice())
+async def voice_handler(message: Message, chat_history: ChatHistory):
+    voice = voice_file(message)
+    duration = message.voice.unwrap().duration
+    if voice.file_size is not None:  # Размер уже есть в сообщении, скачивать не нужно
+        await message.answer(f"Voice received! Duration: {duration} s. Size: {voice.file_size} bytes.")
+        return
+
+    async def on_ready(path: Path) -> None:  # Голосовое скачано в спул в фоне
+        await message.answer(f"Voice received! Duration: {duration} s. Size: {path.stat().st_size} bytes.")
+
+    async def on_error(error: Exception) -> None:  # Голосовое не скачалось: сообщаем, а не молчим
+        await message.answer("Could not download the voice message, please send it again.")
+
+    if not media_pipeline.submit(message.ctx_api, voice, on_ready, on_error):
+        await message.answer("Too many files right now, please send the voice message again later.")
@@ -1,11 +1,27 @@
-import json
+from functools import lru_cache
 from pathlib import Path
+from typing import Any
+
+from app.utils import codec
+
 from .calls import tool_objects
 
 CURRENT_DIR = Path(__file__).parent
 TOOLS_DIR = CURRENT_DIR / "tools.json"
 
-with open(TOOLS_DIR) as f:
-    tools = json.loads(f.read())
 
-__all__ = ("tools", "tool_objects")
+# Схемы инструментов читаются при первом обращении (создание клиента), а не при импорте app.llm
+@lru_cache(maxsize=None)
+def get_tools() -> list[dict[str, Any]]:
+    with open(TOOLS_DIR) as f:
+        return codec.loads(f.read())
+
+
+# from app.llm import tools работает как раньше
+def __getattr__(name: str) -> Any:
+    if name == "tools":
+        return get_tools()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ("get_tools", "tools", "tool_objects")
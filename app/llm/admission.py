@@ -0,0 +1,246 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from mubble import logger
+
+from app.config import (
+    LLM_MAX_CONCURRENT,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_NOTICE_AFTER,
+    LLM_QUEUE_TIMEOUT,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+from app.utils.metrics import metrics
+
+CHARS_PER_TOKEN = 3  # Грубая оценка для украинского текста; после ответа оценка заменяется точным usage
+OUTPUT_TOKENS_ESTIMATE = 300  # Сколько токенов ответа резервируется до того, как известен usage
+
+
+class Busy(Exception):
+    """Запрос к модели не допущен: очередь переполнена или ожидание в ней слишком долгое."""
+
+
+class TokenBucket:
+    """
+    Ведро токенов с пополнением `per_minute` единиц в минуту.
+    Уровень может уйти в минус, если реальный расход оказался больше оценки (см. `settle`).
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Через сколько секунд в ведре будет `amount` (0 - уже есть)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # Иначе слишком большой запрос ждал бы вечно
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+
+# Запрос, который ждёт в очереди
+@dataclass(slots=True)
+class _Waiter:
+    tokens: int
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class AdmissionController:
+    """
+    Допуск запросов к модели.
+
+    * Одновременно выполняется не больше `max_concurrent` запросов.
+    * Запросы в минуту и токены в минуту ограничены вёдрами токенов.
+    * Ожидающие запросы выдаются по кругу между пользователями, а не в порядке прихода:
+      пользователь с длинной цепочкой инструментов не задерживает остальных.
+    * Если очередь полна или запрос ждал дольше `queue_timeout`, выбрасывается `Busy`.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = LLM_MAX_CONCURRENT,
+        requests_per_minute: int | None = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int | None = LLM_TOKENS_PER_MINUTE,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        notice_after: float = LLM_QUEUE_NOTICE_AFTER,
+    ):
+        self.max_concurrent = max_concurrent
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.notice_after = notice_after
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._queues: dict[int, deque[_Waiter]] = {}  # Очередь каждого пользователя
+        self._order: deque[int] = deque()  # Пользователи с ожидающими запросами, по кругу
+        self._wakeup: asyncio.TimerHandle | None = None  # Повторная выдача, когда пополнятся вёдра
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        uid: int,
+        tokens: int,
+        on_queued: Callable[[], Awaitable[None]] | None = None,
+    ) -> AsyncIterator[None]:
+        """
+        Ждёт допуска запроса пользователя `uid` примерно на `tokens` токенов и держит место до выхода.
+        `on_queued` вызывается, если запрос ждёт в очереди дольше `notice_after` секунд.
+        """
+        await self.acquire(uid, tokens, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(
+        self,
+        uid: int,
+        tokens: int,
+        on_queued: Callable[[], Awaitable[None]] | None = None,
+    ) -> None:
+        if self.try_acquire(tokens):
+            return
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            metrics.inc("llm_admission_rejected_total", reason="queue_full")
+            raise Busy("LLM queue is full")
+
+        waiter = _Waiter(tokens)
+        if uid not in self._queues:
+            self._queues[uid] = deque()
+            self._order.append(uid)
+        self._queues[uid].append(waiter)
+        self.queued += 1
+        self._dispatch()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.queue_timeout
+        try:
+            if on_queued is not None and self.notice_after < self.queue_timeout:
+                done, _ = await asyncio.wait({waiter.future}, timeout=self.notice_after)
+                if not done:
+                    try:
+                        await on_queued()
+                    except Exception as e:  # Уведомление не отправилось - запрос всё равно ждёт своей очереди
+                        logger.warning("Queue notice failed: {}", repr(e))
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            if waiter.future.done():  # Допущен в последний момент
+                return
+            self._remove(uid, waiter)
+            self.rejected += 1
+            metrics.inc("llm_admission_rejected_total", reason="timeout")
+            raise Busy(f"LLM queue wait exceeded {self.queue_timeout} seconds")
+        except BaseException:  # Отмена хода или любая другая ошибка: место и очередь не должны утечь
+            if waiter.future.done():
+                self.release()  # Место уже выдано, но запрос не пойдёт
+            else:
+                self._remove(uid, waiter)
+            raise
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Занимает место без ожидания, только если оно есть сейчас и никто не ждёт в очереди.
+        Так допускаются дублирующие запросы: они не обходят лимиты и не отнимают место у очереди.
+        """
+        if self._order or self._can_admit(tokens) != 0.0:
+            return False
+        self._admit(tokens)
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Поправляет ведро токенов по реальному usage ответа вместо оценки."""
+        if self.tokens is not None and actual:
+            self.tokens.take(actual - estimated)
+
+    def _can_admit(self, tokens: int) -> float | None:
+        """0 - можно допускать сейчас, число - через сколько секунд, None - ждать освобождения места."""
+        if self.in_flight >= self.max_concurrent:
+            return None
+        return max(
+            self.requests.wait_time(1) if self.requests else 0.0,
+            self.tokens.wait_time(tokens) if self.tokens else 0.0,
+        )
+
+    def _admit(self, tokens: int) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+    def _dispatch(self) -> None:
+        """Выдаёт места ожидающим запросам по кругу между пользователями, пока позволяют лимиты."""
+        while self._order:
+            uid = self._order[0]
+            waiter = self._queues[uid][0]
+            wait = self._can_admit(waiter.tokens)
+            if wait is None:  # Все места заняты, следующая выдача - в release
+                return
+            if wait > 0:  # Лимит в минуту: повторим, когда вёдра пополнятся
+                if self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later(wait, self._wake)
+                return
+
+            self._remove(uid, waiter)
+            if uid in self._queues:  # У пользователя есть ещё запросы - в конец круга
+                self._order.rotate(-1)
+            self._admit(waiter.tokens)
+            waiter.future.set_result(None)
+
+    def _wake(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _remove(self, uid: int, waiter: _Waiter) -> None:
+        queue = self._queues[uid]
+        queue.remove(waiter)
+        self.queued -= 1
+        if not queue:
+            del self._queues[uid]
+            self._order.remove(uid)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+def estimate_tokens(messages: list[dict[str, Any]]) -> int:
+    """Оценка токенов запроса и ответа без токенизатора: запрос ещё не отправлен, точное число придёт в usage."""
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return chars // CHARS_PER_TOKEN + OUTPUT_TOKENS_ESTIMATE
+
+
+# Общий контроль допуска для всего бота
+admission = AdmissionController()
+
+
+__all__ = ("AdmissionController", "Busy", "TokenBucket", "admission", "estimate_tokens")
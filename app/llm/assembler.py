@@ -0,0 +1,83 @@
+from datetime import datetime
+from typing import Any
+
+from mubble import logger
+
+
+def get_current_time():
+    """
+    Повертає поточний час у форматі ISO 8601.
+    """
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def assemble_request(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Собирает сообщения запроса к модели так, чтобы их начало не менялось от запроса к запросу.
+
+    Порядок: системный промпт, схемы инструментов (их подставляет клиент, они читаются
+    один раз на процесс), история чата (её начало сдвигается блоками, см. `load_messages`),
+    новые сообщения хода и в самом конце - то, что меняется каждый запрос (текущее время).
+    Провайдер кэширует самое длинное одинаковое начало запроса, поэтому всё изменчивое - в хвосте.
+    Хвост не сохраняется в историю чата.
+    """
+    return [
+        *messages,
+        {"role": "system", "content": f"Current time and date: {get_current_time()}"},
+    ]
+
+
+class PromptCacheStats:
+    """
+    Сколько токенов запросов к модели провайдер взял из своего кэша промптов.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, response: Any) -> None:
+        """Учитывает usage из ответа модели (AIMessage или собранный из кусков стрима)."""
+        prompt_tokens, cached_tokens = read_usage(response)
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        logger.debug("Prompt tokens: {}, cached: {}", prompt_tokens, cached_tokens)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+
+
+def read_usage(response: Any) -> tuple[int, int]:
+    """Возвращает (токены запроса, из них взято из кэша) из метаданных ответа."""
+    if usage := getattr(response, "usage_metadata", None):
+        details = usage.get("input_token_details") or {}
+        return usage.get("input_tokens", 0), details.get("cache_read", 0) or 0
+
+    # Старые версии langchain-openai кладут usage только в response_metadata
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    details = token_usage.get("prompt_tokens_details") or {}
+    return token_usage.get("prompt_tokens", 0), details.get("cached_tokens", 0) or 0
+
+
+# Общая статистика кэша промптов для всего бота
+prompt_cache = PromptCacheStats()
+
+
+__all__ = (
+    "PromptCacheStats",
+    "assemble_request",
+    "get_current_time",
+    "prompt_cache",
+    "read_usage",
+)
@@ -3,84 +3,69 @@ from typing import Any, List, Dict
 from datetime import datetime, timedelta
 from mubble import AiohttpClient, Message
 import datetime as datetime_module
-from tortoise.exceptions import DoesNotExist
+from tortoise.exceptions import DoesNotExist, IntegrityError
+from tortoise.transactions import in_transaction
 
 from app.llm.decorators import (
+    cacheable,
+    catalog_only,
+    run_serially,
     terminate_after_answer,
-)  # Декоратор, который нам нужен для замораживания ответа модели
+)  # Декораторы: замораживание ответа модели, последовательное выполнение и кэширование инструмента
 from app.database.slot import Slot
 from app.database.service import Service
 from app.database.master import Master
 from app.database.appointment import Appointment
 from app.database.user import User
+from app.utils.availability import availability
+from app.utils.catalog import catalog
 
 
+class SlotTaken(Exception):
+    """Slot is already booked, the booking transaction must be rolled back."""
+
+
+@cacheable
 async def get_free_time_slots(
-    min_slot_duration: int, start_date: str, end_date: str
-) -> List[Dict[str, Any]]:
+    min_slot_duration: int,
+    start_date: str,
+    end_date: str,
+    staff_id: int | None = None,
+    service_id: int | None = None,
+    offset: int = 0,
+) -> Dict[str, Any]:
     """
     Returns free time slots for employees based on their work schedule.
+    The list is limited, `next_offset` is returned when more slots are available.
     """
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
 
-    # Get all available slots within date range
-    slots = await Slot.filter(
-        date__gte=start.date(), date__lte=end.date(), status="available"
-    ).prefetch_related("service", "master")
-
-    # Filter slots by minimum duration
-    available_slots = []
-    for slot in slots:
-        if slot.service.duration >= min_slot_duration:
-            available_slots.append(
-                {
-                    "id": slot.id,
-                    "date": slot.date.isoformat(),
-                    "time": slot.time.isoformat(),
-                    "service": {
-                        "id": slot.service.id,
-                        "name": slot.service.name,
-                        "duration": slot.service.duration,
-                        "price": slot.service.price,
-                    },
-                    "master": {
-                        "staff_id": slot.master.id,
-                        "name": slot.master.name,
-                        "specialization": slot.master.specialization,
-                    },
-                }
-            )
-
-    return available_slots
+    return await availability.find(
+        min_slot_duration,
+        start.date(),
+        end.date(),
+        master_id=staff_id,
+        service_id=service_id,
+        offset=offset,
+    )
 
 
+@cacheable
+@catalog_only
 async def get_services() -> List[Dict[str, Any]]:
     """
     Returns a list of services with their details.
     """
 
     try:
-        # Get all services
-        services = await Service.all()
-
-        result = []
-        for service in services:
-            service_data = {
-                "id": service.id,
-                "name": service.name,
-                "description": service.description,
-                "price": service.price,
-                "duration": service.duration,  # Duration in minutes
-            }
-            result.append(service_data)
-
-        return result
+        return await catalog.services_json()  # Already serialized, served from memory
 
     except Exception as e:
         return []
 
 
+@run_serially
 async def create_record(
     staff_id: int,
     services: List[Dict[str, Any]],
@@ -106,60 +91,119 @@ async def create_record(
             "error": "Користувача з таким uid не знайдено. Будь ласка, зареєструйтесь спочатку."
         }
 
-    # Оновити телефон, якщо він переданий і ще не збережений
-    if client.get("phone") and not user.phone:
-        user.phone = client["phone"]
-        await user.save()
-
-    # Далі як і було:
-    appointments = []
-    for service_info in services:
-        service = await Service.get(id=service_info["id"])
-        slot, _ = await Slot.get_or_create(
-            date=appointment_datetime.date(),
-            time=appointment_datetime.time(),
-            service=service,
-            master_id=staff_id,
-            defaults={"status": "booked"},
-        )
-        appointment = await Appointment.create(user=user, slot=slot, status="active")
-        appointments.append(appointment)
+    staff = {master["id"]: master for master in await catalog.staff()}
+    if staff_id not in staff:
+        return {"error": "Майстра з таким staff_id не знайдено."}
 
+    slots = []
+    booked_from: dict[int, int] = {}  # ID вільного слоту, який бронюється -> його послуга до бронювання
+    try:
+        # Усе бронювання - одна транзакція: або записані всі послуги, або жодна
+        async with in_transaction():
+            # Усі послуги одним запитом
+            service_ids = [service_info["id"] for service_info in services]
+            loaded = {
+                service.id: service
+                for service in await Service.filter(id__in=service_ids)
+            }
+            if missing := [i for i in service_ids if i not in loaded]:
+                return {"error": f"Послуги з id {missing} не знайдено."}
+
+            # Кілька послуг записуються одна за одною, кожна починається після попередньої
+            starts, start = [], appointment_datetime
+            for service_id in service_ids:
+                starts.append(start)
+                start += timedelta(minutes=loaded[service_id].duration)
+
+            # Блокуємо вже існуючі слоти майстра на ці дні, щоб паралельний запис їх не зайняв.
+            # Час порівнюємо тут, а не в SQL: TimeField повертає час з tzinfo, а start.time() - без нього,
+            # і SQLite зберігає час рядком разом зі зсувом
+            existing = {
+                (slot.date, slot.time.replace(tzinfo=None)): slot
+                for slot in await Slot.filter(
+                    master_id=staff_id,
+                    date__in=list({start.date() for start in starts}),
+                ).select_for_update()
+            }
+
+            for service_id, start in zip(service_ids, starts):
+                slot = existing.get((start.date(), start.time()))
+                if slot is None:
+                    # Нового слоту ще немає: унікальний індекс (master, date, time)
+                    # не дасть двом паралельним записам створити його двічі
+                    slot = await Slot.create(
+                        date=start.date(),
+                        time=start.time(),
+                        status="booked",
+                        service_id=service_id,
+                        master_id=staff_id,
+                    )
+                elif slot.status != "available":
+                    # Виняток відкочує всю транзакцію, разом з уже заброньованими слотами
+                    raise SlotTaken(f"Час {start.isoformat()} у цього майстра вже зайнятий.")
+                else:
+                    booked_from[slot.id] = slot.service_id
+                    slot.status = "booked"
+                    slot.service_id = service_id
+                    await slot.save(update_fields=["status", "service_id"])
+                slots.append(slot)
+
+            # Оновити телефон, якщо він переданий і ще не збережений
+            if client.get("phone") and not user.phone:
+                user.phone = client["phone"]
+                await user.save(update_fields=["phone"])
+
+            await Appointment.bulk_create(
+                [Appointment(user=user, slot=slot, status="active") for slot in slots]
+            )
+            # bulk_create не повертає id, тому забираємо їх одним запитом
+            appointment_ids = dict(
+                await Appointment.filter(
+                    user=user, slot_id__in=[slot.id for slot in slots]
+                ).values_list("slot_id", "id")
+            )
+    except (SlotTaken, IntegrityError) as e:
+        # Транзакцію відкочено: повертаємо в індекс вільних слотів те, що встигли там зайняти,
+        # з тією послугою, яка записана в базі (а не зі зміненою в пам'яті)
+        for slot in slots:
+            if slot.id in booked_from:
+                slot.status = "available"
+                slot.service_id = booked_from[slot.id]
+                availability.release(slot)
+        if isinstance(e, SlotTaken):
+            return {"error": str(e)}
+        return {"error": "Цей час щойно зайняли. Будь ласка, оберіть інший."}
+
+    master = staff[staff_id]
     return {
         "appointments": [
             {
-                "id": app.id,
-                "status": app.status,
+                "id": appointment_ids.get(slot.id),
+                "status": "active",
                 "service": {
-                    "id": app.slot.service.id,
-                    "name": app.slot.service.name,
-                    "price": app.slot.service.price,
-                    "duration": app.slot.service.duration,
+                    "id": loaded[slot.service_id].id,
+                    "name": loaded[slot.service_id].name,
+                    "price": loaded[slot.service_id].price,
+                    "duration": loaded[slot.service_id].duration,
                 },
                 "master": {
-                    "id": (await app.slot.master).id,
-                    "name": (await app.slot.master).name,
+                    "id": master["id"],
+                    "name": master["name"],
                 },
-                "datetime": f"{app.slot.date.isoformat()}T{app.slot.time.isoformat()}",
+                "datetime": datetime_module.datetime.combine(slot.date, slot.time),
             }
-            for app in appointments
+            for slot in slots
         ]
     }
 
 
+@cacheable
+@catalog_only
 async def get_staff() -> list[dict]:
     """
     Returns a list of all staff (masters) with their id, name, and specialization.
     """
-    masters = await Master.all()
-    return [
-        {
-            "id": master.id,
-            "name": master.name,
-            "specialization": master.specialization,
-        }
-        for master in masters
-    ]
+    return await catalog.staff_json()  # Already serialized, served from memory
 
 
 # Словарь, который содержит все функции из этого файла
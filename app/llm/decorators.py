@@ -5,3 +5,31 @@ def terminate_after_answer(func):
     """
     func._terminate_after_answer = True
     return func
+
+
+def run_serially(func):
+    """
+    Декоратор для инструментов, которые нельзя выполнять одновременно с другими
+    (например, которые что-то записывают в базу данных)
+    """
+    func._run_serially = True
+    return func
+
+
+def cacheable(func):
+    """
+    Декоратор для инструментов, которые только читают данные.
+    Одинаковые вызовы (то же название и аргументы) в рамках одного хода выполняются один раз,
+    пока не выполнился инструмент без этого декоратора
+    """
+    func._cacheable = True
+    return func
+
+
+def catalog_only(func):
+    """
+    Декоратор для инструментов, результат которых зависит только от каталога салона.
+    Ответы модели, для которых вызывались только такие инструменты, можно класть в кэш ответов
+    """
+    func._catalog_only = True
+    return func
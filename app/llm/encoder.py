@@ -0,0 +1,166 @@
+from typing import Any
+
+from app.config import TOOL_RESULT_BUDGET, TOOL_RESULT_BUDGETS
+from app.utils.catalog import PreSerialized
+from app.utils.codec import dumps
+from app.utils.tokens import count_tokens_batch
+
+# Ключи, по которым вложенный объект считается сущностью (услуга, мастер) и выносится в справочник
+ID_KEYS = ("id", "staff_id")
+TABLE_MIN_ROWS = 2  # Списки короче этого остаются списками объектов
+# Оценка для JSON результатов: цифры, даты и знаки дают около 2 символов на токен (текст - около 3)
+CHARS_PER_TOKEN = 2.0
+FIT_ATTEMPTS = 3  # Сколько раз уточнять обрезку точным подсчётом токенов
+
+
+async def encode_tool_result(tool_name: str, result: Any) -> str:
+    """
+    Кодирует результат инструмента для сообщения `function`: это же содержимое уходит в модель
+    и сохраняется в историю чата.
+
+    Списки объектов превращаются в таблицы (`columns` + `rows`), повторяющиеся вложенные
+    сущности выносятся в справочник `refs` и заменяются ссылкой `<поле>_id`.
+    Если результат больше бюджета инструмента в токенах, длинный список обрезается
+    и добавляется `more_available` - сколько элементов не вошло.
+    Длина подбирается по оценке в символах, токенизатор считает только итоговый вариант
+    (в пуле потоков), обычно один раз.
+    """
+    if isinstance(result, PreSerialized):  # Уже готовый JSON (например, из кэша каталога)
+        return result
+
+    content = dumps(compact(result))
+    budget = TOOL_RESULT_BUDGETS.get(tool_name, TOOL_RESULT_BUDGET)
+    if budget is None:
+        return content
+
+    limit = int(budget * CHARS_PER_TOKEN)  # Бюджет в символах
+    for _ in range(FIT_ATTEMPTS):
+        candidate = content if len(content) <= limit else truncate(result, limit)
+        if candidate is None:  # Обрезать нечего
+            return content
+        [used] = await count_tokens_batch([{"role": "function", "content": candidate}])
+        if used <= budget:
+            return candidate
+        # Символов на токен оказалось меньше оценки: уточняем по точному подсчёту
+        limit = len(candidate) * budget // used
+    return candidate
+
+
+def compact(value: Any) -> Any:
+    """Переводит списки объектов (на верхнем уровне и в полях словаря) в таблицы."""
+    if _is_records(value):
+        return tabulate(value)
+    if isinstance(value, dict):
+        return {key: tabulate(item) if _is_records(item) else item for key, item in value.items()}
+    return value
+
+
+def tabulate(records: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Таблица из списка объектов. Пример для свободных слотов:
+    {"columns": ["id", "date", "time", "service_id", "master_id"], "rows": [[...], ...],
+     "refs": {"service": {"3": {...}}, "master": {"5": {...}}}}
+    """
+    refs: dict[str, dict[Any, dict[str, Any]]] = {}
+    columns: dict[str, None] = {}  # Упорядоченное множество колонок
+    flat_records = []
+    for record in records:
+        flat = {}
+        for key, value in record.items():
+            if isinstance(value, dict) and (entity_id := _entity_id(value)) is not None:
+                # Сущность пишется в справочник один раз, в строке остаётся только ссылка
+                refs.setdefault(key, {})[entity_id] = {
+                    k: v for k, v in value.items() if k not in ID_KEYS
+                }
+                flat[f"{key}_id"] = entity_id
+            else:
+                flat[key] = value
+        columns.update(dict.fromkeys(flat))
+        flat_records.append(flat)
+
+    table = {
+        "columns": list(columns),
+        "rows": [[record.get(column) for column in columns] for record in flat_records],
+    }
+    if refs:
+        table["refs"] = refs
+    return table
+
+
+def expand(value: Any) -> Any:
+    """Обратное к `tabulate`: таблица снова становится списком объектов со вложенными сущностями."""
+    if not (isinstance(value, dict) and "columns" in value and "rows" in value):
+        return value
+    refs = value.get("refs", {})
+    records = []
+    for row in value["rows"]:
+        record = {}
+        for column, item in zip(value["columns"], row):
+            key = column.removesuffix("_id")
+            if key != column and key in refs:
+                # После JSON ключи справочника - строки
+                record[key] = {"id": item, **refs[key].get(str(item), {})}
+            else:
+                record[column] = item
+        records.append(record)
+    return records
+
+
+def truncate(result: Any, max_chars: int) -> str | None:
+    """
+    Обрезает самый длинный список результата так, чтобы JSON уложился в `max_chars` символов.
+    Подбор длины - бинарным поиском, справочник собирается только по оставшимся строкам.
+    """
+    key, records = _longest_list(result)
+    if records is None:
+        return None
+
+    def render(count: int) -> str:
+        dropped = len(records) - count
+        value = result[:count] if key is None else {**result, key: records[:count]}
+        encoded = compact(value)
+        if not isinstance(encoded, dict):
+            encoded = {"items": encoded}
+        encoded["more_available"] = dropped
+        if key is not None and isinstance(result.get("total"), int):
+            # Постраничный результат: следующая страница начинается с первого невошедшего элемента
+            encoded["next_offset"] = result.get("next_offset", result["total"]) - dropped
+        return dumps(encoded)
+
+    lo, hi = 0, len(records) - 1  # Хотя бы один элемент всегда отбрасывается
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(render(mid)) <= max_chars:
+            lo = mid
+        else:
+            hi = mid - 1
+    return render(lo)
+
+
+def _is_records(value: Any) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) >= TABLE_MIN_ROWS
+        and all(isinstance(item, dict) for item in value)
+    )
+
+
+def _entity_id(value: dict[str, Any]) -> Any:
+    for key in ID_KEYS:
+        if key in value:
+            return value[key]
+    return None
+
+
+def _longest_list(result: Any) -> tuple[str | None, list | None]:
+    """Возвращает (ключ, список): ключ None - сам результат является списком."""
+    if isinstance(result, list):
+        return None, result
+    if isinstance(result, dict):
+        lists = [(key, value) for key, value in result.items() if isinstance(value, list) and value]
+        if lists:
+            return max(lists, key=lambda item: len(item[1]))
+    return None, None
+
+
+__all__ = ("compact", "encode_tool_result", "expand", "tabulate", "truncate")
@@ -1,3 +1,5 @@
+from dataclasses import dataclass
+from hashlib import sha256
 from pathlib import Path
 from enum import Enum
 
@@ -7,9 +9,25 @@ CURRENT_DIR = Path(__file__).parent
 # Это Enum, который содержит все возможные типы промптов
 class PromptType(Enum):
     ENTRY = "entry.txt"
+    SUMMARY = "summary.txt"  # Промпт для сводки старых сообщений истории чата
     # Сюда можно добавить другие типы промптов, если они понадобятся
 
 
+# Версия промпта: тип, хэш содержимого и само содержимое
+@dataclass(frozen=True, slots=True)
+class Prompt:
+    type: PromptType
+    version: str
+    content: str
+
+
+# Реестр всех загруженных версий промптов: {тип: {версия: промпт}}.
+# Версии сохраняются в базу (PromptVersion) в sync_prompt_versions, поэтому реестр переживает перезапуск
+_versions: dict[PromptType, dict[str, Prompt]] = {}
+# Текущая (последняя загруженная) версия каждого промпта
+_latest: dict[PromptType, Prompt] = {}
+
+
 # Эта функция возвращает содержимое файла промпта по его типу
 def get_prompt(prompt_type: PromptType) -> str:
     try:
@@ -21,9 +39,67 @@ def get_prompt(prompt_type: PromptType) -> str:
         raise Exception(f"Error reading prompt file: {e}")
 
 
-# В переменной entry содержится содержимое файла entry.txt
-entry = get_prompt(PromptType.ENTRY)
+# Читает файл промпта и регистрирует его как текущую версию.
+# Историям чата не нужно ничего переписывать: они хранят тип и версию промпта, старые версии остаются в реестре.
+def load_prompt(prompt_type: PromptType) -> Prompt:
+    content = get_prompt(prompt_type)
+    version = sha256(content.encode("UTF-8")).hexdigest()[:12]
+    prompt = _versions.setdefault(prompt_type, {}).setdefault(
+        version, Prompt(prompt_type, version, content)
+    )
+    _latest[prompt_type] = prompt
+    return prompt
+
+
+# Возвращает промпт по типу (объект PromptType или его имя) и версии.
+# Без версии (или если такой версии нет в реестре) возвращается текущая версия.
+def resolve_prompt(prompt_type: PromptType | str, version: str | None = None) -> Prompt:
+    if isinstance(prompt_type, str):
+        prompt_type = PromptType[prompt_type]
+    if version is not None and (prompt := _versions.get(prompt_type, {}).get(version)):
+        return prompt
+    if (prompt := _latest.get(prompt_type)) is not None:
+        return prompt
+    return load_prompt(prompt_type)
+
+
+# Перечитывает все промпты с диска (после изменения файла промпта)
+def reload_prompts() -> None:
+    for prompt_type in PromptType:
+        load_prompt(prompt_type)
+
+
+# Сохраняет текущие версии промптов в базу и добавляет в реестр все сохранённые раньше:
+# история чата с закреплённой версией получает тот же промпт и после перезапуска бота.
+async def sync_prompt_versions() -> None:
+    from app.database.prompt_version import PromptVersion  # Модели базы нужны только здесь
+
+    for prompt in _latest.values():
+        await PromptVersion.get_or_create(
+            type=prompt.type.name, version=prompt.version, defaults={"content": prompt.content}
+        )
+    for type_name, version, content in await PromptVersion.all().values_list("type", "version", "content"):
+        if type_name in PromptType.__members__:
+            prompt_type = PromptType[type_name]
+            _versions.setdefault(prompt_type, {}).setdefault(version, Prompt(prompt_type, version, content))
+
+
+# В переменной entry содержится содержимое файла entry.txt.
+# Файл читается при первом обращении (или в reload_prompts при запуске), а не при импорте модуля
+def __getattr__(name: str) -> str:
+    if name == "entry":
+        return resolve_prompt(PromptType.ENTRY).content
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Можно добавить другие промпты, если они понадобятся, используя функцию get_prompt
 
-__all__ = ("PromptType", "get_prompt", "entry")
+__all__ = (
+    "PromptType",
+    "Prompt",
+    "get_prompt",
+    "load_prompt",
+    "resolve_prompt",
+    "reload_prompts",
+    "sync_prompt_versions",
+    "entry",
+)
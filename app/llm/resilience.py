@@ -0,0 +1,264 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from mubble import logger
+
+from app.config import (
+    LLM_ATTEMPT_TIMEOUT,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_BREAKER_COOLDOWN,
+    LLM_BREAKER_FAILURES,
+    LLM_FALLBACKS,
+    LLM_HEDGE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_RETRIES,
+)
+from app.llm.admission import admission
+from app.utils.metrics import metrics
+
+LATENCY_WINDOW = 200  # По скольким последним ответам модели считается p95
+RETRYABLE_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Ошибки openai (импортировать openai здесь не нужно: проверяем по имени класса)
+RETRYABLE_ERRORS = frozenset(
+    {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError"}
+)
+
+Invoke = Callable[[str], Awaitable[Any]]
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Временная ошибка провайдера: таймаут, обрыв соединения, 429 или 5xx."""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUSES
+
+
+class CircuitBreaker:
+    """
+    Размыкается после `failures` временных ошибок подряд: запросы идут на запасную модель.
+    Через `cooldown` секунд основную модель пробует один запрос, остальные идут на запасную,
+    пока он не закончится: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False  # В half_open уже идёт пробный запрос
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allows(self) -> bool:
+        state = self.state
+        return state == "closed" or state == "half_open" and not self.probing
+
+    def begin(self) -> bool:
+        """Отмечает пробный запрос, если цепь в half_open. True - этот запрос и есть пробный."""
+        if self.probing or self.state != "half_open":
+            return False
+        self.probing = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning("Circuit breaker opened after {} failures", self.failures)
+            self.opened_at = time.monotonic()  # В half_open одна ошибка снова размыкает цепь
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных ответов модели."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._values: deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._values.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def p95(self) -> float:
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class ResilientCaller:
+    """
+    Вызов модели с ограничением времени попытки, повторами с экспоненциальной задержкой и джиттером,
+    дублирующим запросом (hedging) и автоматическим выключателем с переходом на запасную модель.
+    """
+
+    def __init__(
+        self,
+        attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+        retries: int = LLM_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+        hedge: bool = LLM_HEDGE,
+        hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        fallbacks: dict[str, str] = LLM_FALLBACKS,
+    ):
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.fallbacks = fallbacks
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.latencies: dict[str, LatencyTracker] = {}
+        self.counts = {
+            "retries": 0,
+            "timeouts": 0,
+            "hedges": 0,
+            "hedges_skipped": 0,
+            "hedge_wins": 0,
+            "fallbacks": 0,
+        }
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        return self.breakers.setdefault(model, CircuitBreaker())
+
+    def pick_model(self, model: str) -> str:
+        """Модель для попытки: запасная, если выключатель основной разомкнут."""
+        if self.breaker(model).allows():
+            return model
+        fallback = self.fallbacks.get(model)
+        if fallback is None or not self.breaker(fallback).allows():
+            return model  # Запасной нет или она тоже падает - пробуем основную
+        self.counts["fallbacks"] += 1
+        metrics.inc("llm_fallbacks_total", model=model)
+        return fallback
+
+    def hedge_delay(self, model: str) -> float | None:
+        """Через сколько секунд отправить дублирующий запрос (None - не дублировать)."""
+        latencies = self.latencies.get(model)
+        if not self.hedge or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, latencies.p95())
+
+    def backoff(self, attempt: int) -> float:
+        """Полный джиттер: случайная задержка до base * 2^attempt, чтобы повторы не шли волной."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    async def call(self, model: str, invoke: Invoke, hedge_tokens: int | None = None) -> tuple[Any, str]:
+        """
+        Вызывает `invoke(модель)` и возвращает (ответ, модель, которая ответила).
+        `hedge_tokens` - оценка токенов запроса, с которой дублирующий запрос занимает место в `admission`;
+        None - не дублировать (при стриминге куски уже показываются пользователю).
+        Невременные ошибки (например, 400) и последняя неудачная попытка пробрасываются дальше.
+        """
+        for attempt in range(self.retries + 1):
+            target = self.pick_model(model)
+            breaker = self.breaker(target)
+            probe = breaker.begin()
+            try:
+                response = await self._attempt(target, invoke, hedge_tokens)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.failure()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                self.counts["retries"] += 1
+                metrics.inc("llm_retries_total", model=target)
+                logger.warning(
+                    "LLM {} attempt {} failed ({}), retrying in {:.2f}s", target, attempt + 1, repr(e), delay
+                )
+                await asyncio.sleep(delay)
+            else:
+                breaker.success()
+                return response, target
+            finally:
+                if probe:  # Невременная ошибка или отмена: следующий запрос снова может быть пробным
+                    breaker.probing = False
+
+    async def _attempt(self, model: str, invoke: Invoke, hedge_tokens: int | None) -> Any:
+        """Одна попытка с ограничением времени и, если ответ задерживается дольше p95, дублирующим запросом."""
+        delay = self.hedge_delay(model) if hedge_tokens is not None else None
+        if delay is None or delay >= self.attempt_timeout:
+            return await self._timed(model, invoke)
+
+        primary = asyncio.ensure_future(self._timed(model, invoke))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        # Дублирующий запрос - такой же запрос к модели: без свободного места и запаса лимитов он не отправляется
+        if not admission.try_acquire(hedge_tokens):
+            self.counts["hedges_skipped"] += 1
+            return await primary
+        self.counts["hedges"] += 1
+        metrics.inc("llm_hedges_total", model=model)
+        secondary = asyncio.ensure_future(self._timed(model, invoke))
+        secondary.add_done_callback(lambda _: admission.release())
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None or not pending:  # Первый успех или последняя ошибка
+                        if task is secondary and task.exception() is None:
+                            self.counts["hedge_wins"] += 1
+                        return task.result()
+        finally:
+            for task in pending:  # Проигравший запрос отменяется
+                task.cancel()
+
+    async def _timed(self, model: str, invoke: Invoke) -> Any:
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(invoke(model), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            self.counts["timeouts"] += 1
+            metrics.inc("llm_timeouts_total", model=model)
+            raise
+        self.latencies.setdefault(model, LatencyTracker()).add(time.perf_counter() - start)
+        return response
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.counts,
+            "breakers": {model: breaker.state for model, breaker in self.breakers.items()},
+            "p95_ms": {
+                model: round(latencies.p95() * 1000, 1)
+                for model, latencies in self.latencies.items()
+                if len(latencies)
+            },
+        }
+
+
+# Общий слой устойчивости вызовов модели для всего бота
+resilience = ResilientCaller()
+
+
+__all__ = (
+    "CircuitBreaker",
+    "LatencyTracker",
+    "ResilientCaller",
+    "is_retryable",
+    "resilience",
+)
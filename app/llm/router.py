@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+from typing import Any
+
+from app.config import LLM_MODEL, LLM_PRICES, LLM_ROUTES, ROUTER_SMALL_TALK_MAX_WORDS
+from app.llm import tool_objects
+from app.utils import codec
+from app.utils.answer_cache import normalize
+from app.utils.metrics import metrics
+
+# Слова приветствий и благодарностей (после normalize). Ход только из них не требует инструментов.
+# "так", "ні", "добре" сюда не входят: это часто подтверждение записи, его решает основная модель.
+SMALL_TALK_WORDS = frozenset(
+    {
+        "привит", "привет", "витаю", "здравствуйте", "здрастуйте", "добрий", "доброго", "доброе",
+        "ден", "ранок", "ранку", "утро", "вечир", "вечора", "дня", "дякую", "дякуемо", "спасиби",
+        "спасибо", "болшое", "дуже", "щиро", "велике", "гарного", "хорошого", "до", "побачення",
+        "бувайте", "бувай", "чудово", "супер", "клас", "hi", "hello", "thanks", "thank", "you", "bye",
+    }
+)
+
+
+# Маршруты хода: их модели задаются в LLM_ROUTES
+class Route:
+    SMALL_TALK = "small_talk"  # Приветствия и благодарности
+    AFTER_TOOLS = "after_tools"  # Ответ после результатов инструментов
+    DEFAULT = "default"  # Остальные ходы
+    ESCALATED = "escalated"  # Повтор запроса после некорректного вызова или вызова записи дешёвой моделью
+    SUMMARY = "summary"  # Сводка старых сообщений (не часть хода, модель - SUMMARY_MODEL)
+
+
+def is_small_talk(text: str) -> bool:
+    """Короткое сообщение только из приветствий и благодарностей."""
+    words = normalize(text)
+    return 0 < len(words) <= ROUTER_SMALL_TALK_MAX_WORDS and all(word in SMALL_TALK_WORDS for word in words)
+
+
+def malformed_tool_calls(tool_calls: list[dict[str, Any]]) -> list[str]:
+    """Ошибки в вызовах инструментов: неизвестный инструмент или аргументы - не JSON-объект."""
+    errors = []
+    for tool_call in tool_calls:
+        function = tool_call.get("function") or {}
+        name = function.get("name")
+        if name not in tool_objects:
+            errors.append(f"unknown tool {name!r}")
+            continue
+        try:
+            arguments = codec.loads(function.get("arguments") or "{}")
+        except ValueError:
+            errors.append(f"{name}: arguments are not valid JSON")
+            continue
+        if not isinstance(arguments, dict):
+            errors.append(f"{name}: arguments are not an object")
+    return errors
+
+
+def write_tool_calls(tool_calls: list[dict[str, Any]]) -> list[str]:
+    """
+    Вызовы инструментов, которые могут менять данные (без `cacheable`, например create_record).
+    Аргументы записи заполняет только сильная модель: дешёвой после инструментов достаётся
+    ответ клиенту и чтение.
+    """
+    return [
+        f"{name}: writes data"
+        for tool_call in tool_calls
+        if (name := (tool_call.get("function") or {}).get("name")) in tool_objects
+        and not getattr(tool_objects[name], "_cacheable", False)
+    ]
+
+
+# Статистика одного маршрута и модели
+@dataclass(slots=True)
+class RouteStats:
+    calls: int = 0
+    seconds: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0  # В долларах по LLM_PRICES
+    baseline_cost: float = 0.0  # Сколько бы стоили те же токены на LLM_MODEL
+
+
+class ModelRouter:
+    """
+    Выбирает модель для каждого запроса хода по политике `routes` (маршрут -> модель)
+    и считает задержку и стоимость каждого маршрута, чтобы было видно экономию.
+    """
+
+    def __init__(self, routes: dict[str, str] = LLM_ROUTES, strong_model: str = LLM_MODEL):
+        self.routes = routes
+        self.strong_model = strong_model
+        self.escalations = 0
+        self._stats: dict[tuple[str, str], RouteStats] = {}
+
+    def choose(self, text: str, iterations: int, escalated: bool = False) -> tuple[str, str]:
+        """(маршрут, модель) для запроса: `iterations` - сколько раз за ход уже вызывались инструменты."""
+        if escalated:
+            route = Route.ESCALATED
+        elif iterations:
+            route = Route.AFTER_TOOLS
+        elif is_small_talk(text):
+            route = Route.SMALL_TALK
+        else:
+            route = Route.DEFAULT
+        return route, self.routes.get(route, self.strong_model)
+
+    def should_escalate(self, model: str, tool_calls: list[dict[str, Any]]) -> list[str]:
+        """
+        Причины повторить запрос на сильной модели: ошибки в вызовах инструментов
+        или вызов инструмента, который пишет данные.
+        """
+        if model == self.strong_model or not tool_calls:
+            return []
+        if errors := malformed_tool_calls(tool_calls) + write_tool_calls(tool_calls):
+            self.escalations += 1
+            metrics.inc("llm_escalations_total", model=model)
+        return errors
+
+    def record(self, route: str, model: str, seconds: float, usage: dict[str, Any]) -> None:
+        """Учитывает один ответ модели: время и usage_metadata."""
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        cost = price(model, input_tokens, output_tokens)
+
+        stats = self._stats.setdefault((route, model), RouteStats())
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.input_tokens += input_tokens
+        stats.output_tokens += output_tokens
+        stats.cost += cost
+        stats.baseline_cost += price(self.strong_model, input_tokens, output_tokens)
+        metrics.inc("llm_cost_usd_total", cost, route=route, model=model)
+
+    def stats(self) -> dict[str, Any]:
+        routes = {
+            f"{route}/{model}": {
+                "calls": stats.calls,
+                "avg_ms": round(stats.seconds / stats.calls * 1000, 1) if stats.calls else 0.0,
+                "input_tokens": stats.input_tokens,
+                "output_tokens": stats.output_tokens,
+                "cost_usd": round(stats.cost, 4),
+            }
+            for (route, model), stats in sorted(self._stats.items())
+        }
+        cost = sum(stats.cost for stats in self._stats.values())
+        baseline = sum(stats.baseline_cost for stats in self._stats.values())
+        return {
+            "routes": routes,
+            "escalations": self.escalations,
+            "cost_usd": round(cost, 4),
+            "saved_usd": round(baseline - cost, 4),
+        }
+
+
+def price(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Стоимость запроса в долларах (0, если цены модели нет в LLM_PRICES)."""
+    input_price, output_price = LLM_PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+# Общий маршрутизатор для всего бота
+router = ModelRouter()
+
+
+__all__ = (
+    "ModelRouter",
+    "Route",
+    "RouteStats",
+    "is_small_talk",
+    "malformed_tool_calls",
+    "price",
+    "router",
+    "write_tool_calls",
+)
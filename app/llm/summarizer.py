@@ -0,0 +1,183 @@
+import re
+import time
+from typing import Any, Protocol
+
+from mubble import logger
+
+from app.config import SUMMARIZER, SUMMARY_MAX_LINES, SUMMARY_MODEL, get_env
+from app.llm.admission import admission, estimate_tokens
+from app.llm.encoder import expand
+from app.llm.prompts import PromptType, resolve_prompt
+from app.llm.resilience import resilience
+from app.llm.router import Route, router
+from app.utils import codec
+from app.utils.metrics import metrics
+
+# Первая строка сообщения со сводкой, сама сводка идёт после неё
+SUMMARY_HEADER = "Summary of the earlier conversation with this client:"
+CLIENT_PREFIX = "- Client wrote: "  # Строки локальной сводки с репликами клиента
+TRANSCRIPT_LIMIT = 500  # Сколько символов каждого сообщения попадает в запрос к модели-суммаризатору
+SUMMARY_QUEUE = 0  # Очередь допуска для сводок: все сводки ждут как один пользователь и не вытесняют клиентов
+
+PHONE_RE = re.compile(r"\+?\d[\d\s()-]{7,}\d")
+NAME_RE = re.compile(
+    r"(?:меня зовут|мене звати|мене звуть|my name is)\s+([^\W\d_][\w'-]*)", re.IGNORECASE
+)
+
+
+class Summarizer(Protocol):
+    """
+    Суммаризатор получает текущую сводку (None, если её ещё нет) и сообщения,
+    которые удаляются из истории, и возвращает обновлённую сводку.
+    Сводка обновляется по частям и никогда не строится заново по всей истории.
+    """
+
+    async def __call__(self, summary: str | None, messages: list[dict[str, Any]]) -> str: ...
+
+
+class LocalSummarizer:
+    """
+    Сводка без модели: детерминированно выбирает из сообщений имя, телефон, записи и запросы
+    клиента. Подходит для тестов и как запасной вариант, если модель недоступна.
+    """
+
+    def __init__(self, max_lines: int = SUMMARY_MAX_LINES):
+        self.max_lines = max_lines
+
+    async def __call__(self, summary: str | None, messages: list[dict[str, Any]]) -> str:
+        lines = summary.splitlines() if summary else []
+        for message in messages:
+            lines.extend(self.facts(message))
+
+        # Повторы убираем, оставляя последнее упоминание
+        unique = list(dict.fromkeys(reversed(lines)))
+        unique.reverse()
+        # Факты (имя, телефон, записи) важнее реплик клиента: реплики вытесняются первыми
+        facts = [line for line in unique if not line.startswith(CLIENT_PREFIX)][-self.max_lines :]
+        notes = [line for line in unique if line.startswith(CLIENT_PREFIX)]
+        notes = notes[len(notes) - (self.max_lines - len(facts)) :] if len(facts) < self.max_lines else []
+        return "\n".join(facts + notes)
+
+    @staticmethod
+    def facts(message: dict[str, Any]) -> list[str]:
+        content = message.get("content") or ""
+        if message["role"] == "user":
+            phones = [re.sub(r"[^\d+]", "", phone) for phone in PHONE_RE.findall(content)]
+            facts = [f"- Phone: {phone}" for phone in phones]
+            facts += [f"- Name: {name}" for name in NAME_RE.findall(content)]
+            facts.append(f"{CLIENT_PREFIX}{' '.join(content.split())[:120]}")
+            return facts
+        if message["role"] in ("function", "tool") and message.get("name") == "create_record":
+            try:
+                result = codec.loads(content)
+            except ValueError:
+                return []
+            return [
+                f"- Booked appointment {item.get('id')}: {item['service']['name']} "
+                f"with {item['master']['name']} at {item.get('datetime')}"
+                for item in expand(result.get("appointments", []))
+                if isinstance(item, dict) and "service" in item and "master" in item
+            ]
+        return []
+
+
+class ModelSummarizer:
+    """
+    Сводка дешёвой моделью по промпту PromptType.SUMMARY.
+    Запрос идёт тем же путём, что и запросы хода: допуск в `admission`, таймауты и запасная модель
+    в `resilience`, время и стоимость - в статистику маршрута Route.SUMMARY.
+    """
+
+    def __init__(self, model: str = SUMMARY_MODEL):
+        self.model = model
+        self._clients: dict[str, Any] = {}
+
+    def client(self, model: str):
+        """Клиент модели `model` без инструментов: resilience может перейти на запасную модель."""
+        if model not in self._clients:
+            from langchain_openai import ChatOpenAI  # Как и основной клиент - только при первом вызове
+
+            # max_retries=0: таймауты и повторы делает app.llm.resilience
+            self._clients[model] = ChatOpenAI(api_key=get_env("OPENAI_TOKEN"), model=model, max_retries=0)
+        return self._clients[model]
+
+    async def __call__(self, summary: str | None, messages: list[dict[str, Any]]) -> str:
+        transcript = "\n".join(
+            f"{message['role']}: {(message.get('content') or '')[:TRANSCRIPT_LIMIT]}"
+            for message in messages
+            if message.get("content")
+        )
+        request = [
+            {"role": "system", "content": resolve_prompt(PromptType.SUMMARY).content},
+            {
+                "role": "user",
+                "content": f"Current summary:\n{summary or '-'}\n\nNew messages:\n{transcript}",
+            },
+        ]
+
+        async def invoke(model: str):
+            return await self.client(model).ainvoke(input=request)
+
+        estimate = estimate_tokens(request)
+        async with admission.slot(SUMMARY_QUEUE, estimate):
+            start = time.perf_counter()
+            with metrics.span("llm", route=Route.SUMMARY):
+                response, model = await resilience.call(self.model, invoke)
+        usage = getattr(response, "usage_metadata", None) or {}
+        router.record(Route.SUMMARY, model, time.perf_counter() - start, usage)
+        metrics.record_usage(usage)
+        admission.settle(estimate, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+        return response.content.strip()
+
+
+_summarizer: Summarizer | None = None
+
+
+def get_summarizer() -> Summarizer:
+    """Суммаризатор из настройки SUMMARIZER ("model" или "local"), если его не подменили."""
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = ModelSummarizer() if SUMMARIZER == "model" else LocalSummarizer()
+    return _summarizer
+
+
+def set_summarizer(summarizer: Summarizer | None) -> None:
+    """Подменяет суммаризатор (None - вернуть суммаризатор из настроек)."""
+    global _summarizer
+    _summarizer = summarizer
+
+
+async def update_summary(summary: str | None, messages: list[dict[str, Any]]) -> str:
+    """
+    Дописывает в сводку удаляемые сообщения. Если суммаризатор упал,
+    используется локальный: сообщения удаляются в любом случае, и факты из них не теряются.
+    """
+    try:
+        return await get_summarizer()(summary, messages)
+    except Exception as e:
+        logger.error("Summarizer failed, using local summary: {}", e)
+        return await LocalSummarizer()(summary, messages)
+
+
+def render_summary(summary: str) -> str:
+    """Содержимое сообщения со сводкой."""
+    return f"{SUMMARY_HEADER}\n{summary}"
+
+
+def parse_summary(content: str | None) -> str | None:
+    """Сама сводка из содержимого сообщения со сводкой."""
+    if not content:
+        return None
+    return content.removeprefix(SUMMARY_HEADER).strip() or None
+
+
+__all__ = (
+    "LocalSummarizer",
+    "ModelSummarizer",
+    "Summarizer",
+    "get_summarizer",
+    "parse_summary",
+    "render_summary",
+    "set_summarizer",
+    "update_summary",
+)
@@ -1,119 +1,365 @@
+import asyncio  # Модуль для одновременного выполнения инструментов
 import inspect  # Модуль для работы с функциями (получение аргументов, их значения и т.д.)
-import json  # Модуль для работы с JSON, желательно использовать orjson, так как он быстрее
-from typing import Any, Callable  # Модуль для работы с типами данных
-from datetime import datetime
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable  # Модуль для работы с типами данных
+from functools import lru_cache
 
 from mubble import (
     Message,
     logger,
 )  # Message - объект сообщения телеграм, logger - модуль для логирования
-from langchain_openai import ChatOpenAI
 from app.database.chat_history import ChatHistory  # Модель истории чата
-from app.config import LLM_MODEL, OPENAI_TOKEN  # Конфигурация
-from app.llm import tools, tool_objects  # Инструменты и объекты инструментов
+from app.config import (
+    FAQ_CACHE_ENABLED,
+    LLM_MODEL,
+    MAX_TOOL_ITERATIONS,
+    SESSION_WRITE_BEHIND,
+    get_env,
+    TOOL_TIMEOUT,
+)  # Конфигурация
+from app.llm import get_tools, tool_objects  # Инструменты и объекты инструментов
+from app.llm.admission import Busy, admission, estimate_tokens
+from app.llm.assembler import assemble_request, prompt_cache
+from app.llm.encoder import encode_tool_result
+from app.llm.resilience import is_retryable, resilience
+from app.llm.router import Route, router
 from app.enums import Error, Info  # Перечисления ошибок и информации
+from app.utils import codec
+from app.utils.answer_cache import answer_cache
+from app.utils.metrics import ITERATION_BUCKETS, metrics
+from app.utils.token_budget import token_budget
+from app.utils.history_store import (
+    after_write,
+    append_messages,
+    has_messages,
+    load_messages,
+    queue_messages,
+)
 
-client = ChatOpenAI(api_key=OPENAI_TOKEN, model=LLM_MODEL).bind_tools(
-    tools=tools, tool_choice="auto"
-)  # Клиент для работы с OpenAI API
+if TYPE_CHECKING:
+    from langchain_core.runnables import Runnable
 
 
-def get_current_time():
+@lru_cache(maxsize=None)
+def get_client(model: str = LLM_MODEL) -> "Runnable":
     """
-    Повертає поточний час у форматі ISO 8601.
+    Клиент для работы с OpenAI API, один на модель (с уже привязанными инструментами).
+    Создаётся при первом вызове (или в on_startup), вместе с импортом langchain_openai,
+    чтобы импорт wrapper не тянул LangChain.
     """
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    from langchain_openai import ChatOpenAI
 
+    # stream_usage: usage (и cached_tokens) приходит и в стриме, последним куском.
+    # max_retries=0: таймауты и повторы делает app.llm.resilience, иначе повторы умножаются
+    return ChatOpenAI(
+        api_key=get_env("OPENAI_TOKEN"), model=model, stream_usage=True, max_retries=0
+    ).bind_tools(tools=get_tools(), tool_choice="auto")
 
-async def make_completion(chat_history: ChatHistory, message: Message) -> str | None:
+
+async def make_completion(
+    chat_history: ChatHistory,
+    message: Message,
+    text: str | None = None,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+    use_answer_cache: bool = FAQ_CACHE_ENABLED,
+    on_queued: Callable[[], Awaitable[None]] | None = None,
+) -> str | None:
     """
     Обрабатывает сообщение пользователя, создаёт ответ с помощью модели и вызывает необходимые инструменты.
-    Все промежуточные сообщения сохраняются во временном списке и обновляются в истории чата только в конце.
+    `text` - текст хода, если он отличается от текста сообщения (например, несколько склеенных сообщений).
+    `on_delta` - если передан, ответ модели стримится, и функция вызывается с уже полученным текстом.
+    `use_answer_cache` - False, если ход нельзя брать из кэша ответов и класть в него (нужны данные пользователя).
+    `on_queued` - вызывается, если первый запрос хода долго ждёт в очереди к модели.
+    Если модель перегружена или бюджет пользователя исчерпан, возвращается ошибка из Error, а не исключение.
+    Все промежуточные сообщения сохраняются во временном списке и дописываются в историю чата только в конце.
     """
-    temp_messages = chat_history.data.copy()  # Копируем все сообщения из истории чата
-    temp_messages.append(
-        {"role": "system", "content": f"Current time and date: {get_current_time()}"}
-    )
-    temp_messages.append(
-        {"role": "user", "content": message.text.unwrap()}
-    )  # Добавляем сообщение пользователя
+    text = text or message.text.unwrap()
+    user_message = {"role": "user", "content": text}
+
+    # Частые вопросы (цены, мастера) отвечаются из кэша без запроса к модели.
+    # Только в начале разговора: вопрос вроде "скільки це коштує?" зависит от прошлых ходов
+    use_answer_cache = use_answer_cache and not has_messages(chat_history)
+    if use_answer_cache and (cached := answer_cache.lookup(text)) is not None:
+        metrics.observe("tool_iterations", 0, ITERATION_BUCKETS)
+        await save_chat_history(
+            chat_history, [user_message, {"role": "assistant", "content": cached}]
+        )  # История остаётся такой же, как если бы ответила модель
+        return cached
+
+    uid = message.from_user.id
+    if not await token_budget.allows(uid):  # Дневной бюджет токенов пользователя исчерпан
+        return Error.DAILY_BUDGET_EXCEEDED
+
+    temp_messages = await load_messages(chat_history)  # Загружаем последние сообщения из истории чата
+    history_length = len(temp_messages)  # Всё, что после этого индекса - новые сообщения этого хода
+    tool_cache: dict[tuple[str, str], asyncio.Future] = {}  # Результаты read-only инструментов этого хода
+    used_tools: set[str] = set()  # Инструменты, которые вызывались за этот ход
+    iterations = 0  # Сколько раз модель получила результаты инструментов за этот ход
+    escalated = False  # Дешёвая модель ошиблась в вызове инструмента или вызвала запись, дальше - только сильная
+    temp_messages.append(user_message)  # Добавляем сообщение пользователя
 
     while (
         True
     ):  # Бесконечный цикл, пока не будет получен ответ от модели и пока она не пройдется по всем цепочкам инструментов
-        response = await get_model_text_response(
-            temp_messages
-        )  # Получаем ответ от модели
+        request = assemble_request(temp_messages)  # Текущее время добавляется в конец запроса и не сохраняется
+        if tool_limit_reached := iterations >= MAX_TOOL_ITERATIONS:  # Больше инструментов не даём
+            request.append({"role": "system", "content": Info.TOOL_LIMIT_REACHED})
+        route, model = router.choose(text, iterations, escalated)  # Дешёвая модель для простых запросов
+        try:
+            response, answered = await get_model_text_response(
+                request, on_delta, uid, on_queued if iterations == 0 else None, model=model, route=route
+            )  # Ответ и модель, которая ответила (при разомкнутом выключателе - запасная)
+        except Exception as e:
+            if not isinstance(e, Busy) and not is_retryable(e):
+                raise
+            # Не допущен в очередь или провайдер не ответил после всех повторов и запасной модели
+            logger.warning("LLM request of user {} failed: {!r}", uid, e)
+            if iterations:  # Инструменты этого хода уже выполнены (например, запись), сохраняем их
+                await save_chat_history(chat_history, temp_messages[history_length:])
+            return Error.LLM_BUSY
         result_message = response.content
 
-        if tool_calls := response.additional_kwargs.get(
-            "tool_calls", []
-        ):  # Если есть инструменты
+        tool_calls = response.additional_kwargs.get("tool_calls", [])
+        if errors := router.should_escalate(answered, tool_calls):
+            if escalated:  # Сильная модель недоступна, ответила запасная: её запись не выполняем
+                logger.warning("Main model is unavailable, {} tool calls are dropped ({})", answered, "; ".join(errors))
+                if iterations:
+                    await save_chat_history(chat_history, temp_messages[history_length:])
+                return Error.LLM_BUSY
+            logger.warning("Escalating tool calls of model {} ({})", answered, "; ".join(errors))
+            escalated = True
+            continue  # Тот же запрос - сильной модели, ответ дешёвой никуда не сохраняется
+        if tool_calls and tool_limit_reached:
+            logger.warning("User {} turn reached {} tool iterations", uid, iterations)
+            tool_calls = []  # Модель всё равно просит инструменты - отвечаем тем, что есть
+
+        if tool_calls:  # Если есть инструменты
             tool_responses, should_terminate = await handle_tool_calls(
-                tool_calls, message
+                tool_calls, message, tool_cache
             )  # Обрабатываем инструменты
             temp_messages.extend(tool_responses)  # Добавляем результаты инструментов
+            used_tools.update(response["name"] for response in tool_responses)
+            iterations += 1
             if (
                 should_terminate
             ):  # Если нужно завершить генерацию ответа после выполнения инструмента
+                metrics.observe("tool_iterations", iterations, ITERATION_BUCKETS)
                 await save_chat_history(
-                    chat_history, temp_messages
-                )  # Сохраняем все сообщения
+                    chat_history, temp_messages[history_length:]
+                )  # Сохраняем новые сообщения
                 return Info.TERMINATE_AFTER_ANSWER  # Возвращаем информацию о завершении
             continue  # Пропускаем остальной код
-        elif result_message:  # Если есть контент
+        metrics.observe("tool_iterations", iterations, ITERATION_BUCKETS)
+        if result_message:  # Если есть контент
             temp_messages.append(
                 {"role": "assistant", "content": result_message}
             )  # Добавляем контент
             await save_chat_history(
-                chat_history, temp_messages
-            )  # Сохраняем все сообщения
+                chat_history, temp_messages[history_length:]
+            )  # Сохраняем новые сообщения
+            if use_answer_cache and is_shareable_answer(result_message, used_tools, message):
+                answer_cache.store(text, result_message)
             return result_message  # Возвращаем контент
+        elif tool_limit_reached:  # Результаты инструментов сохраняем, ответа нет
+            await save_chat_history(chat_history, temp_messages[history_length:])
+            return Error.TOOL_LIMIT_REACHED
         else:
             return Error.NO_CONTENT_IN_RESPONSE  # Возвращаем ошибку
 
 
-async def get_model_text_response(messages: dict):
-    """Получает ответ от модели с заданными сообщениями."""
-    return await client.ainvoke(
-        input=messages
-    )  # Создаём запрос к модели с сообщениями и инструментами
+def is_shareable_answer(answer: str, used_tools: set[str], message: Message) -> bool:
+    """
+    Ответ можно отдавать другим пользователям, если он построен только на каталоге салона
+    (вызывался хотя бы один инструмент каталога и никакие другие) и не обращается к пользователю по имени.
+    Ответ без инструментов не кэшируется: модель ответила из общих знаний или из разговора.
+    Ответы в середине разговора не кэшируются вовсе (см. make_completion).
+    """
+    if not used_tools:
+        return False
+    if not all(getattr(tool_objects.get(name), "_catalog_only", False) for name in used_tools):
+        return False
+    name = message.from_user.first_name
+    return not name or name.casefold() not in answer.casefold()
+
+
+async def get_model_text_response(
+    messages: dict,
+    on_delta: Callable[[str], Awaitable[None]] | None = None,
+    uid: int | None = None,
+    on_queued: Callable[[], Awaitable[None]] | None = None,
+    model: str = LLM_MODEL,
+    route: str = Route.DEFAULT,
+):
+    """
+    Получает ответ от модели `model` с заданными сообщениями.
+    Запрос ждёт допуска в `admission` (общий лимит запросов и токенов) и выбрасывает `Busy`, если не дождался.
+    Таймауты, повторы и переход на запасную модель - в `resilience`.
+    Токены ответа списываются с дневного бюджета пользователя `uid`, время и стоимость - в статистику маршрута `route`.
+    Возвращает (ответ, модель, которая ответила): при разомкнутом выключателе это запасная модель.
+    """
+    # Запросы, отменённые уже после отправки (проигравший дублирующий запрос, таймаут): (модель, секунды).
+    # Провайдер всё равно считает их входные токены
+    abandoned: list[tuple[str, float]] = []
 
+    async def invoke(model: str):
+        client = get_client(model)
+        sent = time.perf_counter()
+        try:
+            if on_delta is None:
+                return await client.ainvoke(
+                    input=messages
+                )  # Создаём запрос к модели с сообщениями и инструментами
+            # Стриминг: куски ответа складываются в один (вызовы инструментов и usage тоже собираются по кускам).
+            # При повторе текст показывается заново: on_delta получает весь текст, а не добавку
+            response = None
+            async for chunk in client.astream(input=messages):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    await on_delta(response.content)  # Отдаём весь уже полученный текст
+            return response
+        except asyncio.CancelledError:
+            abandoned.append((model, time.perf_counter() - sent))
+            raise
 
-async def handle_tool_calls(tool_calls: list, message: Message) -> list[dict[str, Any]]:
-    """Обрабатывает все tool_calls и возвращает список сообщений с результатами выполнения инструментов."""
-    temp_tool_messages = []  # Временный список сообщений с результатами инструментов
+    estimate = estimate_tokens(messages)
+    async with admission.slot(uid, estimate, on_queued):
+        start = time.perf_counter()
+        with metrics.span("llm", route=route):
+            response, model = await resilience.call(
+                model, invoke, hedge_tokens=estimate if on_delta is None else None
+            )
+    prompt_cache.record(response)
+    usage = getattr(response, "usage_metadata", None) or {}
+    router.record(route, model, time.perf_counter() - start, usage)
+    metrics.record_usage(usage)
+    tokens = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    admission.settle(estimate, tokens)
+    # Отменённые запросы - тот же запрос: входных токенов столько же, сколько у ответившего
+    for abandoned_model, seconds in abandoned:
+        lost = {"input_tokens": usage.get("input_tokens", 0)}
+        router.record(route, abandoned_model, seconds, lost)
+        metrics.record_usage(lost)
+        tokens += lost["input_tokens"]
+    if uid is not None:
+        token_budget.add(uid, tokens)
+    return response, model
+
+
+async def handle_tool_calls(
+    tool_calls: list,
+    message: Message,
+    tool_cache: dict[tuple[str, str], asyncio.Future] | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Обрабатывает все tool_calls и возвращает список сообщений с результатами выполнения инструментов.
+    Независимые инструменты выполняются одновременно, помеченные `run_serially` - по одному
+    в том месте, где их вызвала модель: вызовы до них завершаются раньше, вызовы после - позже.
+    Результаты идут в том же порядке, что и tool_calls.
+    `tool_cache` - результаты инструментов с `cacheable` за текущий ход.
+    """
+    calls = []  # Список (инструмент, название, аргументы) в исходном порядке
     should_terminate = False  # Флаг, который показывает, нужно ли завершить генерацию ответа после выполнения инструмента
 
     for tool_call in tool_calls:  # Проходимся по всем инструментам
         tool_name = tool_call.get("function", {}).get("name")
-        tool_args = json.loads(tool_call.get("function", {}).get("arguments", []))
+        tool_args = codec.loads(tool_call.get("function", {}).get("arguments", []))
 
         if tool := tool_objects.get(tool_name):  # Если инструмент существует
-            logger.debug(
-                "Executing tool: {} with arguments: {}", tool_name, tool_args
-            )  # Логируем информацию
-            result = await execute_tool(
-                tool, tool_args, message
-            )  # Выполняем инструмент
-            temp_tool_messages.append(
-                {
-                    "role": "function",
-                    "content": json.dumps(result, ensure_ascii=False),
-                    "name": tool_name,
-                }
-            )  # Добавляем результат во временный список
+            calls.append((tool, tool_name, tool_args))
             if getattr(
                 tool, "_terminate_after_answer", False
             ):  # Если нужно завершить генерацию ответа после выполнения инструмента
                 should_terminate = True  # Устанавливаем флаг
 
+    results: list[Any] = [None] * len(calls)
+    group: list[int] = []  # Независимые инструменты после последнего serial-инструмента
+
+    async def run_group() -> None:
+        group_results = await asyncio.gather(
+            *(execute_tool_call(*calls[i], message, tool_cache) for i in group)
+        )
+        for i, result in zip(group, group_results):
+            results[i] = result
+        group.clear()
+
+    # Инструменты с `run_serially` - барьеры в порядке модели: сначала одновременно все независимые
+    # вызовы перед ним, затем он сам, затем следующая группа (чтение после записи видит запись)
+    for i, (tool, *_) in enumerate(calls):
+        if not getattr(tool, "_run_serially", False):
+            group.append(i)
+            continue
+        await run_group()
+        results[i] = await execute_tool_call(*calls[i], message, tool_cache)
+    await run_group()
+
+    contents = await asyncio.gather(
+        *(encode_tool_result(tool_name, result) for (_, tool_name, _), result in zip(calls, results))
+    )  # Компактно и в пределах бюджета токенов
+    temp_tool_messages = [
+        {
+            "role": "function",
+            "content": content,
+            "name": tool_name,
+        }
+        for (_, tool_name, _), content in zip(calls, contents)
+    ]  # Сообщения с результатами в исходном порядке
+
     return (
         temp_tool_messages,
         should_terminate,
     )  # Возвращаем список сообщений с результатами инструментов и флаг завершения
 
 
+async def execute_tool_call(
+    tool: Callable,
+    tool_name: str,
+    tool_args: dict,
+    message: Message,
+    tool_cache: dict[tuple[str, str], asyncio.Future] | None = None,
+) -> Any:
+    """
+    Выполняет один вызов инструмента с ограничением по времени.
+    Повторный вызов read-only инструмента с теми же аргументами берётся из `tool_cache`.
+    После любого другого инструмента (например, create_record) кэш хода сбрасывается:
+    он мог изменить данные, которые вернули прежние вызовы.
+    """
+    if tool_cache is None:
+        return await run_tool_call(tool, tool_name, tool_args, message)
+    if not getattr(tool, "_cacheable", False):
+        try:
+            return await run_tool_call(tool, tool_name, tool_args, message)
+        finally:  # Запись могла пройти и при ошибке
+            tool_cache.clear()
+
+    key = (tool_name, codec.dumps(tool_args, sort_keys=True))
+    if (cached := tool_cache.get(key)) is None:
+        # Одинаковые вызовы, которые выполняются одновременно, ждут один и тот же результат
+        cached = tool_cache[key] = asyncio.ensure_future(
+            run_tool_call(tool, tool_name, tool_args, message)
+        )
+    else:
+        logger.debug("Tool {} result is taken from the turn cache", tool_name)
+    return await asyncio.shield(cached)
+
+
+async def run_tool_call(
+    tool: Callable, tool_name: str, tool_args: dict, message: Message
+) -> Any:
+    """Выполняет один вызов инструмента с ограничением по времени."""
+    logger.debug(
+        "Executing tool: {} with arguments: {}", tool_name, tool_args
+    )  # Логируем информацию
+    try:
+        with metrics.span("tool", tool=tool_name):
+            return await asyncio.wait_for(
+                execute_tool(tool, tool_args, message), timeout=TOOL_TIMEOUT
+            )
+    except asyncio.TimeoutError:
+        logger.error("Tool {} timed out after {} seconds", tool_name, TOOL_TIMEOUT)
+        metrics.inc("tool_timeouts_total", tool=tool_name)
+        return {"error": f"Tool {tool_name} timed out, try again later."}
+
+
 async def execute_tool(tool: Callable, tool_args: dict, message: Any = None) -> Any:
     """Выполняет указанный инструмент с переданными аргументами."""
     signature = inspect.signature(tool)  # Получаем сигнатуру инструмента
@@ -129,7 +375,12 @@ async def execute_tool(tool: Callable, tool_args: dict, message: Any = None) ->
     )  # Выполняем инструмент и возвращаем результат
 
 
-async def save_chat_history(chat_history: ChatHistory, messages: dict) -> None:
-    """Сохраняет все сообщения в истории чата."""
-    chat_history.data = messages  # Добавляем сообщения
-    await chat_history.save()  # Сохраняем историю чата
+async def save_chat_history(chat_history: ChatHistory, messages: list[dict]) -> None:
+    """Дописывает новые сообщения хода в конец истории чата."""
+    with metrics.span("save_chat_history"):
+        if SESSION_WRITE_BEHIND:  # Сообщения запишутся в базу общей пачкой
+            queue_messages(chat_history, messages)
+            return
+
+        await append_messages(chat_history, messages)  # Старые сообщения не перезаписываются
+        await after_write(chat_history)
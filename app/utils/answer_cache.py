@@ -0,0 +1,217 @@
+import random
+import re
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from mubble import logger
+
+from app.config import (
+    FAQ_CACHE_MIN_WORDS,
+    FAQ_CACHE_SIZE,
+    FAQ_CACHE_THRESHOLD,
+)
+from app.utils.catalog import catalog
+
+# Украинское и русское написание одних и тех же слов приводится к одному виду
+TRANSLIT = str.maketrans(
+    {
+        "і": "и",
+        "ї": "и",
+        "ы": "и",
+        "є": "е",
+        "э": "е",
+        "ё": "е",
+        "ґ": "г",
+        "ъ": "",
+        "ь": "",
+        "'": "",
+        "’": "",
+        "ʼ": "",
+    }
+)
+WORD_RE = re.compile(r"\w+")
+
+NUM_HASHES = 32  # Длина MinHash-подписи
+BANDS = 8  # Подпись делится на полосы, совпадение любой полосы - кандидат на проверку
+ROWS = NUM_HASHES // BANDS
+PRIME = (1 << 61) - 1
+# Параметры хэш-функций фиксированы, чтобы подписи не зависели от запуска
+_rng = random.Random(0)
+_PERMUTATIONS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(NUM_HASHES)]
+
+
+def normalize(text: str) -> list[str]:
+    """Приводит текст к списку слов: нижний регистр, одно написание для украинского и русского."""
+    return WORD_RE.findall(text.casefold().translate(TRANSLIT))
+
+
+def fingerprint(words: list[str]) -> str:
+    """Отпечаток по набору слов: порядок и повторы слов не важны."""
+    return " ".join(sorted(set(words)))
+
+
+def shingles(fingerprint: str, size: int = 3) -> frozenset[str]:
+    """Символьные n-граммы отпечатка: устойчивы к опечаткам и окончаниям."""
+    if len(fingerprint) <= size:
+        return frozenset((fingerprint,))
+    return frozenset(fingerprint[i : i + size] for i in range(len(fingerprint) - size + 1))
+
+
+def minhash(grams: frozenset[str]) -> tuple[int, ...]:
+    hashes = [zlib.crc32(gram.encode("UTF-8")) for gram in grams]
+    return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def _bands(signature: tuple[int, ...]) -> list[tuple[int, tuple[int, ...]]]:
+    return [(i, signature[i * ROWS : (i + 1) * ROWS]) for i in range(BANDS)]
+
+
+def jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+# Слова, после которых ответ зависит от самого пользователя (его записи, его данные)
+PERSONAL_WORDS = frozenset(
+    normalize(
+        "я мне меня мой моя моё мою мои моих мені мене мій моє мої моїх "
+        "запиши запишите запишіть записать записатись записаться "
+        "отмени отмените отменить скасуй скасуйте скасувати перенеси перенесите"
+    )
+)
+
+
+def needs_personal_data(words: list[str]) -> bool:
+    """Ход про самого пользователя (номер, дата, его запись) - такой ответ нельзя брать из кэша."""
+    return any(word.isdigit() or word in PERSONAL_WORDS for word in words)
+
+
+@dataclass(slots=True)
+class CachedAnswer:
+    fingerprint: str
+    grams: frozenset[str]
+    bands: list[tuple[int, tuple[int, ...]]]
+    answer: str
+
+
+class AnswerCache:
+    """
+    Кэш ответов модели на частые вопросы (цены, мастера, время работы).
+
+    Вопросы сравниваются после нормализации: сначала точное совпадение набора слов,
+    затем похожие по MinHash-индексу (LSH по полосам подписи) с проверкой сходства
+    по n-граммам не ниже `threshold`. Все ответы привязаны к версии каталога:
+    изменение Service/Master очищает кэш.
+    """
+
+    def __init__(
+        self,
+        max_size: int = FAQ_CACHE_SIZE,
+        threshold: float = FAQ_CACHE_THRESHOLD,
+        min_words: int = FAQ_CACHE_MIN_WORDS,
+    ):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.min_words = min_words
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._version = catalog.version
+        self._answers: OrderedDict[str, CachedAnswer] = OrderedDict()
+        self._bands: dict[tuple[int, tuple[int, ...]], set[str]] = {}
+
+    def _words(self, text: str) -> list[str] | None:
+        """Слова вопроса или None, если вопрос нельзя брать из кэша и класть в него."""
+        words = normalize(text)
+        if len(set(words)) < self.min_words or needs_personal_data(words):
+            return None
+        return words
+
+    def _check_version(self) -> None:
+        if self._version != catalog.version:  # Каталог изменился - старые ответы могут врать
+            self.clear()
+            self._version = catalog.version
+
+    def lookup(self, text: str) -> str | None:
+        """Возвращает сохранённый ответ на такой же или похожий вопрос."""
+        self._check_version()
+        if (words := self._words(text)) is None:
+            self.bypassed += 1
+            return None
+
+        key = fingerprint(words)
+        entry = self._answers.get(key)
+        if entry is None:
+            grams = shingles(key)
+            signature = minhash(grams)
+            candidates = set()
+            for band in _bands(signature):
+                candidates |= self._bands.get(band, set())
+            scored = [
+                (jaccard(grams, self._answers[candidate].grams), candidate)
+                for candidate in candidates
+            ]
+            score, best = max(scored, default=(0.0, None))
+            if best is not None and score >= self.threshold:
+                entry = self._answers[best]
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._answers.move_to_end(entry.fingerprint)
+        logger.debug("Answer for {!r} is taken from the answer cache", text)
+        return entry.answer
+
+    def store(self, text: str, answer: str) -> None:
+        """Сохраняет ответ модели на вопрос."""
+        self._check_version()
+        if (words := self._words(text)) is None:
+            return
+
+        key = fingerprint(words)
+        self._remove(key)
+        grams = shingles(key)
+        entry = CachedAnswer(key, grams, _bands(minhash(grams)), answer)
+        self._answers[key] = entry
+        for band in entry.bands:
+            self._bands.setdefault(band, set()).add(key)
+
+        if len(self._answers) > self.max_size:
+            self._remove(next(iter(self._answers)))  # Выкидываем самый старый ответ
+
+    def clear(self) -> None:
+        self._answers.clear()
+        self._bands.clear()
+
+    def _remove(self, key: str) -> None:
+        if (entry := self._answers.pop(key, None)) is None:
+            return
+        for band in entry.bands:
+            keys = self._bands[band]
+            keys.discard(key)
+            if not keys:
+                del self._bands[band]
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._answers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Общий кэш ответов для всего бота
+answer_cache = AnswerCache()
+
+
+__all__ = (
+    "AnswerCache",
+    "answer_cache",
+    "fingerprint",
+    "needs_personal_data",
+    "normalize",
+)
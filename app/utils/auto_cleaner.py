@@ -1,78 +1,186 @@
+from dataclasses import dataclass, replace
 from typing import Any
 from mubble import logger
-import tiktoken
-import json
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 
-from app.config import LLM_MODEL, MAX_MESSAGES, MAX_TOKENS
+from app.config import HISTORY_BLOCK, MAX_FUNCTION_MESSAGES, MAX_MESSAGES, MAX_TOKENS
 from app.database.chat_history import ChatHistory
+from app.database.chat_message import SUMMARY_SEQ, ChatMessage
+from app.llm.prompts import resolve_prompt
+from app.llm.summarizer import parse_summary, render_summary, update_summary
+from app.utils.tokens import count_tokens
 
 
-async def clean_chat_history(chat_history: ChatHistory):
-    """
-    Автоматически удаляет старые сообщения из истории чата, если они превышают лимит по количеству сообщений.
+# Роли сообщений с результатами инструментов
+TOOL_ROLES = ("function", "tool")
 
-    * `chat_history`: Объект ChatHistory, хранящий историю чата.
+
+@dataclass(frozen=True, slots=True)
+class TrimPolicy:
+    """
+    Лимиты истории чата. Первое сообщение (системный промпт и сводка) никогда не удаляется.
+
+    * `max_messages`: Максимальное количество сообщений в истории чата (вместе с промптом).
+    * `max_tokens`: Максимальное количество токенов в истории чата (вместе с промптом).
+    * `max_function_messages`: Сколько последних результатов инструментов оставлять (None - без лимита).
+    * `block`: Запас в сообщениях. История урезается, только когда превышает лимиты,
+      и сразу на `block` сообщений ниже них, чтобы начало истории (и кэш промптов провайдера)
+      менялось раз в несколько ходов, а не каждый ход. 0 - урезать ровно до лимитов.
     """
-    if len(chat_history.data) > MAX_MESSAGES:
-        for _ in range(len(chat_history.data) - MAX_MESSAGES):
-            try:
-                chat_history.data.pop(1)
-            except Exception as e:
-                logger.error("Failed to delete old messages from chat history.", e)
-        await chat_history.save()
-
-        logger.debug(
-            "Old messages were deleted from chat history to meet the messages limit. "
+
+    max_messages: int = MAX_MESSAGES
+    max_tokens: int = MAX_TOKENS
+    max_function_messages: int | None = MAX_FUNCTION_MESSAGES
+    block: int = HISTORY_BLOCK
+
+    def high_water(self) -> "TrimPolicy":
+        """Лимиты, при превышении которых история урезается (результатам инструментов - запас)."""
+        if self.max_function_messages is None:
+            return self
+        return replace(self, max_function_messages=self.max_function_messages + self.block)
+
+    def low_water(self) -> "TrimPolicy":
+        """Лимиты, до которых история урезается."""
+        max_messages = max(self.max_messages - self.block, 1)
+        return replace(
+            self,
+            max_messages=max_messages,
+            max_tokens=self.max_tokens * max_messages // self.max_messages,
         )
 
 
-async def clean_chat_history_cool(chat_history: ChatHistory):
+DEFAULT_POLICY = TrimPolicy()
+
+
+async def clean_chat_history(
+    chat_history: ChatHistory, policy: TrimPolicy = DEFAULT_POLICY
+) -> None:
+    """
+    Удаляет старые сообщения истории чата по политике `policy`.
+    Удаляемые сообщения сворачиваются в сводку (строка с seq = SUMMARY_SEQ), которая идёт
+    сразу после системного промпта, поэтому имя, телефон и записи клиента не теряются.
+    Для плана читаются только роли и счётчики токенов, содержимое - только у удаляемых сообщений.
+
+    * `chat_history`: Объект ChatHistory, хранящий историю чата.
+    """
     # ВАЖНО!!!! ЭТА ШТУКА ПРОСТО ОПТИМИЗАТОР, ОНА СЧИТАЕТ ТОКЕНЫ С ЗАПАСОМ СПЕЦИАЛЬНО!!!
     # НА САМОМ ДЕЛЕ GPT-модели ЖРУТ НЕ ТАК МНОГО ТОКЕНОВ, КАК ТУТ НАПИСАНО!!! ОНИ ЖРУТ В РАЗ 10-20 МЕНЬШЕ!!!!!
-    # Не удаляем первое сообщение с ролью "system" (промпт)
-    if not chat_history.data or len(chat_history.data) <= 1:
+    rows = (
+        await ChatMessage.filter(chat_history_id=chat_history.id)
+        .order_by("seq")
+        .values_list("seq", "role", "tool_calls", "tokens")
+    )
+    summary_tokens = 0
+    if rows and rows[0][0] == SUMMARY_SEQ:  # Сводка закреплена, в план не входит
+        summary_tokens = rows.pop(0)[3]
+    if not rows:
         return
 
-    # Находим все сообщения с ролью "function"
-    function_messages_indices = [
-        i for i, msg in enumerate(chat_history.data) if msg["role"] == "function"
-    ]
-
-    # Оставляем последние три сообщения с ролью "function"
-    if len(function_messages_indices) > 3:
-        indices_to_delete = function_messages_indices[:-3]
-        # Удаляем лишние сообщения с конца, чтобы не нарушать индексы
-        for index in sorted(indices_to_delete, reverse=True):
-            del chat_history.data[index]
-
-    # Подсчет общего количества токенов в истории чата
-    total_tokens = 0
-    for message in chat_history.data:
-        total_tokens += count_tokens(message)
-
-    # Удаляем самые старые сообщения (кроме первого), пока не уложимся в лимит токенов
-    current_index = 1  # начинаем со второго сообщения
-    while total_tokens >= MAX_TOKENS and current_index < len(chat_history.data):
-        message = chat_history.data[current_index]
-        total_tokens -= count_tokens(message)
-        del chat_history.data[current_index]
-        await chat_history.save()
-
-
-def count_tokens(message: dict[str, Any], model_name=LLM_MODEL):
-    encoding = tiktoken.encoding_for_model(model_name)
-
-    # Проверяем тип контента и сериализуем его в строку, если это dict или list
-    content = message["content"]
-    if isinstance(content, (dict, list)):
-        content = json.dumps(content)
-
-    # Кодируем роль и контент сообщения
-    role_tokens = encoding.encode(message["role"])
-    content_tokens = encoding.encode(content)
-
-    # Возвращаем общее количество токенов для этого сообщения
-    return len(role_tokens) + len(content_tokens)
+    # Первое сообщение - системный промпт по ссылке (вместе со сводкой), оно учитывается в лимитах, но не удаляется
+    prompt = resolve_prompt(chat_history.prompt, chat_history.prompt_version)
+    prompt_tokens = count_tokens({"role": "system", "content": prompt.content}) + summary_tokens
+    rows = [(None, "system", None, prompt_tokens)] + rows
+
+    messages = [{"role": role, "tool_calls": tool_calls} for _, role, tool_calls, _ in rows]
+    token_counts = [tokens for *_, tokens in rows]
+    kept = set(plan_trim(messages, token_counts, policy))
+    if len(kept) == len(rows):
+        return
+
+    removed = [rows[i][0] for i in range(len(rows)) if i not in kept]
+    removed_tokens = sum(token_counts[i] for i in range(len(rows)) if i not in kept)
+
+    # Сводка считается до транзакции: суммаризатор может ходить в модель
+    evicted = await ChatMessage.filter(
+        chat_history_id=chat_history.id, seq__in=[SUMMARY_SEQ, *removed]
+    ).order_by("seq")
+    previous = None
+    if evicted and evicted[0].seq == SUMMARY_SEQ:
+        previous = parse_summary(evicted.pop(0).content)
+    summary = await update_summary(previous, [message.to_dict() for message in evicted])
+    summary_message = {"role": "system", "content": render_summary(summary)}
+    new_summary_tokens = count_tokens(summary_message)
+
+    delta = new_summary_tokens - summary_tokens - removed_tokens
+    async with in_transaction():
+        await ChatMessage.filter(
+            chat_history_id=chat_history.id, seq__in=[SUMMARY_SEQ, *removed]
+        ).delete()
+        await ChatMessage.from_dict(
+            chat_history.id, SUMMARY_SEQ, summary_message, new_summary_tokens
+        ).save()
+        await ChatHistory.filter(id=chat_history.id).update(
+            total_tokens=F("total_tokens") + delta
+        )
+    chat_history.total_tokens += delta
+
+    logger.debug(
+        "{} old messages of chat history {} were folded into its summary", len(removed), chat_history.id
+    )
+
+
+def plan_trim(
+    messages: list[dict[str, Any]],
+    token_counts: list[int],
+    policy: TrimPolicy = DEFAULT_POLICY,
+) -> list[int]:
+    """
+    Возвращает индексы сообщений, которые нужно оставить (по возрастанию).
+
+    Если история укладывается в `policy.high_water()`, она остаётся как есть,
+    иначе урезается до `policy.low_water()`.
+    """
+    kept = _plan_trim(messages, token_counts, policy.high_water())
+    if len(kept) == len(messages) or policy.block <= 0:
+        return kept
+    return _plan_trim(messages, token_counts, policy.low_water())
+
+
+def _plan_trim(
+    messages: list[dict[str, Any]],
+    token_counts: list[int],
+    policy: TrimPolicy,
+) -> list[int]:
+    """
+    История проходится один раз с конца. Результаты инструментов всегда идут одним блоком
+    вместе с сообщением ассистента, которое их вызвало, поэтому пары вызов/ответ не разрываются.
+    """
+    tokens_left = policy.max_tokens - token_counts[0]
+    messages_left = policy.max_messages - 1
+    function_messages = 0
+    kept: list[int] = []
+
+    end = len(messages) - 1
+    while end >= 1:
+        # Находим начало блока: одно сообщение или результаты инструментов вместе с вызовом
+        start = end
+        while start >= 1 and messages[start]["role"] in TOOL_ROLES:
+            start -= 1
+        is_tool_block = start < end
+        if is_tool_block and not (start >= 1 and messages[start].get("tool_calls")):
+            start += 1  # Вызов не сохранён в истории, блок - только результаты
+
+        block_tokens = sum(token_counts[start : end + 1])
+        block_size = end - start + 1
+
+        if is_tool_block and policy.max_function_messages is not None:
+            if function_messages >= policy.max_function_messages:
+                end = start - 1  # Старые результаты инструментов выкидываем, идём дальше
+                continue
+            function_messages += block_size
+
+        if block_tokens >= tokens_left or block_size > messages_left:
+            break  # Всё, что старше этого блока, не помещается в лимиты
+
+        tokens_left -= block_tokens
+        messages_left -= block_size
+        kept.extend(range(end, start - 1, -1))
+        end = start - 1
+
+    kept.append(0)  # Системный промпт
+    kept.reverse()
+    return kept
 
 
 # Функция для подсчета токенов в сообщении тупая для дебилов
@@ -0,0 +1,234 @@
+import asyncio
+from bisect import bisect_left, insort
+from datetime import date, time, timedelta
+from typing import Any, NamedTuple
+
+from mubble import logger
+from tortoise import Tortoise
+from tortoise.exceptions import IntegrityError, OperationalError
+from tortoise.signals import post_delete, post_save
+
+from app.config import FREE_SLOTS_LIMIT
+from app.database.slot import Slot
+from app.utils.catalog import catalog
+
+
+# Индексы из Slot.Meta для таблиц, созданных до их появления (generate_schemas их не добавит)
+SLOT_INDEXES = {
+    ("status", "date", "time"): ("idx_slot_status_date_time", False),
+    ("master_id", "date", "time"): ("uid_slot_master_date_time", True),
+}
+
+
+# Дубликаты слотов (мастер, дата, время), которые успел создать прежний get_or_create.
+# Остаётся слот с записью клиента, а если записей нет - слот с меньшим id.
+# Слоты с записями не удаляются никогда: если их два, уникальный индекс не создаётся.
+DEDUPLICATE_SLOTS_SQL = """DELETE FROM "slot" AS s
+WHERE NOT EXISTS (SELECT 1 FROM "appointment" AS a WHERE a."slot_id" = s."id")
+  AND EXISTS (
+    SELECT 1 FROM "slot" AS o
+    WHERE o."master_id" = s."master_id" AND o."date" = s."date" AND o."time" = s."time"
+      AND o."id" <> s."id"
+      AND (o."id" < s."id" OR EXISTS (SELECT 1 FROM "appointment" AS b WHERE b."slot_id" = o."id"))
+  )
+"""
+
+
+# Свободный слот в индексе: сортируется по дате и времени
+class FreeSlot(NamedTuple):
+    date: date
+    time: time
+    id: int
+    service_id: int
+    master_id: int
+
+
+class AvailabilityIndex:
+    """
+    Свободные слоты в памяти, по отсортированному списку на каждого мастера.
+
+    Индекс строится один раз (`rebuild`), дальше бронирование и отмена обновляют его
+    точечно: сигналы Tortoise на сохранение/удаление Slot или явные `book`/`release`.
+    Пока индекс не построен, поиск идёт одним SQL-запросом.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._lock = asyncio.Lock()
+        self._by_master: dict[int, list[FreeSlot]] = {}
+        self._slots: dict[int, FreeSlot] = {}  # ID слота -> слот, для быстрого удаления
+
+    async def rebuild(self) -> None:
+        """Загружает все будущие свободные слоты из базы."""
+        async with self._lock:
+            rows = await Slot.filter(status="available", date__gte=date.today()).values_list(
+                "date", "time", "id", "service_id", "master_id"
+            )
+            self._by_master.clear()
+            self._slots.clear()
+            for row in sorted(FreeSlot(*row) for row in rows):
+                self._slots[row.id] = row
+                self._by_master.setdefault(row.master_id, []).append(row)
+            self.ready = True
+        logger.info("Availability index built: {} free slots", len(self._slots))
+
+    def release(self, slot: Slot) -> None:
+        """Добавляет слот в индекс (новый свободный слот или отмена записи)."""
+        if not self.ready:
+            return
+        self.book(slot)  # Если слот уже был в индексе (например, изменилось время), убираем старую запись
+        row = FreeSlot(slot.date, slot.time, slot.id, slot.service_id, slot.master_id)
+        self._slots[row.id] = row
+        insort(self._by_master.setdefault(row.master_id, []), row)
+
+    def book(self, slot: Slot) -> None:
+        """Убирает слот из индекса (слот забронирован или удалён)."""
+        if (row := self._slots.pop(slot.id, None)) is None:
+            return
+        slots = self._by_master[row.master_id]
+        del slots[bisect_left(slots, row)]
+
+    async def find(
+        self,
+        min_duration: int,
+        start: date,
+        end: date,
+        master_id: int | None = None,
+        service_id: int | None = None,
+        limit: int = FREE_SLOTS_LIMIT,
+        offset: int = 0,
+    ) -> dict[str, Any]:
+        """
+        Ищет свободные слоты и возвращает не больше `limit` штук, начиная с `offset`.
+        """
+        services = {service["id"]: service for service in await catalog.services()}
+        staff = {master["id"]: master for master in await catalog.staff()}
+
+        if self.ready:
+            rows = self._find_in_memory(min_duration, start, end, master_id, service_id, services)
+            total = len(rows)
+            rows = rows[offset : offset + limit]
+        else:
+            query = Slot.filter(
+                status="available",
+                date__gte=start,
+                date__lte=end,
+                service__duration__gte=min_duration,  # Фильтр по длительности - в том же SQL-запросе
+            )
+            if master_id is not None:
+                query = query.filter(master_id=master_id)
+            if service_id is not None:
+                query = query.filter(service_id=service_id)
+            total = await query.count()
+            rows = [
+                FreeSlot(*row)
+                for row in await query.order_by("date", "time")
+                .offset(offset)
+                .limit(limit)
+                .values_list("date", "time", "id", "service_id", "master_id")
+            ]
+
+        slots = []
+        for row in rows:
+            service, master = services.get(row.service_id), staff.get(row.master_id)
+            if service is None or master is None:
+                continue
+            slots.append(
+                {
+                    "id": row.id,
+                    "date": row.date,  # В JSON дата и время пишутся кодеком (app/utils/codec.py)
+                    "time": row.time,
+                    "service": {
+                        "id": service["id"],
+                        "name": service["name"],
+                        "duration": service["duration"],
+                        "price": service["price"],
+                    },
+                    "master": {
+                        "staff_id": master["id"],
+                        "name": master["name"],
+                        "specialization": master["specialization"],
+                    },
+                }
+            )
+
+        result = {"slots": slots, "total": total}
+        if offset + limit < total:
+            result["next_offset"] = offset + limit  # Есть ещё слоты, их можно запросить отдельно
+        return result
+
+    def _find_in_memory(
+        self,
+        min_duration: int,
+        start: date,
+        end: date,
+        master_id: int | None,
+        service_id: int | None,
+        services: dict[int, dict[str, Any]],
+    ) -> list[FreeSlot]:
+        masters = [master_id] if master_id is not None else list(self._by_master)
+        rows = []
+        for master in masters:
+            slots = self._by_master.get(master, [])
+            # Слоты мастера отсортированы по дате, поэтому диапазон дат находим бинарным поиском
+            lo = bisect_left(slots, (start,))
+            # Верхняя граница - начало следующего дня: время слотов с tzinfo нельзя сравнивать с time.max
+            hi = bisect_left(slots, (end + timedelta(days=1),))
+            for row in slots[lo:hi]:
+                if service_id is not None and row.service_id != service_id:
+                    continue
+                service = services.get(row.service_id)
+                if service is not None and service["duration"] >= min_duration:
+                    rows.append(row)
+        rows.sort()
+        return rows
+
+
+# Общий индекс свободных слотов для всего бота
+availability = AvailabilityIndex()
+
+
+async def ensure_indexes() -> None:
+    """Создаёт индексы слотов в уже существующей базе, если их там ещё нет."""
+    connection = Tortoise.get_connection("default")
+    rows = await connection.execute_query_dict(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = 'slot'"
+    )
+    existing = {
+        tuple(column.strip().strip('"') for column in row["indexdef"].rsplit("(", 1)[1].rstrip(")").split(","))
+        for row in rows
+    }
+    for columns, (name, unique) in SLOT_INDEXES.items():
+        if columns in existing:
+            continue
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        if unique:
+            deleted, _ = await connection.execute_query(DEDUPLICATE_SLOTS_SQL)
+            if deleted:
+                logger.warning("Deleted {} duplicate slots before creating index {}", deleted, name)
+        try:
+            await connection.execute_script(
+                f'CREATE {"UNIQUE " if unique else ""}INDEX "{name}" ON "slot" ({quoted})'
+            )
+        except (IntegrityError, OperationalError) as e:
+            # Остались дубликаты с записями клиентов: их нужно разобрать вручную, бот работает и без индекса
+            logger.error("Failed to create index {}: {}", name, e)
+            continue
+        logger.info("Created index {}", name)
+
+
+# Любое сохранение слота через ORM обновляет индекс
+@post_save(Slot)
+async def on_slot_save(sender, instance, created, using_db, update_fields) -> None:
+    if instance.status == "available":
+        availability.release(instance)
+    else:
+        availability.book(instance)
+
+
+@post_delete(Slot)
+async def on_slot_delete(sender, instance, using_db) -> None:
+    availability.book(instance)
+
+
+__all__ = ("AvailabilityIndex", "FreeSlot", "availability", "ensure_indexes")
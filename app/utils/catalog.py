@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any
+
+from tortoise.signals import post_delete, post_save
+
+from app.database.master import Master
+from app.database.service import Service
+from app.utils import codec
+
+
+class PreSerialized(str):
+    """
+    Результат инструмента, который уже сериализован в JSON.
+    Такой результат записывается в сообщение как есть, без повторной сериализации.
+    """
+
+
+class Catalog:
+    """
+    Кэш каталога салона (услуги и мастера) вместе с готовым JSON.
+
+    Каталог меняется только когда администратор меняет Service или Master,
+    поэтому он загружается из базы один раз и сбрасывается сигналами Tortoise
+    или явным вызовом `invalidate` (например, после bulk-операций, которые сигналы не вызывают).
+    """
+
+    def __init__(self):
+        self.version = 0  # Растёт при каждом изменении каталога
+        self._lock = asyncio.Lock()
+        self._services: list[dict[str, Any]] | None = None
+        self._services_json: PreSerialized | None = None
+        self._staff: list[dict[str, Any]] | None = None
+        self._staff_json: PreSerialized | None = None
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш, следующий запрос загрузит каталог из базы заново."""
+        self.version += 1
+        self._services = self._services_json = None
+        self._staff = self._staff_json = None
+
+    async def services(self) -> list[dict[str, Any]]:
+        await self._load()
+        return self._services
+
+    async def services_json(self) -> PreSerialized:
+        await self._load()
+        return self._services_json
+
+    async def staff(self) -> list[dict[str, Any]]:
+        await self._load()
+        return self._staff
+
+    async def staff_json(self) -> PreSerialized:
+        await self._load()
+        return self._staff_json
+
+    async def _load(self) -> None:
+        if self._services is not None and self._staff is not None:
+            return
+
+        async with self._lock:  # Параллельные запросы ждут одну загрузку
+            while self._services is None or self._staff is None:
+                version = self.version
+                services = [
+                    {
+                        "id": service.id,
+                        "name": service.name,
+                        "description": service.description,
+                        "price": service.price,
+                        "duration": service.duration,  # Duration in minutes
+                    }
+                    for service in await Service.all()
+                ]
+                staff = [
+                    {
+                        "id": master.id,
+                        "name": master.name,
+                        "specialization": master.specialization,
+                    }
+                    for master in await Master.all()
+                ]
+                if version != self.version:  # Каталог изменился во время загрузки - грузим заново
+                    continue
+
+                self._services = services
+                self._services_json = PreSerialized(codec.dumps(services))
+                self._staff = staff
+                self._staff_json = PreSerialized(codec.dumps(staff))
+
+
+# Общий кэш каталога для всего бота
+catalog = Catalog()
+
+
+# Любое изменение услуги или мастера через ORM сбрасывает кэш
+@post_save(Service, Master)
+async def on_catalog_save(sender, instance, created, using_db, update_fields) -> None:
+    catalog.invalidate()
+
+
+@post_delete(Service, Master)
+async def on_catalog_delete(sender, instance, using_db) -> None:
+    catalog.invalidate()
+
+
+__all__ = ("Catalog", "PreSerialized", "catalog")
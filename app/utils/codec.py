@@ -0,0 +1,50 @@
+import json
+from datetime import date, time
+from typing import Any
+
+# Модели базы данных импортируют этот модуль, поэтому здесь нет app.config и тяжёлых импортов
+
+
+def _default(value: Any) -> Any:
+    """Типы, которых нет в JSON: дата и время пишутся в ISO 8601, как `isoformat()`."""
+    if isinstance(value, (date, time)):  # datetime - подкласс date
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+try:
+    import orjson as _orjson
+except ImportError:  # Необязательная зависимость (extra "speedups"): без неё работает стандартный json
+    _orjson = None
+
+BACKEND = "orjson" if _orjson is not None else "json"  # Какой модуль кодирует JSON в этом процессе
+
+if _orjson is not None:
+    # Ключи-числа (справочники refs результатов инструментов) пишутся строками, как в json.dumps.
+    # Дата и время идут через _default: TimeField Tortoise отдаёт время с tzinfo, а orjson такое не пишет
+    _OPTIONS = _orjson.OPT_NON_STR_KEYS | _orjson.OPT_PASSTHROUGH_DATETIME
+    _SORTED_OPTIONS = _OPTIONS | _orjson.OPT_SORT_KEYS
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+    _sorted_encoder = json.JSONEncoder(
+        ensure_ascii=False, separators=(",", ":"), default=_default, sort_keys=True
+    )
+
+
+def dumps(value: Any, sort_keys: bool = False) -> str:
+    """
+    JSON без пробелов после разделителей и без экранирования кириллицы.
+    `date`, `time` и `datetime` пишутся в ISO 8601, `sort_keys` - ключи по алфавиту.
+    """
+    if _orjson is not None:
+        return _orjson.dumps(value, default=_default, option=_SORTED_OPTIONS if sort_keys else _OPTIONS).decode()
+    return (_sorted_encoder if sort_keys else _encoder).encode(value)
+
+
+def loads(data: str | bytes) -> Any:
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+__all__ = ("BACKEND", "dumps", "loads")
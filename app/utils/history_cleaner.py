@@ -0,0 +1,62 @@
+import asyncio
+
+from mubble import logger
+
+from app.config import CLEANER_BATCH_SIZE, CLEANER_CONCURRENCY
+from app.database.chat_history import ChatHistory
+from app.utils.auto_cleaner import clean_chat_history
+from app.utils.metrics import metrics
+
+
+# Множество ID историй чата, которые изменились с момента последней очистки.
+# Очиститель проходится только по ним, а не по всей таблице ChatHistory,
+# поэтому истории неактивных пользователей больше никогда не читаются из базы.
+_dirty_histories: set[int] = set()
+
+
+def mark_dirty(chat_history: ChatHistory) -> None:
+    """
+    Помечает историю чата как изменённую, чтобы фоновый очиститель её проверил.
+    """
+    if chat_history.id is not None:
+        _dirty_histories.add(chat_history.id)
+
+
+def dirty_count() -> int:
+    """Количество историй чата, ожидающих очистки."""
+    return len(_dirty_histories)
+
+
+async def clean_dirty_histories() -> None:
+    """
+    Забирает из множества изменённые истории чата и очищает их
+    с ограниченным количеством одновременных задач.
+    """
+    if not _dirty_histories:
+        return
+
+    semaphore = asyncio.Semaphore(CLEANER_CONCURRENCY)
+    failed: set[int] = set()
+
+    async def clean(chat_history: ChatHistory) -> None:
+        async with semaphore:
+            try:
+                with metrics.span("cleaner"):
+                    await clean_chat_history(chat_history)
+            except Exception as e:
+                # Вернём историю в очередь, чтобы попробовать ещё раз в следующий проход
+                failed.add(chat_history.id)
+                logger.error("Failed to clean chat history {}: {}", chat_history.id, e)
+
+    while _dirty_histories:
+        # Забираем пачку ID, новые изменения во время очистки попадут в следующую пачку
+        batch = [
+            _dirty_histories.pop()
+            for _ in range(min(CLEANER_BATCH_SIZE, len(_dirty_histories)))
+        ]
+        chat_histories = await ChatHistory.filter(id__in=batch)
+        await asyncio.gather(*(clean(chat_history) for chat_history in chat_histories))
+
+        logger.debug("Cleaned {} dirty chat histories", len(chat_histories))
+
+    _dirty_histories.update(failed)
@@ -0,0 +1,264 @@
+import asyncio
+from typing import Any
+
+from mubble import logger
+from tortoise import Tortoise
+from tortoise.expressions import F, Q
+from tortoise.transactions import in_transaction
+
+from app.config import HISTORY_BLOCK, MAX_MESSAGES, TRIM_BEFORE_SAVE
+from app.database.chat_history import ChatHistory
+from app.database.chat_message import SUMMARY_SEQ, ChatMessage
+from app.llm.prompts import PromptType, resolve_prompt
+from app.utils.auto_cleaner import TOOL_ROLES, clean_chat_history
+from app.utils.history_cleaner import mark_dirty
+from app.utils.tokens import count_tokens_batch
+
+
+# Добавляет в существующую таблицу chathistory колонки, которых не было в старой схеме.
+# generate_schemas создаёт только новые таблицы, поэтому старые колонки меняем сами.
+MIGRATION_SQL = """
+ALTER TABLE "chathistory" ADD COLUMN IF NOT EXISTS "next_seq" INT NOT NULL DEFAULT 0;
+ALTER TABLE "chathistory" ADD COLUMN IF NOT EXISTS "total_tokens" INT NOT NULL DEFAULT 0;
+ALTER TABLE "chathistory" ADD COLUMN IF NOT EXISTS "prompt" VARCHAR(32) NOT NULL DEFAULT 'ENTRY';
+ALTER TABLE "chathistory" ADD COLUMN IF NOT EXISTS "prompt_version" VARCHAR(16);
+"""
+PROMPT_COLUMN_SQL = """
+SELECT 1 FROM information_schema.columns WHERE table_name = 'chathistory' AND column_name = 'prompt'
+"""
+MIGRATION_BATCH_SIZE = 100  # Сколько старых историй переносится за один запрос
+
+# Сообщения, которые ещё не записаны в базу (write-behind): {ID истории: (история, сообщения)}
+_pending: dict[int, tuple[ChatHistory, list[dict[str, Any]]]] = {}
+_flush_lock = asyncio.Lock()
+
+
+async def create_chat_history() -> ChatHistory:
+    """
+    Создаёт новую пустую историю чата. Системный промпт в ней не хранится,
+    он подставляется по ссылке при загрузке сообщений. История закрепляет текущую версию промпта:
+    новая версия entry.txt действует только для новых разговоров.
+    """
+    prompt = resolve_prompt(PromptType.ENTRY)
+    return await ChatHistory.create(prompt=prompt.type.name, prompt_version=prompt.version)
+
+
+def system_message(chat_history: ChatHistory) -> dict[str, Any]:
+    """Возвращает системный промпт, на который ссылается история чата."""
+    prompt = resolve_prompt(chat_history.prompt, chat_history.prompt_version)
+    return {"role": "system", "content": prompt.content}
+
+
+def has_messages(chat_history: ChatHistory) -> bool:
+    """Был ли у пользователя разговор: есть записанные или ещё не записанные сообщения (без чтения базы)."""
+    return chat_history.next_seq > 0 or chat_history.id in _pending
+
+
+async def load_messages(
+    chat_history: ChatHistory, limit: int = MAX_MESSAGES, block: int = HISTORY_BLOCK
+) -> list[dict[str, Any]]:
+    """
+    Возвращает системный промпт, сводку старых сообщений (если есть)
+    и не больше `limit` последних сообщений истории чата.
+
+    Начало окна сдвигается блоками по `block` сообщений, а не каждый ход: так начало запроса
+    к модели остаётся одинаковым несколько ходов подряд и попадает в кэш промптов провайдера.
+    Старые сообщения, которые ещё не удалил очиститель, не читаются.
+    """
+    # Снимок до запроса к базе: если flush_pending закоммитит очередь, пока идёт запрос,
+    # новые строки не попадут в окно (seq < next_seq), а сообщения останутся в снимке очереди
+    next_seq = chat_history.next_seq
+    pending = list(_pending.get(chat_history.id, (None, []))[1])
+    total = next_seq + len(pending)  # seq, который получит следующее сообщение
+    start_seq = max(0, -(-(total - limit) // max(block, 1)) * max(block, 1))
+
+    window = []
+    if next_seq > 0:
+        # Сводка старых сообщений (seq = SUMMARY_SEQ) читается тем же запросом, что и окно
+        window = (
+            await ChatMessage.filter(
+                Q(seq__gte=start_seq, seq__lt=next_seq) | Q(seq=SUMMARY_SEQ),
+                chat_history_id=chat_history.id,
+            )
+            .order_by("-seq")
+            .limit(limit + 1)
+        )
+        window.reverse()
+    summary = [message.to_dict() for message in window if message.seq == SUMMARY_SEQ]
+    # Ещё не записанные в базу сообщения - самые новые, они получат seq после next_seq
+    messages = [message.to_dict() for message in window if message.seq != SUMMARY_SEQ] + pending[
+        max(0, start_seq - next_seq) :
+    ]
+
+    # Окно не должно начинаться с результата инструмента без его вызова
+    start = 0
+    while start < len(messages) and messages[start]["role"] in TOOL_ROLES:
+        start += 1
+
+    return [system_message(chat_history)] + summary + messages[start:]
+
+
+async def append_messages(
+    chat_history: ChatHistory, messages: list[dict[str, Any]]
+) -> None:
+    """
+    Дописывает новые сообщения в конец истории чата.
+    Старые сообщения не перезаписываются: одна вставка пачкой и одно обновление счётчиков.
+    """
+    if not messages:
+        return
+
+    token_counts = await count_tokens_batch(messages)
+    async with in_transaction():
+        # Блокируем строку истории, чтобы параллельные ходы не получили одинаковые seq
+        locked = await ChatHistory.select_for_update().get(id=chat_history.id)
+        seq = locked.next_seq
+        await ChatMessage.bulk_create(
+            [
+                ChatMessage.from_dict(chat_history.id, seq + i, message, tokens)
+                for i, (message, tokens) in enumerate(zip(messages, token_counts))
+            ]
+        )
+        await ChatHistory.filter(id=chat_history.id).update(
+            next_seq=seq + len(messages),
+            total_tokens=F("total_tokens") + sum(token_counts),
+        )
+
+    chat_history.next_seq = seq + len(messages)
+    chat_history.total_tokens = locked.total_tokens + sum(token_counts)
+
+
+def queue_messages(chat_history: ChatHistory, messages: list[dict[str, Any]]) -> None:
+    """
+    Откладывает запись новых сообщений: они попадут в базу при следующем `flush_pending`.
+    До этого `load_messages` берёт их из памяти.
+    """
+    if messages:
+        _pending.setdefault(chat_history.id, (chat_history, []))[1].extend(messages)
+
+
+async def flush_pending() -> None:
+    """
+    Записывает все отложенные сообщения одной транзакцией:
+    одна блокировка историй, одна вставка пачкой и обновление счётчиков каждой истории.
+    Сообщения остаются в очереди (и их видит `load_messages`), пока транзакция не закоммичена;
+    при ошибке они просто остаются там до следующего раза.
+    """
+    async with _flush_lock:  # Два одновременных сброса записали бы одни и те же сообщения
+        if not _pending:
+            return
+
+        # Снимок очереди: сообщения, добавленные во время записи, остаются на следующий раз
+        batch = {
+            chat_history_id: (chat_history, list(pending))
+            for chat_history_id, (chat_history, pending) in _pending.items()
+        }
+        messages = [message for _, pending in batch.values() for message in pending]
+        token_counts = iter(await count_tokens_batch(messages))
+        async with in_transaction():
+            locked = {
+                chat_history.id: chat_history
+                for chat_history in await ChatHistory.filter(
+                    id__in=list(batch)
+                ).select_for_update()
+            }
+            rows, counters = [], {}
+            for chat_history_id, (_, pending) in batch.items():
+                seq = locked[chat_history_id].next_seq
+                tokens = [next(token_counts) for _ in pending]
+                rows.extend(
+                    ChatMessage.from_dict(chat_history_id, seq + i, message, count)
+                    for i, (message, count) in enumerate(zip(pending, tokens))
+                )
+                counters[chat_history_id] = (seq + len(pending), sum(tokens))
+
+            await ChatMessage.bulk_create(rows)
+            for chat_history_id, (next_seq, tokens) in counters.items():
+                await ChatHistory.filter(id=chat_history_id).update(
+                    next_seq=next_seq, total_tokens=F("total_tokens") + tokens
+                )
+
+        # Транзакция закоммичена: без await между ними убираем записанное из очереди и сдвигаем next_seq,
+        # чтобы load_messages видел каждое сообщение ровно один раз
+        for chat_history_id, (chat_history, pending) in batch.items():
+            queued = _pending[chat_history_id][1]
+            del queued[: len(pending)]
+            if not queued:
+                del _pending[chat_history_id]
+            chat_history.next_seq, tokens = counters[chat_history_id]
+            chat_history.total_tokens = locked[chat_history_id].total_tokens + tokens
+
+    for chat_history, _ in batch.values():
+        await after_write(chat_history)
+
+    logger.debug("Flushed {} messages of {} chat histories", len(rows), len(batch))
+
+
+async def after_write(chat_history: ChatHistory) -> None:
+    """Урезает историю сразу после записи или отдаёт её фоновому очистителю."""
+    if TRIM_BEFORE_SAVE:  # Урезаем историю сразу, фоновому очистителю она не понадобится
+        await clean_chat_history(chat_history)
+    else:
+        mark_dirty(chat_history)  # Фоновый очиститель проверит эту историю
+
+
+async def migrate_legacy_history(chat_history: ChatHistory) -> None:
+    """
+    Переносит историю чата из старого JSON-поля `data` в таблицу сообщений.
+    """
+    async with in_transaction():
+        if chat_history.next_seq == 0:  # Сообщения ещё не переносились
+            messages = chat_history.data or []
+            if messages and messages[0]["role"] == "system":
+                messages = messages[1:]  # Промпт теперь берётся из реестра промптов
+            await append_messages(chat_history, messages)
+        await ChatHistory.filter(id=chat_history.id).update(data=None)
+    chat_history.data = None
+
+
+async def migrate_legacy_histories() -> None:
+    """
+    Переносит все истории чата со старым форматом хранения в таблицу сообщений.
+    """
+    connection = Tortoise.get_connection("default")
+    # Если колонки prompt ещё нет, то промпт хранится первым сообщением каждой истории
+    _, prompt_column = await connection.execute_query(PROMPT_COLUMN_SQL)
+    await connection.execute_script(MIGRATION_SQL)
+    if not prompt_column:
+        await drop_stored_prompts()
+
+    migrated = 0
+    while chat_histories := await ChatHistory.filter(data__isnull=False).limit(
+        MIGRATION_BATCH_SIZE
+    ):
+        for chat_history in chat_histories:
+            await migrate_legacy_history(chat_history)
+        migrated += len(chat_histories)
+
+    if migrated:
+        logger.info("Migrated {} chat histories to message storage", migrated)
+
+
+async def drop_stored_prompts() -> None:
+    """
+    Удаляет копии системного промпта, которые раньше хранились первым сообщением каждой истории.
+    """
+    stored = await ChatMessage.filter(seq=0, role="system").values_list(
+        "chat_history_id", "tokens"
+    )
+    if not stored:
+        return
+
+    # Вычитаем токены промпта одним запросом на каждый размер промпта
+    by_tokens: dict[int, list[int]] = {}
+    for chat_history_id, tokens in stored:
+        by_tokens.setdefault(tokens, []).append(chat_history_id)
+
+    async with in_transaction():
+        await ChatMessage.filter(seq=0, role="system").delete()
+        for tokens, ids in by_tokens.items():
+            await ChatHistory.filter(id__in=ids).update(
+                total_tokens=F("total_tokens") - tokens
+            )
+
+    logger.info("Dropped stored system prompts from {} chat histories", len(stored))
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from mubble import API, Message, logger
+
+from app.config import (
+    MEDIA_CHUNK_SIZE,
+    MEDIA_MAX_FILE_SIZE,
+    MEDIA_QUEUE_SIZE,
+    MEDIA_SPOOL_BYTES,
+    MEDIA_SPOOL_DIR,
+    MEDIA_WORKERS,
+)
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+# Файл из сообщения: всё, что известно о нём без скачивания
+@dataclass(slots=True)
+class MediaFile:
+    file_id: str
+    file_unique_id: str  # Одинаковый для одного и того же файла у всех пользователей
+    file_size: int | None  # Telegram может не прислать размер
+
+
+def largest_photo(message: Message) -> MediaFile:
+    """Самый большой размер фото (последний в списке)."""
+    photo = message.photo.unwrap()[-1]
+    return MediaFile(photo.file_id, photo.file_unique_id, photo.file_size.unwrap_or_none())
+
+
+def voice_file(message: Message) -> MediaFile:
+    voice = message.voice.unwrap()
+    return MediaFile(voice.file_id, voice.file_unique_id, voice.file_size.unwrap_or_none())
+
+
+class MediaTooLarge(Exception):
+    """Файл больше MEDIA_MAX_FILE_SIZE (Bot API не отдаёт файлы больше 20 МБ)."""
+
+
+# Задача очереди: что скачать, что сделать с файлом и как сообщить об ошибке
+OnReady = Callable[[Path], Awaitable[None]]
+OnError = Callable[[Exception], Awaitable[None]]
+
+
+class MediaPipeline:
+    """
+    Скачивание медиа без хранения файлов в памяти.
+
+    * Файл пишется кусками по `chunk_size` в свою директорию процесса внутри `spool_dir`:
+      в памяти - один кусок на загрузку, другие процессы бота с тем же `spool_dir` её не трогают.
+    * Повторный файл (тот же `file_unique_id`) берётся из спула, одновременные загрузки
+      одного файла ждут одну загрузку. Спул ограничен `max_spool_bytes`, старые файлы удаляются.
+    * Обработка идёт в `workers` фоновых задачах из очереди на `queue_size` задач,
+      поэтому хендлер только ставит задачу и сразу возвращается. Если файл не скачался,
+      вызывается `on_error`, чтобы пользователь получил ответ.
+    """
+
+    def __init__(
+        self,
+        spool_dir: Path = MEDIA_SPOOL_DIR,
+        workers: int = MEDIA_WORKERS,
+        queue_size: int = MEDIA_QUEUE_SIZE,
+        chunk_size: int = MEDIA_CHUNK_SIZE,
+        max_spool_bytes: int = MEDIA_SPOOL_BYTES,
+        max_file_size: int = MEDIA_MAX_FILE_SIZE,
+    ):
+        self.spool_root = spool_dir
+        self.spool_dir: Path | None = None  # Директория этого процесса, создаётся при первой загрузке
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_spool_bytes = max_spool_bytes
+        self.max_file_size = max_file_size
+        self.hits = 0
+        self.downloads = 0
+        self.rejected = 0
+        self._queue: asyncio.Queue[tuple[API, MediaFile, OnReady, OnError | None]] = asyncio.Queue(queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self._files: OrderedDict[str, tuple[Path, int]] = OrderedDict()  # LRU: file_unique_id -> (путь, размер)
+        self._spool_bytes = 0
+        self._loading: dict[str, asyncio.Task[Path]] = {}
+        self._session: "aiohttp.ClientSession | None" = None
+
+    def submit(self, api: API, media: MediaFile, on_ready: OnReady, on_error: OnError | None = None) -> bool:
+        """Ставит файл в очередь на скачивание. False - очередь полна, файл не будет обработан."""
+        if not self._tasks:
+            self._start()
+        try:
+            self._queue.put_nowait((api, media, on_ready, on_error))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        return True
+
+    async def fetch(self, api: API, media: MediaFile) -> Path:
+        """Путь к файлу в спуле: из кэша по `file_unique_id` или после скачивания."""
+        if (cached := self._files.get(media.file_unique_id)) is not None and cached[0].exists():
+            self._files.move_to_end(media.file_unique_id)
+            self.hits += 1
+            return cached[0]
+
+        if (task := self._loading.get(media.file_unique_id)) is None:
+            task = self._loading[media.file_unique_id] = asyncio.ensure_future(self._download(api, media))
+            task.add_done_callback(lambda _: self._loading.pop(media.file_unique_id, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _start(self) -> None:
+        """Запускает воркеры при первой задаче (уже внутри цикла событий)."""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        while True:
+            api, media, on_ready, on_error = await self._queue.get()
+            try:
+                await on_ready(await self.fetch(api, media))
+            except Exception as e:
+                logger.error("Failed to process media {}: {!r}", media.file_unique_id, e)
+                if on_error is not None:
+                    try:
+                        await on_error(e)
+                    except Exception as reply_error:
+                        logger.error("Failed to report media error {}: {!r}", media.file_unique_id, reply_error)
+            finally:
+                self._queue.task_done()
+
+    def _spool(self) -> Path:
+        """Директория спула этого процесса (уникальная, поэтому очищать чужие файлы при запуске не нужно)."""
+        if self.spool_dir is None:
+            self.spool_root.mkdir(parents=True, exist_ok=True)
+            self.spool_dir = Path(tempfile.mkdtemp(dir=self.spool_root))
+        return self.spool_dir
+
+    async def _download(self, api: API, media: MediaFile) -> Path:
+        if media.file_size is not None and media.file_size > self.max_file_size:
+            raise MediaTooLarge(f"{media.file_size} bytes")
+
+        file_path = (await api.get_file(media.file_id)).unwrap().file_path.unwrap()
+        path = self._spool() / media.file_unique_id
+        partial = path.with_suffix(".part")  # Недокачанный файл никогда не попадает в кэш
+
+        size = 0
+        try:
+            async with self.session().get(api.request_file_url + file_path) as response:
+                response.raise_for_status()
+                with open(partial, "wb") as f:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        size += len(chunk)
+                        if size > self.max_file_size:
+                            raise MediaTooLarge(f"more than {self.max_file_size} bytes")
+                        f.write(chunk)  # Локальная запись куска в page cache - микросекунды, поток не нужен
+            os.replace(partial, path)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+
+        self.downloads += 1
+        self._remember(media.file_unique_id, path, size)
+        return path
+
+    def _remember(self, file_unique_id: str, path: Path, size: int) -> None:
+        if (old := self._files.pop(file_unique_id, None)) is not None:
+            self._spool_bytes -= old[1]
+        self._files[file_unique_id] = (path, size)
+        self._spool_bytes += size
+        while self._spool_bytes > self.max_spool_bytes and len(self._files) > 1:
+            _, (old_path, old_size) = self._files.popitem(last=False)  # Самый давний файл
+            old_path.unlink(missing_ok=True)
+            self._spool_bytes -= old_size
+
+    def session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            import aiohttp  # Зависимость mubble, нужна только для скачивания
+
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self) -> None:
+        """
+        Останавливает воркеры (незавершённые задачи отбрасываются), закрывает HTTP-сессию
+        и удаляет директорию спула этого процесса в потоке, не блокируя цикл событий.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._session is not None:
+            await self._session.close()
+        if self.spool_dir is not None:
+            await asyncio.to_thread(shutil.rmtree, self.spool_dir, ignore_errors=True)
+            self.spool_dir = None
+            self._files.clear()
+            self._spool_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "spool_files": len(self._files),
+            "spool_bytes": self._spool_bytes,
+            "downloads": self.downloads,
+            "hits": self.hits,
+            "rejected": self.rejected,
+        }
+
+
+# Общий конвейер медиа для всего бота
+media_pipeline = MediaPipeline()
+
+
+__all__ = (
+    "MediaFile",
+    "MediaPipeline",
+    "MediaTooLarge",
+    "largest_photo",
+    "media_pipeline",
+    "voice_file",
+)
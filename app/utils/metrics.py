@@ -0,0 +1,233 @@
+import asyncio
+import resource
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Any, Callable
+
+from mubble import logger
+
+from app.config import METRICS_BUCKETS, METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+PREFIX = "bot_"  # Префикс имён всех метрик
+ITERATION_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10)  # Корзины гистограммы итераций цикла инструментов
+
+# Пустой контекст для выключенных метрик: один объект на весь процесс, без выделения памяти на вызов
+_NOOP = nullcontext()
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: количество значений по верхним границам корзин, сумма и количество."""
+
+    __slots__ = ("bounds", "buckets", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """Замер одного этапа: `with metrics.span("llm"): ...` записывает длительность в гистограмму этапа."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Метрики бота в памяти процесса: длительности этапов хода, счётчики токенов и итераций.
+    Когда метрики выключены, `span` возвращает общий пустой контекст, а `observe` и `inc`
+    сразу возвращаются, поэтому на горячем пути остаётся одна проверка флага.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, buckets: tuple[float, ...] = METRICS_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.help: dict[str, str] = {}
+
+    def span(self, stage: str, **labels: str):
+        """Контекст, который записывает длительность блока в `bot_stage_seconds{stage=...}`."""
+        if not self.enabled:
+            return _NOOP
+        return Span(self._histogram("stage_seconds", (("stage", stage), *labels.items()), self.buckets))
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] | None = None, **labels: str) -> None:
+        """Добавляет значение в гистограмму `name`."""
+        if self.enabled:
+            self._histogram(name, tuple(labels.items()), buckets or self.buckets).observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Увеличивает счётчик `name`."""
+        if self.enabled:
+            key = (name, tuple(labels.items()))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, read: Callable[[], float], help: str = "") -> None:
+        """Регистрирует значение, которое считывается в момент запроса метрик (размер кэша и т.п.)."""
+        self.gauges[name] = read
+        if help:
+            self.help[name] = help
+
+    def record_usage(self, usage: dict[str, Any] | None) -> None:
+        """Счётчики токенов из `usage_metadata` ответа модели."""
+        if not self.enabled or not usage:
+            return
+        details = usage.get("input_token_details") or {}
+        self.inc("llm_tokens_total", usage.get("input_tokens", 0), type="input")
+        self.inc("llm_tokens_total", usage.get("output_tokens", 0), type="output")
+        self.inc("llm_tokens_total", details.get("cache_read", 0) or 0, type="cache_read")
+
+    def _histogram(self, name: str, labels: Labels, buckets: tuple[float, ...]) -> Histogram:
+        key = (name, labels)
+        if (histogram := self.histograms.get(key)) is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        return histogram
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        def header(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                if help := self.help.get(name):
+                    lines.append(f"# HELP {PREFIX}{name} {help}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip((*histogram.bounds, float("inf")), histogram.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else format_value(bound)
+                lines.append(f"{PREFIX}{name}_bucket{format_labels((*labels, ('le', le)))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, "counter")
+            lines.append(f"{PREFIX}{name}{format_labels(labels)} {format_value(value)}")
+
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:  # Одна сломанная метрика не должна ломать весь ответ
+                logger.error("Failed to read gauge {}: {}", name, e)
+                continue
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Обнуляет гистограммы и счётчики (значения gauge считываются заново при каждом запросе)."""
+        self.histograms.clear()
+        self.counters.clear()
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def process_gauges(target: Metrics) -> None:
+    """Ресурсы процесса: процессорное время и пиковая память."""
+    target.gauge(
+        "process_cpu_seconds",
+        lambda: sum(resource.getrusage(resource.RUSAGE_SELF)[:2]),
+        "User and system CPU time of the bot process",
+    )
+    target.gauge(
+        "process_max_rss_bytes",
+        lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,  # В Linux ru_maxrss в КБ
+        "Peak resident memory of the bot process",
+    )
+    target.gauge("asyncio_tasks", lambda: len(asyncio.all_tasks()), "Running asyncio tasks")
+
+
+# Общие метрики для всего бота
+metrics = Metrics()
+process_gauges(metrics)
+metrics.help.update(
+    {
+        "stage_seconds": "Duration of turn stages (middleware, llm, tool, save_chat_history, cleaner, flush_pending)",
+        "tool_iterations": "Model calls with tool results per turn",
+        "llm_tokens_total": "LLM tokens from usage_metadata",
+        "stream_ttfb_seconds": "Time until the first streamed tokens are shown to the user",
+    }
+)
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Минимальный HTTP: на GET /metrics отдаёт метрики, на всё остальное - 404."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (line := await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass  # Заголовки не нужны
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.Server | None:
+    """Запускает эндпоинт /metrics в процессе бота, если метрики включены."""
+    if not metrics.enabled:
+        return None
+    server = await asyncio.start_server(handle_request, host, port)
+    logger.info("Metrics are served on http://{}:{}/metrics", host, port)
+    return server
+
+
+__all__ = (
+    "Histogram",
+    "Metrics",
+    "Span",
+    "metrics",
+    "process_gauges",
+    "start_metrics_server",
+)
@@ -0,0 +1,100 @@
+from datetime import date, time, timedelta
+from pathlib import Path
+from typing import Any
+
+from mubble import logger
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from app.database.appointment import Appointment
+from app.database.master import Master
+from app.database.service import Service
+from app.database.slot import Slot
+from app.database.system import System
+from app.utils import codec
+from app.utils.catalog import catalog
+
+CURRENT_DIR = Path(__file__).parent
+FIXTURES_PATH = CURRENT_DIR / "fixtures.json"
+
+# Колонка версии фикстур для таблицы system, созданной до её появления
+MIGRATION_SQL = """
+ALTER TABLE "system" ADD COLUMN IF NOT EXISTS "fixtures_version" INT NOT NULL DEFAULT 0;
+"""
+
+
+def load_fixtures() -> dict[str, Any]:
+    """Читает демо-данные салона (услуги, мастера, слоты) из fixtures.json."""
+    with open(FIXTURES_PATH, encoding="UTF-8") as f:
+        return codec.loads(f.read())
+
+
+def without_id(fixture: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in fixture.items() if key != "id"}
+
+
+async def seed_demo_data() -> None:
+    """
+    Загружает демо-данные, если их версия в fixtures.json отличается от записанной в System.
+    Каталог салона (услуги, мастера, слоты) заменяется целиком, пользователи и истории чатов не трогаются.
+    Записи клиентов ссылаются на слоты и удалились бы вместе с ними, поэтому при наличии записей
+    демо-данные не загружаются (в базе с реальными клиентами версия фикстур не меняется).
+    """
+    connection = Tortoise.get_connection("default")
+    if connection.capabilities.dialect == "postgres":  # В SQLite (бенчмарки) таблицы всегда создаются заново
+        await connection.execute_script(MIGRATION_SQL)
+
+    fixtures = load_fixtures()
+    system = await System.get_or_none(id=1)
+    if system is not None and system.fixtures_version == fixtures["version"]:
+        logger.info("Demo data is up to date (version {})", fixtures["version"])
+        return
+
+    if appointments := await Appointment.all().count():
+        logger.warning(
+            "Demo data version {} is not loaded: the database has {} client appointments",
+            fixtures["version"],
+            appointments,
+        )
+        return
+
+    logger.info("Loading demo data version {}...", fixtures["version"])
+    today = date.today()
+    async with in_transaction():
+        # Старый демо-каталог заменяется целиком (записей клиентов нет, см. выше)
+        for model in (Slot, Service, Master):
+            await model.all().delete()
+
+        # id в фикстурах - это ключи для ссылок из слотов, в базе id выдаются автоматически
+        await Service.bulk_create(
+            [Service(**without_id(service)) for service in fixtures["services"]]
+        )
+        await Master.bulk_create(
+            [Master(**without_id(master)) for master in fixtures["masters"]]
+        )
+        # bulk_create не возвращает id, поэтому забираем их по названиям одним запросом на таблицу
+        service_ids = dict(await Service.all().values_list("name", "id"))
+        master_ids = dict(await Master.all().values_list("name", "id"))
+        services = {s["id"]: service_ids[s["name"]] for s in fixtures["services"]}
+        masters = {m["id"]: master_ids[m["name"]] for m in fixtures["masters"]}
+
+        await Slot.bulk_create(
+            [
+                Slot(
+                    date=today + timedelta(days=slot["day"]),
+                    time=time.fromisoformat(slot["time"]),
+                    status="available",
+                    service_id=services[slot["service"]],
+                    master_id=masters[slot["master"]],
+                )
+                for slot in fixtures["slots"]
+            ]
+        )
+
+        if system is None:
+            await System.create(id=1, fixtures_version=fixtures["version"])
+        else:
+            await System.filter(id=1).update(fixtures_version=fixtures["version"])
+
+    catalog.invalidate()  # bulk_create не вызывает сигналы, поэтому сбрасываем кэш сами
+    logger.info("Demo data loaded!")
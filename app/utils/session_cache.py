@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from tortoise.transactions import in_transaction
+
+from app.config import SESSION_CACHE_SIZE, SESSION_TTL
+from app.database.chat_history import ChatHistory
+from app.database.user import User
+from app.utils.history_store import create_chat_history
+
+
+# Сессия пользователя: сам пользователь и его история чата
+@dataclass(slots=True)
+class Session:
+    user: User
+    chat_history: ChatHistory
+    expires_at: float
+
+
+class SessionCache:
+    """
+    LRU-кэш сессий с временем жизни, ключ - Telegram ID пользователя.
+    Пока сессия в кэше, middleware не делает ни одного запроса к базе данных.
+    """
+
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE, ttl: float = SESSION_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._sessions: OrderedDict[int, Session] = OrderedDict()
+        # Загрузки, которые уже идут: параллельные сообщения одного пользователя ждут одну загрузку
+        self._loading: dict[int, asyncio.Task[Session]] = {}
+
+    async def get(self, uid: int, name: str) -> Session:
+        """
+        Возвращает сессию пользователя из кэша или загружает её из базы данных.
+        Новый пользователь регистрируется вместе с историей чата в одной транзакции.
+        """
+        session = self._sessions.get(uid)
+        if session is not None and session.expires_at > time.monotonic():
+            self._sessions.move_to_end(uid)
+            self.hits += 1
+            return session
+
+        self.misses += 1
+        if (task := self._loading.get(uid)) is None:
+            task = self._loading[uid] = asyncio.ensure_future(self._load(uid, name))
+            task.add_done_callback(lambda _: self._loading.pop(uid, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, uid: int, name: str) -> Session:
+        # Пользователь и его история чата - одним запросом
+        user = await User.filter(uid=uid).select_related("chat_history").first()
+        if user is None:
+            async with in_transaction():
+                chat_history = await create_chat_history()
+                user = await User.create(
+                    uid=uid, name=name, chat_history=chat_history, phone=None
+                )
+        elif (chat_history := user.chat_history) is None:
+            async with in_transaction():
+                chat_history = await create_chat_history()
+                user.chat_history = chat_history
+                await user.save(update_fields=["chat_history_id"])
+
+        session = Session(user, chat_history, time.monotonic() + self.ttl)
+        self._sessions[uid] = session
+        self._sessions.move_to_end(uid)
+        if len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)  # Выкидываем самую давнюю сессию
+        return session
+
+    def invalidate(self, uid: int) -> None:
+        """Удаляет сессию из кэша (например, после изменения пользователя в другом месте)."""
+        self._sessions.pop(uid, None)
+
+    def stats(self) -> dict[str, float]:
+        """Счётчики попаданий и промахов кэша."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Общий кэш сессий для всего бота
+sessions = SessionCache()
+
+
+__all__ = ("Session", "SessionCache", "sessions")
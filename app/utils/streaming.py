@@ -0,0 +1,103 @@
+import asyncio
+import time
+from typing import Callable
+
+from mubble import Message, logger
+
+from app.config import STREAM_EDIT_INTERVAL
+from app.utils.metrics import metrics
+
+
+class StreamingReply:
+    """
+    Ответ пользователю, который показывается по мере генерации.
+
+    Первое сообщение отправляется, как только пришли первые токены, дальше оно редактируется
+    не чаще раза в `interval` секунд (у Telegram есть лимит на редактирование сообщений).
+    Ход заканчивается `finish` (итоговый текст заменяет показанный) или `discard` (показанный текст удаляется).
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        clean: Callable[[str], str] = lambda text: text,
+        interval: float = STREAM_EDIT_INTERVAL,
+    ):
+        self.message = message
+        self.clean = clean  # Обработка текста перед отправкой
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self.first_token_at: float | None = None  # Когда пользователь увидел первые токены
+        self._message_id: int | None = None
+        self._sent_text = ""  # Текст, который сейчас показан пользователю
+        self._text = ""  # Последний полученный текст
+        self._last_edit = 0.0
+        self._task: asyncio.Task | None = None  # Отправка или редактирование, которое сейчас идёт
+
+    @property
+    def ttfb(self) -> float | None:
+        """Время до первых токенов в секундах."""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    async def update(self, text: str) -> None:
+        """Принимает весь уже сгенерированный текст. Не ждёт отправку, чтобы не тормозить стрим."""
+        self._text = self.clean(text)
+        if not self._text.strip() or (self._task is not None and not self._task.done()):
+            return
+        if self._message_id is not None and time.monotonic() - self._last_edit < self.interval:
+            return
+        self._task = asyncio.create_task(self._push(self._text))
+
+    async def finish(self, text: str) -> None:
+        """Показывает итоговый текст вместо уже показанного (или новым сообщением) и записывает задержки хода."""
+        if self._task is not None:
+            await self._task
+        await self._push(self.clean(text))
+        self._record()
+
+    async def discard(self) -> None:
+        """Удаляет уже показанный текст: ход закончился без ответа модели (его не будет или он уже отправлен)."""
+        if self._task is not None:
+            await self._task
+        if self._message_id is not None:
+            result = await self.message.ctx_api.delete_message(
+                chat_id=self.message.chat.id, message_id=self._message_id
+            )
+            if not result:
+                logger.error("Failed to delete streamed message: {}", result)
+            self._message_id = None
+            self._sent_text = ""
+        self._record()
+
+    def _record(self) -> None:
+        if self.ttfb is not None:
+            metrics.observe("stream_ttfb_seconds", self.ttfb)
+        logger.debug(
+            "Turn latency: ttfb={}s total={:.2f}s",
+            f"{self.ttfb:.2f}" if self.ttfb is not None else "-",
+            time.monotonic() - self.started_at,
+        )
+
+    async def _push(self, text: str) -> None:
+        if text == self._sent_text or not text.strip():
+            return
+
+        if self._message_id is None:  # Первые токены - отправляем новое сообщение
+            result = await self.message.answer(text)
+            if not result:
+                logger.error("Failed to send streamed message: {}", result)
+                return
+            self._message_id = result.unwrap().message_id
+            self.first_token_at = time.monotonic()
+        else:  # Дальше редактируем уже отправленное сообщение
+            result = await self.message.ctx_api.edit_message_text(
+                chat_id=self.message.chat.id, message_id=self._message_id, text=text
+            )
+            if not result:  # Например, незакрытый HTML-тег в середине ответа
+                logger.debug("Failed to edit streamed message: {}", result)
+                return
+
+        self._sent_text = text
+        self._last_edit = time.monotonic()
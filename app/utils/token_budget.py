@@ -0,0 +1,102 @@
+import asyncio
+from datetime import date
+
+from mubble import logger
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+
+from app.config import DAILY_TOKEN_BUDGET
+from app.database.token_usage import TokenUsage
+
+
+class TokenBudget:
+    """
+    Дневной бюджет токенов модели на пользователя.
+
+    Расход за сегодня держится в памяти: из базы он читается один раз за день на пользователя,
+    а новые токены записываются пачкой в `flush` (как отложенные сообщения истории чата).
+    """
+
+    def __init__(self, limit: int | None = DAILY_TOKEN_BUDGET):
+        self.limit = limit
+        self._day = date.today()
+        self._used: dict[int, int] = {}  # Расход за `_day`, включая ещё не записанный
+        self._pending: dict[tuple[int, date], int] = {}  # Не записанные в базу токены: {(uid, день): токены}
+        self._loading: dict[tuple[int, date], asyncio.Future] = {}  # Идущие загрузки расхода из базы
+        self._lock = asyncio.Lock()  # Загрузка из базы не пересекается с записью в flush
+
+    def _roll_day(self) -> None:
+        if (today := date.today()) != self._day:
+            self._day = today
+            self._used.clear()  # Вчерашние токены из _pending запишутся в свой день
+
+    async def used(self, uid: int) -> int:
+        """Сколько токенов пользователь потратил сегодня."""
+        self._roll_day()
+        if (used := self._used.get(uid)) is not None:
+            return used
+        # Одновременные первые запросы пользователя ждут одну загрузку, а не складывают несколько
+        key = (uid, self._day)
+        if (future := self._loading.get(key)) is None:
+            future = self._loading[key] = asyncio.ensure_future(self._load(uid, self._day))
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _load(self, uid: int, day: date) -> int:
+        async with self._lock:
+            row = await TokenUsage.filter(uid=uid, day=day).first()
+            # До загрузки add() копит токены только в _pending: они ещё не в базе, но уже потрачены
+            used = (row.tokens if row else 0) + self._pending.get((uid, day), 0)
+        if day == self._day:
+            self._used[uid] = used
+        return used
+
+    async def allows(self, uid: int) -> bool:
+        """Может ли пользователь сегодня ещё обращаться к модели."""
+        return self.limit is None or await self.used(uid) < self.limit
+
+    def add(self, uid: int, tokens: int) -> None:
+        """Учитывает токены ответа модели (запрос + ответ из usage_metadata)."""
+        if not tokens:
+            return
+        self._roll_day()
+        if uid in self._used:
+            self._used[uid] += tokens
+        key = (uid, self._day)
+        self._pending[key] = self._pending.get(key, 0) + tokens
+
+    async def flush(self) -> None:
+        """Записывает накопленный расход одной транзакцией."""
+        if not self._pending:
+            return
+
+        async with self._lock:
+            batch = dict(self._pending)
+            self._pending.clear()
+            try:
+                async with in_transaction():
+                    for day in {day for _, day in batch}:
+                        uids = [uid for uid, batch_day in batch if batch_day == day]
+                        existing = set(
+                            await TokenUsage.filter(day=day, uid__in=uids).values_list("uid", flat=True)
+                        )
+                        for uid in existing:
+                            await TokenUsage.filter(day=day, uid=uid).update(
+                                tokens=F("tokens") + batch[uid, day]
+                            )
+                        await TokenUsage.bulk_create(
+                            [TokenUsage(uid=uid, day=day, tokens=batch[uid, day]) for uid in uids if uid not in existing]
+                        )
+            except Exception:
+                for key, tokens in batch.items():  # Вернём расход в очередь, чтобы не потерять его
+                    self._pending[key] = self._pending.get(key, 0) + tokens
+                raise
+
+        logger.debug("Flushed token usage of {} users", len(batch))
+
+
+# Общий дневной бюджет токенов для всего бота
+token_budget = TokenBudget()
+
+
+__all__ = ("TokenBudget", "token_budget")
@@ -0,0 +1,96 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
+
+from app.config import LLM_MODEL, TOKEN_CACHE_SIZE, TOKENIZER_WORKERS
+from app.utils import codec
+
+if TYPE_CHECKING:
+    import tiktoken
+
+
+# Пул потоков для токенизации, чтобы не блокировать event loop на больших сообщениях
+_executor = ThreadPoolExecutor(
+    max_workers=TOKENIZER_WORKERS, thread_name_prefix="tokenizer"
+)
+
+# Кэш количества токенов: (модель, роль, контент) -> количество токенов.
+# Системный промпт и результаты инструментов повторяются во многих историях,
+# поэтому они кодируются один раз на процесс.
+_token_cache: OrderedDict[tuple[str, str, str], int] = OrderedDict()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str = LLM_MODEL) -> "tiktoken.Encoding":
+    """
+    Возвращает энкодер модели (создаётся один раз на процесс).
+    tiktoken импортируется здесь, чтобы модули, которые только импортируют tokens, его не грузили.
+    """
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model_name)
+
+
+def _cache_key(message: dict[str, Any], model_name: str) -> tuple[str, str, str]:
+    # Сериализуем контент в строку, если это dict или list
+    content = message["content"]
+    if isinstance(content, (dict, list)):
+        content = codec.dumps(content)
+    return model_name, message["role"], content or ""
+
+
+def _remember(key: tuple[str, str, str], tokens: int) -> None:
+    _token_cache[key] = tokens
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)  # Выкидываем самую старую запись
+
+
+def count_tokens(message: dict[str, Any], model_name: str = LLM_MODEL) -> int:
+    """
+    Считает токены роли и контента сообщения.
+    Повторные сообщения берутся из кэша и не кодируются заново.
+    """
+    key = _cache_key(message, model_name)
+    if (tokens := _token_cache.get(key)) is not None:
+        _token_cache.move_to_end(key)
+        return tokens
+
+    encoding = get_encoding(model_name)
+    tokens = len(encoding.encode(key[1])) + len(encoding.encode(key[2]))
+    _remember(key, tokens)
+    return tokens
+
+
+async def count_tokens_batch(
+    messages: list[dict[str, Any]], model_name: str = LLM_MODEL
+) -> list[int]:
+    """
+    Считает токены для списка сообщений.
+    Некэшированные сообщения кодируются одной пачкой в пуле потоков.
+    """
+    keys = [_cache_key(message, model_name) for message in messages]
+    missing = list({key for key in keys if key not in _token_cache})
+
+    if missing:
+        encoding = get_encoding(model_name)
+        # Кодируем роль и контент каждого сообщения одной пачкой
+        texts = [text for key in missing for text in (key[1], key[2])]
+        encoded = await asyncio.get_running_loop().run_in_executor(
+            _executor, encoding.encode_batch, texts
+        )
+        for i, key in enumerate(missing):
+            _remember(key, len(encoded[2 * i]) + len(encoded[2 * i + 1]))
+
+    return [
+        _token_cache[key] if key in _token_cache else count_tokens(message, model_name)
+        for key, message in zip(keys, messages)
+    ]
+
+
+__all__ = (
+    "get_encoding",
+    "count_tokens",
+    "count_tokens_batch",
+)
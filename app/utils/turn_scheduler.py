@@ -0,0 +1,79 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from app.config import TURN_DEBOUNCE
+
+
+# Состояние очереди ходов одного пользователя
+@dataclass(slots=True)
+class _UserTurns:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # Один ход за раз
+    texts: list[str] = field(default_factory=list)  # Сообщения, которые ещё не ушли в модель
+    waiters: list[asyncio.Future] = field(default_factory=list)  # Хендлеры, ждущие результат
+    run: Callable[[str], Awaitable[Any]] | None = None  # Как выполнить ход (от последнего сообщения)
+    timer: asyncio.Task | None = None  # Отложенный (ещё не начатый) ход
+
+
+class TurnScheduler:
+    """
+    Планировщик ходов по Telegram ID пользователя.
+
+    * У одного пользователя одновременно выполняется не больше одного хода.
+    * Сообщения, пришедшие в течение `debounce` секунд, склеиваются в один ход.
+    * Ещё не начатый ход заменяется новым, если пришло новое сообщение.
+    """
+
+    def __init__(self, debounce: float = TURN_DEBOUNCE):
+        self.debounce = debounce
+        self._users: dict[int, _UserTurns] = {}
+
+    async def submit(
+        self, uid: int, text: str, run: Callable[[str], Awaitable[Any]]
+    ) -> Any | None:
+        """
+        Ставит сообщение пользователя в очередь и ждёт результат хода.
+
+        Результат получает только последнее сообщение склеенного хода,
+        для остальных возвращается None (на них уже ответили вместе с последним).
+        """
+        state = self._users.setdefault(uid, _UserTurns())
+        state.texts.append(text)
+        state.run = run
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append(future)
+
+        if state.timer is not None:
+            state.timer.cancel()  # Заменяем отложенный ход новым, со всеми сообщениями
+        state.timer = asyncio.create_task(self._fire(uid, state))
+        return await future
+
+    async def _fire(self, uid: int, state: _UserTurns) -> None:
+        await asyncio.sleep(self.debounce)
+        async with state.lock:  # Ждём, пока закончится предыдущий ход пользователя
+            # С этого момента ход не отменяется: новые сообщения пойдут в следующий ход
+            state.timer = None
+            texts, waiters, run = state.texts, state.waiters, state.run
+            state.texts, state.waiters, state.run = [], [], None
+
+            for waiter in waiters[:-1]:
+                if not waiter.done():
+                    waiter.set_result(None)
+            try:
+                result = await run("\n".join(texts))
+            except Exception as e:
+                if not waiters[-1].done():
+                    waiters[-1].set_exception(e)
+            else:
+                if not waiters[-1].done():
+                    waiters[-1].set_result(result)
+
+        if state.timer is None and not state.texts and not state.lock.locked():
+            self._users.pop(uid, None)  # Пользователь больше ничего не ждёт
+
+
+# Общий планировщик ходов для всего бота
+turns = TurnScheduler()
+
+
+__all__ = ("TurnScheduler", "turns")
@@ -0,0 +1,69 @@
+"""
+Проверка времени импорта через python -X importtime.
+
+Падает (код выхода 1), если модули, которым LLM не нужна, тянут LangChain, OpenAI или tiktoken,
+или если их импорт не укладывается в бюджет.
+
+Запуск: python -m benchmarks.import_time
+"""
+
+import subprocess
+import sys
+
+# Модуль -> бюджет на его импорт в миллисекундах (суммарное время из -X importtime)
+BUDGETS = {
+    "app.config": 1500,
+    "app.database.user": 1500,
+    "app.database.chat_history": 1500,
+    "app.database.chat_message": 1500,
+    "app.database.slot": 1500,
+    "app.database.appointment": 1500,
+    "app.utils.tokens": 1500,
+    "app.utils.history_store": 2000,
+}
+
+# Пакеты, которые должны загружаться только при первом обращении к модели или токенизатору
+FORBIDDEN = ("langchain", "langchain_core", "langchain_openai", "openai", "tiktoken")
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Импортирует модуль в отдельном процессе и возвращает {модуль: накопленное время в мкс}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # Формат строки: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> int:
+    failed = False
+    for module, budget in BUDGETS.items():
+        times = import_times(module)
+        total = times.get(module, 0) / 1000
+        leaked = sorted(
+            name for name in times if name.split(".")[0] in FORBIDDEN
+        )
+        status = "ok"
+        if leaked:
+            status = f"FAIL: imports {', '.join(name for name in leaked if '.' not in name)}"
+            failed = True
+        elif total > budget:
+            status = f"FAIL: over budget ({budget} ms)"
+            failed = True
+        print(f"{module:<30} {total:8.1f} ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
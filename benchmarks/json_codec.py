@@ -0,0 +1,127 @@
+"""
+Кодирование JSON на горячих путях: стандартный json (как было) и app.utils.codec
+(orjson, если он установлен, иначе тот же json с заранее созданным энкодером).
+
+Истории - по 30 сообщений, как MAX_MESSAGES: вопросы клиента, ответы, вызовы инструментов
+и их результаты в том виде, в каком они лежат в истории.
+
+Запуск: python -m benchmarks.json_codec
+"""
+
+import json
+import time
+from datetime import date, timedelta, timezone
+from datetime import time as day_time
+from functools import partial
+from typing import Any, Callable
+
+from app.config import MAX_MESSAGES
+from app.llm.encoder import compact
+from app.utils import codec
+
+HISTORIES = 50  # Количество историй чата
+ROUNDS = 20  # Сколько раз повторяется каждый замер
+MASTERS = 4
+
+# Так JSONField кодирует по умолчанию без orjson (tortoise.fields.data.JSON_DUMPS)
+legacy_dumps = partial(json.dumps, separators=(",", ":"))
+
+
+def free_slots(n: int) -> dict[str, Any]:
+    """Результат get_free_time_slots: дата и время - объекты, как их возвращает availability.find."""
+    start = date.today() + timedelta(days=n % 7)
+    slots = [
+        {
+            "id": n * 100 + i,
+            "date": start + timedelta(days=i // 8),
+            "time": day_time(10 + i % 8, tzinfo=timezone.utc),  # TimeField отдаёт время с tzinfo
+            "service": {"id": i % 5 + 1, "name": f"Послуга {i % 5 + 1}", "duration": 60, "price": 500.0},
+            "master": {"staff_id": i % MASTERS + 1, "name": f"Майстер {i % MASTERS + 1}", "specialization": "Манікюр"},
+        }
+        for i in range(20)
+    ]
+    return {"slots": slots, "total": 56, "next_offset": 20}
+
+
+def tool_call(n: int, i: int) -> dict[str, Any]:
+    arguments = {"min_slot_duration": 60, "start_date": date.today().isoformat(), "master_id": i % MASTERS + 1}
+    return {
+        "id": f"call_{n}_{i}",
+        "type": "function",
+        "function": {"name": "get_free_time_slots", "arguments": json.dumps(arguments)},
+    }
+
+
+def make_history(n: int) -> list[dict[str, Any]]:
+    data = []
+    for i in range(MAX_MESSAGES):
+        match i % 4:
+            case 0:
+                data.append({"role": "user", "content": f"Запишіть мене на манікюр {n}-{i}, будь ласка"})
+            case 1:
+                data.append({"role": "assistant", "content": None, "tool_calls": [tool_call(n, i)]})
+            case 2:
+                data.append(
+                    {
+                        "role": "function",
+                        "name": "get_free_time_slots",
+                        # Как encode_tool_result для результата в пределах бюджета, без токенизатора
+                        "content": codec.dumps(compact(free_slots(n))),
+                    }
+                )
+            case 3:
+                data.append({"role": "assistant", "content": f"Є вільні вікна на завтра о 10:00 та 12:00. {i}"})
+    return data
+
+
+def bench(name: str, func: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<44} {best * 1000:10.2f} ms")
+    return best
+
+
+def compare(name: str, legacy: Callable[[], Any], fast: Callable[[], Any]) -> None:
+    before = bench(f"{name} (json)", legacy)
+    after = bench(f"{name} (codec)", fast)
+    print(f"{'':<44} {'x' + format(before / after, '.1f'):>10}")
+
+
+def main() -> None:
+    histories = [make_history(n) for n in range(HISTORIES)]
+    encoded = [legacy_dumps(history) for history in histories]
+    tool_calls = [message["tool_calls"] for history in histories for message in history if message.get("tool_calls")]
+    arguments = [call[0]["function"]["arguments"] for call in tool_calls]
+    results = [free_slots(n) for n in range(HISTORIES)]
+
+    print(f"codec backend: {codec.BACKEND}")
+    print(f"{HISTORIES} histories x {MAX_MESSAGES} messages, {sum(map(len, encoded)) // HISTORIES} bytes each")
+
+    # ChatHistory.data и System.reports: вся история при каждой загрузке и сохранении
+    compare("history encode", lambda: [legacy_dumps(h) for h in histories], lambda: [codec.dumps(h) for h in histories])
+    compare("history decode", lambda: [json.loads(e) for e in encoded], lambda: [codec.loads(e) for e in encoded])
+
+    # ChatMessage.tool_calls: по строке на сообщение ассистента
+    compare("tool_calls encode", lambda: [legacy_dumps(c) for c in tool_calls], lambda: [codec.dumps(c) for c in tool_calls])
+
+    # handle_tool_calls: аргументы от модели и ключ кэша инструментов за ход
+    compare("tool arguments decode", lambda: [json.loads(a) for a in arguments], lambda: [codec.loads(a) for a in arguments])
+    compare(
+        "tool cache key",
+        lambda: [json.dumps(json.loads(a), sort_keys=True) for a in arguments],
+        lambda: [codec.dumps(codec.loads(a), sort_keys=True) for a in arguments],
+    )
+
+    # Результат инструмента: прежде calls.py делал isoformat() для каждого слота до json.dumps
+    def legacy_result(result: dict[str, Any]) -> str:
+        slots = [{**slot, "date": slot["date"].isoformat(), "time": slot["time"].isoformat()} for slot in result["slots"]]
+        return json.dumps({**result, "slots": slots}, ensure_ascii=False, separators=(",", ":"))
+
+    compare("tool result encode", lambda: [legacy_result(r) for r in results], lambda: [codec.dumps(r) for r in results])
+
+
+if __name__ == "__main__":
+    main()
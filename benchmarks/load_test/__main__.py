@@ -0,0 +1,242 @@
+"""
+Нагрузочный тест всего пути сообщения без Telegram и OpenAI:
+dispatch -> MessageContextMiddleware -> text_handler -> make_completion -> инструменты -> save_chat_history.
+
+* Модель заменена на StubLLM (задержка и сценарии вызова инструментов задаются ниже),
+  она же может отвечать ошибками 429/5xx и медленными ответами, чтобы проверить app.llm.resilience.
+* Апдейты генерируются для N пользователей, каждый отправляет следующее сообщение после ответа.
+* Исходящие запросы бота записываются FakeAPI.
+* База - SQLite в памяти по умолчанию или любая другая по --db (например, локальный Postgres).
+
+Выводит ходы в секунду, p50/p95/p99 по этапам и запросы к базе на ход.
+
+Запуск: python -m benchmarks.load_test --users 50 --turns 10 --llm-latency 0.5
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import date, timedelta
+
+from fntypes.result import RESULT_ERROR_LOGGER
+from mubble import Dispatch, logger
+from tortoise import Tortoise
+
+import app.llm.wrapper as wrapper
+from app.config import SESSION_FLUSH_INTERVAL, models
+from app.handlers import dps
+from app.handlers import text as text_handler
+from app.llm.admission import admission
+from app.llm.assembler import prompt_cache
+from app.llm.prompts import reload_prompts, sync_prompt_versions
+from app.llm.resilience import resilience
+from app.llm.router import router
+from app.llm.summarizer import LocalSummarizer, set_summarizer
+from app.utils.answer_cache import answer_cache
+from app.utils.availability import availability
+from app.utils.history_cleaner import clean_dirty_histories
+from app.utils.history_store import flush_pending
+from app.utils.metrics import metrics
+from app.utils.seeding import seed_demo_data
+from app.utils.session_cache import sessions
+from app.utils.token_budget import token_budget
+from app.utils.turn_scheduler import turns
+
+from .fake_telegram import FakeAPI, UpdateFactory
+from .stats import QueryCounter, Recorder, current_source, format_table
+from .stub_llm import Step, StubLLM
+
+CLEANER_INTERVAL = 10  # Как в app/__main__.py
+
+
+async def free_slots() -> dict:
+    today = date.today()
+    return {"min_slot_duration": 30, "start_date": today.isoformat(), "end_date": (today + timedelta(days=7)).isoformat()}
+
+
+async def booking() -> dict:
+    """Аргументы create_record для случайного свободного слота (занятые слоты дают ошибку, как в жизни)."""
+    today = date.today()
+    found = await availability.find(0, today, today + timedelta(days=14), limit=50)
+    if not found["slots"]:
+        return {"staff_id": 0, "services": [], "client": {}, "datetime": today.isoformat(), "comment": ""}
+    slot = random.choice(found["slots"])
+    return {
+        "staff_id": slot["master"]["staff_id"],
+        "services": [{"id": slot["service"]["id"]}],
+        "client": {"name": "Load Test", "phone": "+380000000000"},
+        "datetime": f"{slot['date']}T{slot['time']}",
+        "comment": "",
+    }
+
+
+# Сценарии ходов: текст сообщения -> шаги модели. Вес - как часто сценарий встречается.
+SCENARIOS: dict[str, tuple[int, list[Step]]] = {
+    "Скільки коштує манікюр?": (4, [[("get_services", {})], "Манікюр коштує від 500 грн."]),
+    "Які у вас є майстри?": (2, [[("get_staff", {})], "У нас працюють вісім майстрів."]),
+    "Покажіть вільні вікна": (3, [[("get_free_time_slots", free_slots)], "Ось вільні вікна на тиждень."]),
+    "Запишіть мене на манікюр": (
+        1,
+        [[("get_free_time_slots", free_slots)], [("create_record", booking)], "Готово, ви записані!"],
+    ),
+    "Дякую, гарного дня": (2, ["Дякуємо, чекаємо на вас!"]),
+}
+
+
+async def setup_db(db_url: str) -> None:
+    await Tortoise.init(
+        config={
+            "connections": {"default": db_url},
+            "apps": {"models": {"models": models, "default_connection": "default"}},
+        }
+    )
+    await Tortoise.generate_schemas()
+    await seed_demo_data()
+    await availability.rebuild()
+    reload_prompts()
+    await sync_prompt_versions()
+
+
+async def background(recorder: Recorder, stop: asyncio.Event) -> None:
+    """Фоновые задачи бота (как интервалы в app/__main__.py): запись отложенных сообщений и очистка."""
+    current_source.set("background")
+    last_clean = time.monotonic()
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=SESSION_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await recorder.wrap("flush_pending", flush_pending)()
+        await token_budget.flush()
+        if stop.is_set() or time.monotonic() - last_clean >= CLEANER_INTERVAL:
+            await recorder.wrap("clean_dirty_histories", clean_dirty_histories)()
+            last_clean = time.monotonic()
+
+
+async def user(
+    index: int,
+    turns_count: int,
+    dispatch: Dispatch,
+    api: FakeAPI,
+    updates: UpdateFactory,
+    recorder: Recorder,
+    rng: random.Random,
+) -> None:
+    current_source.set("turn")
+    texts = list(SCENARIOS)
+    weights = [weight for weight, _ in SCENARIOS.values()]
+    for turn in range(turns_count):
+        text = rng.choices(texts, weights)[0]
+        if not text.endswith("?"):  # Частые вопросы повторяются дословно, остальные - с номером хода
+            text = f"{text} #{index}-{turn}"
+        start = time.perf_counter()
+        await dispatch.feed(updates.message(index, text), api)
+        recorder.add("turn", time.perf_counter() - start)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Одновременных пользователей")
+    parser.add_argument("--turns", type=int, default=10, help="Ходов на пользователя")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Задержка ответа модели, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Разброс задержки модели, с")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Доля запросов к модели с ошибкой 429/5xx")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Доля запросов к модели с задержкой x10")
+    parser.add_argument("--hedge-min-delay", type=float, help="Минимальная задержка дублирующего запроса, с")
+    parser.add_argument("--no-hedge", action="store_true", help="Не отправлять дублирующие запросы")
+    parser.add_argument("--debounce", type=float, default=0.0, help="Окно склейки сообщений, с")
+    parser.add_argument("--no-stream", action="store_true", help="Отвечать без стриминга")
+    parser.add_argument("--no-answer-cache", action="store_true", help="Не отвечать из кэша ответов")
+    parser.add_argument("--llm-concurrency", type=int, help="Лимит одновременных запросов к модели")
+    parser.add_argument("--metrics", action="store_true", help="Включить app.utils.metrics и вывести их")
+    parser.add_argument("--db", default="sqlite://:memory:", help="URL базы данных Tortoise")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logger.set_level("WARNING")  # Логи бота на каждый ход сильно искажают замеры
+    # fntypes форматирует весь стек вызовов для каждого Error/Nothing, а mubble создаёт их на каждое
+    # пустое поле апдейта: ~90% процессорного времени хода. Бот этот стек оставляет, здесь он только мешает
+    RESULT_ERROR_LOGGER.set_traceback_formatter(lambda: "")
+    counter = QueryCounter()
+    counter.install()
+    await setup_db(args.db)
+
+    # Модель, суммаризатор и Telegram - локальные
+    llm = StubLLM(
+        {text: steps for text, (_, steps) in SCENARIOS.items()},
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        seed=args.seed,
+        error_rate=args.llm_error_rate,
+        slow_rate=args.llm_slow_rate,
+    )
+    wrapper.get_client = lambda model=None: llm
+    set_summarizer(LocalSummarizer())
+    turns.debounce = args.debounce
+    text_handler.STREAMING = not args.no_stream
+    if args.no_answer_cache:
+        answer_cache.min_words = float("inf")  # Ни один вопрос не подходит для кэша
+    metrics.enabled = args.metrics
+    if args.hedge_min_delay is not None:
+        resilience.hedge_min_delay = args.hedge_min_delay
+    resilience.hedge = not args.no_hedge
+    if args.llm_concurrency:
+        admission.max_concurrent = args.llm_concurrency
+
+    # Этапы, по которым считаются задержки
+    recorder = Recorder()
+    sessions.get = recorder.wrap("session", sessions.get)
+    for stage in ("load_messages", "get_model_text_response", "handle_tool_calls", "save_chat_history"):
+        setattr(wrapper, stage, recorder.wrap(stage, getattr(wrapper, stage)))
+
+    dispatch = Dispatch()
+    dispatch.load_many(*dps)
+    api = FakeAPI()
+    updates = UpdateFactory()
+    rng = random.Random(args.seed)
+    counter.queries.clear()  # Запросы подготовки базы не считаем
+
+    stop = asyncio.Event()
+    background_task = asyncio.create_task(background(recorder, stop))
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            user(i, args.turns, dispatch, api, updates, recorder, random.Random(rng.random()))
+            for i in range(args.users)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await background_task
+
+    total_turns = args.users * args.turns
+    print(f"\n{total_turns} turns of {args.users} users in {elapsed:.2f} s: {total_turns / elapsed:.1f} turns/s")
+    print(f"LLM calls: {llm.calls} ({llm.calls / total_turns:.2f} per turn), injected errors: {llm.errors}")
+    print()
+    print(format_table(recorder.report(), ("stage", "calls", "p50 ms", "p95 ms", "p99 ms")))
+    print()
+    queries = counter.queries
+    print(
+        "DB queries per turn: {:.2f} in turns, {:.2f} in background, {:.2f} total".format(
+            queries.get("turn", 0) / total_turns,
+            queries.get("background", 0) / total_turns,
+            sum(queries.values()) / total_turns,
+        )
+    )
+    print(f"Telegram requests: {api.counts()}")
+    print(f"Session cache: {sessions.stats()}")
+    print(f"Answer cache: {answer_cache.stats()}")
+    print(f"Prompt cache: {prompt_cache.stats()}")
+    print(f"LLM admission: {admission.stats()}")
+    print(f"LLM routes: {router.stats()}")
+    print(f"LLM resilience: {resilience.stats()}")
+    if args.metrics:  # Без корзин гистограмм: суммы, количества, счётчики и gauge
+        print()
+        print("\n".join(line for line in metrics.render().splitlines() if "_bucket" not in line))
+
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
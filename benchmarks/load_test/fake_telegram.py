@@ -0,0 +1,79 @@
+"""
+Фейковый Telegram: апдейты с сообщениями пользователей и API, которое записывает исходящие запросы.
+"""
+
+import json
+import time
+from itertools import count
+from typing import Any
+
+import msgspec
+from fntypes.result import Ok
+from mubble import API, Token
+from mubble.msgspec_utils import decoder
+from mubble.types.objects import Update
+
+BOT_ID = 100000
+
+
+class FakeAPI(API):
+    """API бота без сети: каждый запрос записывается в `outbox`, в ответ приходит правдоподобное сообщение."""
+
+    def __init__(self):
+        super().__init__(Token(f"{BOT_ID}:LOAD-TEST"))
+        self.outbox: list[tuple[str, dict[str, Any]]] = []
+        self._message_ids = count(1)
+
+    async def request(self, method: str, data: dict[str, Any] | None = None, files=None):
+        self.outbox.append((method, data or {}))
+        return Ok(self._result(data or {}))
+
+    async def request_raw(self, method: str, data: dict[str, Any] | None = None, files=None):
+        self.outbox.append((method, data or {}))
+        return Ok(msgspec.Raw(json.dumps(self._result(data or {}), ensure_ascii=False).encode()))
+
+    def _result(self, data: dict[str, Any]) -> dict[str, Any]:
+        chat_id = data.get("chat_id", 0)
+        return {
+            "message_id": data.get("message_id") or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"},
+            "text": str(data.get("text", "")),
+        }
+
+    def counts(self) -> dict[str, int]:
+        """Сколько запросов каждого метода отправил бот."""
+        result: dict[str, int] = {}
+        for method, _ in self.outbox:
+            result[method] = result.get(method, 0) + 1
+        return result
+
+
+class UpdateFactory:
+    """Текстовые сообщения от пользователей в том виде, в котором их отдаёт getUpdates."""
+
+    def __init__(self, first_uid: int = 1_000_000):
+        self.first_uid = first_uid
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+
+    def uid(self, user: int) -> int:
+        return self.first_uid + user
+
+    def message(self, user: int, text: str) -> Update:
+        uid = self.uid(user)
+        raw = {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private", "first_name": f"User{user}"},
+                "from": {"id": uid, "is_bot": False, "first_name": f"User{user}"},
+                "text": text,
+            },
+        }
+        return decoder.decode(json.dumps(raw, ensure_ascii=False).encode(), type=Update)
+
+
+__all__ = ("FakeAPI", "UpdateFactory")
@@ -0,0 +1,96 @@
+"""
+Сбор метрик нагрузочного теста: задержки по этапам и количество запросов к базе.
+"""
+
+import functools
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Callable
+
+# Откуда сейчас идут запросы к базе: "turn" (ход пользователя) или "background" (запись, очистка)
+current_source: ContextVar[str] = ContextVar("current_source", default="other")
+
+
+class Recorder:
+    """Длительности этапов в секундах: {этап: [длительности]}."""
+
+    def __init__(self):
+        self.durations: dict[str, list[float]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage: str, func: Callable) -> Callable:
+        """Оборачивает async-функцию, чтобы каждый её вызов записывался в этап `stage`."""
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def report(self) -> list[tuple[str, int, float, float, float]]:
+        """[(этап, вызовов, p50 мс, p95 мс, p99 мс)]"""
+        return [
+            (
+                stage,
+                len(values),
+                percentile(values, 50) * 1000,
+                percentile(values, 95) * 1000,
+                percentile(values, 99) * 1000,
+            )
+            for stage, values in self.durations.items()
+        ]
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryCounter(logging.Handler):
+    """
+    Считает SQL-запросы Tortoise по его debug-логу ("tortoise.db_client"),
+    отдельно для каждого источника из `current_source`.
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries: dict[str, int] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.msg == "%s: %s":  # Запросы логируются так, подключение и закрытие - иначе
+            source = current_source.get()
+            self.queries[source] = self.queries.get(source, 0) + 1
+
+    def install(self) -> None:
+        db_logger = logging.getLogger("tortoise.db_client")
+        db_logger.setLevel(logging.DEBUG)
+        db_logger.propagate = False  # Сами запросы в консоль не выводим
+        db_logger.addHandler(self)
+
+
+def format_table(rows: list[tuple[Any, ...]], header: tuple[str, ...]) -> str:
+    """Таблица с выравниванием: первая колонка влево, остальные вправо."""
+    cells = [header] + [
+        tuple(f"{cell:.1f}" if isinstance(cell, float) else str(cell) for cell in row) for row in rows
+    ]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    return "\n".join(
+        "  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in cells
+    )
+
+
+__all__ = ("QueryCounter", "Recorder", "current_source", "format_table", "percentile")
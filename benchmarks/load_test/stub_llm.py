@@ -0,0 +1,164 @@
+"""
+Замена ChatOpenAI для нагрузочного теста: отвечает по сценариям, с заданной задержкой, без сети.
+"""
+
+import asyncio
+import inspect
+import json
+import random
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Any, Awaitable, Callable
+
+# Шаг сценария: либо вызовы инструментов [(название, аргументы)], либо текст ответа.
+# Аргументы могут быть функцией (в том числе async), тогда они считаются в момент вызова.
+ToolArgs = dict[str, Any] | Callable[[], dict[str, Any] | Awaitable[dict[str, Any]]]
+Step = list[tuple[str, ToolArgs]] | str
+
+
+@dataclass
+class StubMessage:
+    """То, что wrapper читает из AIMessage: content, tool_calls и usage."""
+
+    content: str = ""
+    additional_kwargs: dict[str, Any] = field(default_factory=dict)
+    usage_metadata: dict[str, Any] | None = None
+
+    def __add__(self, other: "StubMessage") -> "StubMessage":
+        # Как у AIMessageChunk: текст склеивается, вызовы инструментов и usage приходят последним куском
+        return StubMessage(
+            self.content + other.content,
+            {**self.additional_kwargs, **other.additional_kwargs},
+            other.usage_metadata or self.usage_metadata,
+        )
+
+
+class StubError(Exception):
+    """Временная ошибка провайдера, как InternalServerError/RateLimitError у openai."""
+
+    def __init__(self, status_code: int = 503):
+        super().__init__(f"Stub provider error {status_code}")
+        self.status_code = status_code
+
+
+class StubLLM:
+    """
+    Отвечает по сценарию, который выбирается по тексту последнего сообщения пользователя.
+    Номер шага - по количеству результатов инструментов после этого сообщения.
+
+    `error_rate` - доля запросов, которые падают с StubError (503 или 429).
+    `slow_rate` - доля запросов, которые отвечают в `slow_factor` раз дольше (хвост задержек).
+    """
+
+    def __init__(
+        self,
+        scenarios: dict[str, list[Step]],
+        latency: float = 0.5,
+        jitter: float = 0.1,
+        chunks: int = 5,
+        seed: int = 0,
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_factor: float = 10.0,
+    ):
+        self.scenarios = scenarios
+        self.latency = latency
+        self.jitter = jitter
+        self.chunks = chunks  # На сколько кусков делится ответ при стриминге
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.calls = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._ids = count(1)
+
+    async def ainvoke(self, input: list[dict[str, Any]], **kwargs) -> StubMessage:
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        return await self._respond(input)
+
+    async def astream(self, input: list[dict[str, Any]], **kwargs):
+        delay = self._delay()
+        await asyncio.sleep(delay / 2)  # Время до первого токена
+        self._maybe_fail()
+        response = await self._respond(input)
+        if not response.content:
+            yield response
+            return
+
+        size = max(1, len(response.content) // self.chunks)
+        parts = [response.content[i : i + size] for i in range(0, len(response.content), size)]
+        for part in parts[:-1]:
+            yield StubMessage(part)
+            await asyncio.sleep(delay / 2 / len(parts))
+        yield StubMessage(parts[-1], response.additional_kwargs, response.usage_metadata)
+
+    def _delay(self) -> float:
+        delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        if self._rng.random() < self.slow_rate:
+            delay *= self.slow_factor
+        return delay
+
+    def _maybe_fail(self) -> None:
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise StubError(self._rng.choice((429, 500, 503)))
+
+    async def _respond(self, messages: list[dict[str, Any]]) -> StubMessage:
+        self.calls += 1
+        last_user = max(i for i, message in enumerate(messages) if message["role"] == "user")
+        text = messages[last_user]["content"]
+        tool_results = sum(
+            1 for message in messages[last_user + 1 :] if message["role"] in ("function", "tool")
+        )
+
+        steps = self.scenarios.get(scenario_of(text), ["OK"])
+        for step in steps:
+            if isinstance(step, str):
+                return self._message(messages, content=step)
+            if tool_results < len(step):
+                return self._message(messages, tool_calls=await self._tool_calls(step))
+            tool_results -= len(step)
+        return self._message(messages, content=steps[-1] if isinstance(steps[-1], str) else "OK")
+
+    async def _tool_calls(self, step: list[tuple[str, ToolArgs]]) -> list[dict[str, Any]]:
+        calls = []
+        for name, args in step:
+            if callable(args):
+                args = args()
+                if inspect.isawaitable(args):
+                    args = await args
+            calls.append(
+                {
+                    "id": f"call_{next(self._ids)}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
+                }
+            )
+        return calls
+
+    @staticmethod
+    def _message(
+        messages: list[dict[str, Any]],
+        content: str = "",
+        tool_calls: list[dict[str, Any]] | None = None,
+    ) -> StubMessage:
+        prompt_chars = sum(len(message.get("content") or "") for message in messages)
+        return StubMessage(
+            content,
+            {"tool_calls": tool_calls} if tool_calls else {},
+            {
+                "input_tokens": prompt_chars // 4,
+                "output_tokens": len(content) // 4,
+                "input_token_details": {"cache_read": 0},
+            },
+        )
+
+
+def scenario_of(text: str) -> str:
+    """Сценарий хода: текст сообщения до " #" (после - номер хода, чтобы тексты не повторялись)."""
+    return text.split(" #", 1)[0]
+
+
+__all__ = ("StubError", "StubLLM", "StubMessage", "scenario_of")
@@ -0,0 +1,50 @@
+"""
+Стоимость замеров app.utils.metrics на горячем пути: пустой блок без замера,
+с выключенными метриками и с включёнными.
+
+Запуск: python -m benchmarks.metrics_overhead
+"""
+
+import time
+
+from app.utils.metrics import Metrics
+
+ITERATIONS = 1_000_000
+
+
+def bare() -> None:
+    for _ in range(ITERATIONS):
+        pass
+
+
+def spans(metrics: Metrics) -> None:
+    for _ in range(ITERATIONS):
+        with metrics.span("tool", tool="get_services"):
+            pass
+
+
+def counters(metrics: Metrics) -> None:
+    usage = {"input_tokens": 1000, "output_tokens": 50, "input_token_details": {"cache_read": 512}}
+    for _ in range(ITERATIONS):
+        metrics.record_usage(usage)
+
+
+def measure(func, *args) -> float:
+    """Наносекунды на одну итерацию."""
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) / ITERATIONS * 1e9
+
+
+def main() -> None:
+    baseline = measure(bare)
+    print(f"empty loop: {baseline:.0f} ns")
+    for enabled in (False, True):
+        metrics = Metrics(enabled=enabled)
+        state = "enabled" if enabled else "disabled"
+        print(f"span, {state}: +{measure(spans, metrics) - baseline:.0f} ns")
+        print(f"record_usage, {state}: +{measure(counters, metrics) - baseline:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Время запуска базы данных: загрузка демо-данных и запуск без изменений.
+
+Нужна настроенная база из .env. Запуск: python -m benchmarks.startup
+"""
+
+import asyncio
+import time
+
+from tortoise import Tortoise
+
+from app.config import setup_database
+from app.database.system import System
+from app.utils.seeding import seed_demo_data
+
+RUNS = 5  # Сколько раз повторяется каждый замер
+
+
+async def timed(name: str, func) -> None:
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        await func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name:<35} median {timings[len(timings) // 2] * 1000:8.1f} ms")
+
+
+async def reseed() -> None:
+    # Сбрасываем версию, чтобы демо-данные загрузились заново
+    await System.filter(id=1).update(fixtures_version=0)
+    await seed_demo_data()
+
+
+async def restart() -> None:
+    await Tortoise.close_connections()
+    await setup_database()
+
+
+async def main() -> None:
+    await setup_database()
+    await seed_demo_data()  # Первая загрузка, чтобы замеры шли на заполненной базе
+
+    await timed("seed_demo_data (version changed)", reseed)
+    await timed("seed_demo_data (up to date)", seed_demo_data)
+    await timed("setup_database (restart)", restart)
+
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
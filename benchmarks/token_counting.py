@@ -0,0 +1,99 @@
+"""
+Сравнение старого подсчёта токенов (encoding_for_model + encode на каждое сообщение)
+с кэшированным подсчётом из app.utils.tokens.
+
+Запуск: python -m benchmarks.token_counting
+"""
+
+import asyncio
+import json
+import time
+from typing import Any
+
+import tiktoken
+
+from app.config import LLM_MODEL
+from app.llm.prompts import entry
+from app.utils.tokens import count_tokens, count_tokens_batch
+
+HISTORIES = 50  # Количество историй чата
+MESSAGES = 30  # Сообщений в каждой истории
+
+
+def legacy_count_tokens(message: dict[str, Any], model_name=LLM_MODEL):
+    # Копия прежней реализации из app/utils/auto_cleaner.py
+    encoding = tiktoken.encoding_for_model(model_name)
+
+    content = message["content"]
+    if isinstance(content, (dict, list)):
+        content = json.dumps(content)
+
+    role_tokens = encoding.encode(message["role"])
+    content_tokens = encoding.encode(content)
+
+    return len(role_tokens) + len(content_tokens)
+
+
+def make_history(n: int) -> list[dict[str, Any]]:
+    services = [
+        {"id": i, "name": f"Послуга {i}", "price": 300 + i, "duration": 60}
+        for i in range(8)
+    ]
+    data = [{"role": "system", "content": entry}]
+    for i in range(MESSAGES - 1):
+        if i % 3 == 0:
+            data.append({"role": "user", "content": f"Привіт, запишіть мене {n}-{i}"})
+        elif i % 3 == 1:
+            data.append(
+                {
+                    "role": "function",
+                    "name": "get_services",
+                    "content": json.dumps(services, ensure_ascii=False),
+                }
+            )
+        else:
+            data.append({"role": "assistant", "content": f"Звичайно! Відповідь {i}"})
+    return data
+
+
+def bench(name: str, func) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {elapsed * 1000:10.1f} ms")
+    return elapsed
+
+
+async def main() -> None:
+    histories = [make_history(n) for n in range(HISTORIES)]
+
+    print(f"{HISTORIES} histories x {MESSAGES} messages")
+    legacy = bench(
+        "legacy count_tokens (full pass)",
+        lambda: [sum(legacy_count_tokens(m) for m in h) for h in histories],
+    )
+
+    # Первый проход: каждое уникальное сообщение кодируется один раз пачкой в пуле потоков
+    start = time.perf_counter()
+    stored = [await count_tokens_batch(data) for data in histories]
+    cold = time.perf_counter() - start
+    print(f"{'count_tokens_batch (cold)':<40} {cold * 1000:10.1f} ms")
+
+    # Повторный проход: итог - это сумма сохранённых счётчиков
+    bench("stored counts (sum)", lambda: [sum(c) for c in stored])
+    bench(
+        "count_tokens (warm cache)",
+        lambda: [sum(count_tokens(m) for m in h) for h in histories],
+    )
+
+    # Новый ход: кодируется только одно новое сообщение
+    start = time.perf_counter()
+    await count_tokens_batch([{"role": "user", "content": "Нове повідомлення"}])
+    append = time.perf_counter() - start
+    print(f"{'count_tokens_batch (one new message)':<40} {append * 1000:10.3f} ms")
+
+    print(f"speedup (cold): x{legacy / cold:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
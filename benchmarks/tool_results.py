@@ -0,0 +1,69 @@
+"""
+Размер результатов инструментов в токенах: прежний json.dumps и компактный encode_tool_result.
+
+Запуск: python -m benchmarks.tool_results
+"""
+
+import asyncio
+import json
+from datetime import date, time, timedelta
+
+from app.llm.encoder import encode_tool_result
+from app.utils.tokens import count_tokens
+
+SERVICES = 8  # Услуг в каталоге
+MASTERS = 8  # Мастеров в каталоге
+SLOTS_PER_DAY = 8  # Свободных слотов у мастера в день
+
+
+def free_slots(days: int, limit: int) -> dict:
+    """Результат get_free_time_slots в том же виде, что возвращает availability.find."""
+    slots = []
+    start = date.today()
+    for day in range(days):
+        for master in range(MASTERS):
+            for hour in range(SLOTS_PER_DAY):
+                service = (master + hour) % SERVICES
+                slots.append(
+                    {
+                        "id": len(slots) + 1,
+                        "date": start + timedelta(days=day),
+                        "time": time(10 + hour),
+                        "service": {
+                            "id": service + 1,
+                            "name": f"Послуга {service + 1}",
+                            "duration": 60,
+                            "price": 500 + 100 * service,
+                        },
+                        "master": {
+                            "staff_id": master + 1,
+                            "name": f"Майстер {master + 1}",
+                            "specialization": "Манікюр та педикюр",
+                        },
+                    }
+                )
+    result = {"slots": slots[:limit], "total": len(slots)}
+    if limit < len(slots):
+        result["next_offset"] = limit
+    return result
+
+
+def tokens(content: str) -> int:
+    return count_tokens({"role": "function", "content": content})
+
+
+async def main() -> None:
+    print(f"{'case':<28} {'json.dumps':>10} {'encoded':>8} {'saved':>7}")
+    for name, result in (
+        ("1 day, 20 slots", free_slots(1, 20)),
+        ("1 week, 20 slots", free_slots(7, 20)),
+        ("1 week, 100 slots", free_slots(7, 100)),
+        ("1 week, all slots", free_slots(7, 7 * MASTERS * SLOTS_PER_DAY)),
+    ):
+        before = tokens(json.dumps(result, ensure_ascii=False, default=str))
+        after = tokens(await encode_tool_result("get_free_time_slots", result))
+        print(f"{name:<28} {before:>10} {after:>8} {1 - after / before:>7.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""Общие фикстуры тестов: база SQLite в памяти с демо-данными, как в нагрузочном тесте, и результаты инструментов."""
+
+import asyncio
+from datetime import date, time, timedelta
+
+import pytest
+from tortoise import Tortoise
+
+from benchmarks.load_test.__main__ import setup_db
+
+
+@pytest.fixture(scope="session")
+def runner():
+    """Один цикл событий на все тесты: кэш каталога и индекс слотов - общие объекты с asyncio.Lock."""
+    with asyncio.Runner() as runner:
+        yield runner
+
+
+@pytest.fixture
+def run(runner):
+    """Запускает тест на новой базе SQLite в памяти с демо-данными."""
+
+    def run(test):
+        async def wrapper():
+            await setup_db("sqlite://:memory:")
+            try:
+                await test()
+            finally:
+                await Tortoise.close_connections()
+
+        runner.run(wrapper())
+
+    return run
+
+
+@pytest.fixture
+def free_slots():
+    """Фабрика результатов get_free_time_slots в том же виде, что возвращает availability.find."""
+
+    def free_slots(days: int, limit: int, masters: int = 8, slots_per_day: int = 8) -> dict:
+        slots = []
+        for day in range(days):
+            for master in range(masters):
+                for hour in range(slots_per_day):
+                    slots.append(
+                        {
+                            "id": len(slots) + 1,
+                            "date": date.today() + timedelta(days=day),
+                            "time": time(10 + hour),
+                            "service": {"id": hour + 1, "name": f"Послуга {hour + 1}", "duration": 60, "price": 500},
+                            "master": {"staff_id": master + 1, "name": f"Майстер {master + 1}"},
+                        }
+                    )
+        result = {"slots": slots[:limit], "total": len(slots)}
+        if limit < len(slots):
+            result["next_offset"] = limit
+        return result
+
+    return free_slots
@@ -0,0 +1,45 @@
+"""Очередь допуска запросов к модели: место не утекает, если ожидание прервалось."""
+
+import asyncio
+
+import pytest
+
+from app.llm.admission import AdmissionController
+
+
+def test_failed_queue_notice_keeps_waiting(runner):
+    async def test():
+        admission = AdmissionController(
+            max_concurrent=1, requests_per_minute=None, tokens_per_minute=None, queue_timeout=0.2, notice_after=0.01
+        )
+        await admission.acquire(1, 100)
+
+        async def notice():
+            admission.release()  # Место освобождается, пока отправляется уведомление
+            raise ConnectionError("Telegram is unavailable")
+
+        await admission.acquire(2, 100, notice)  # Ошибка уведомления не отменяет запрос
+        assert admission.stats() == {"in_flight": 1, "queued": 0, "admitted": 2, "rejected": 0}
+
+    runner.run(test())
+
+
+def test_cancelled_after_admission_releases_slot(runner):
+    async def test():
+        admission = AdmissionController(
+            max_concurrent=1, requests_per_minute=None, tokens_per_minute=None, queue_timeout=1, notice_after=0.01
+        )
+        await admission.acquire(1, 100)
+
+        async def notice():
+            admission.release()  # Место выдано, пока отправляется уведомление
+            await asyncio.sleep(10)
+
+        waiting = asyncio.create_task(admission.acquire(2, 100, notice))
+        await asyncio.sleep(0.05)
+        waiting.cancel()  # Ход отменён до выхода из очереди
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.in_flight == 0 and admission.queued == 0
+
+    runner.run(test())
@@ -0,0 +1,21 @@
+"""Поиск свободных слотов в индексе в памяти и тем же запросом в базе."""
+
+from datetime import date, timedelta
+
+from app.utils.availability import availability
+
+
+def test_find_in_memory_matches_database(run):
+    async def test():
+        today = date.today()
+        for start, end in ((today, today), (today, today + timedelta(days=7))):
+            in_memory = await availability.find(0, start, end)
+            availability.ready = False  # Тот же поиск запросом к базе
+            try:
+                from_database = await availability.find(0, start, end)
+            finally:
+                availability.ready = True
+            assert in_memory["total"] == from_database["total"] > 0
+            assert [slot["id"] for slot in in_memory["slots"]] == [slot["id"] for slot in from_database["slots"]]
+
+    run(test)
@@ -0,0 +1,123 @@
+"""
+Одновременные записи на один и тот же слот (create_record) на SQLite из нагрузочного теста
+и кэш инструментов хода после записи.
+
+Запуск: python -m pytest tests
+"""
+
+import asyncio
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from app.database.appointment import Appointment
+from app.database.service import Service
+from app.database.slot import Slot
+from app.database.user import User
+from app.llm.calls import create_record, get_free_time_slots
+from app.llm.wrapper import execute_tool_call
+from app.utils.availability import availability
+
+CLIENTS = 10  # Сколько пользователей одновременно записываются на один слот
+
+
+async def make_users(count: int) -> list[SimpleNamespace]:
+    """Пользователи в базе и сообщения от них (create_record берёт из сообщения только uid)."""
+    await User.bulk_create([User(uid=1000 + i, name=f"Client {i}") for i in range(count)])
+    return [SimpleNamespace(from_user=SimpleNamespace(id=1000 + i)) for i in range(count)]
+
+
+async def free_slot() -> Slot:
+    return await Slot.filter(status="available", date__gte=date.today()).order_by("date", "time").first()
+
+
+def booking(slot: Slot, services: list[int]) -> dict:
+    return {
+        "staff_id": slot.master_id,
+        "services": [{"id": service_id} for service_id in services],
+        "client": {"name": "Client"},
+        "datetime": datetime.combine(slot.date, slot.time).isoformat(),
+        "comment": "",
+    }
+
+
+def test_parallel_bookings_of_one_slot(run):
+    async def test():
+        slot = await free_slot()
+        messages = await make_users(CLIENTS)
+
+        results = await asyncio.gather(
+            *(create_record(**booking(slot, [slot.service_id]), message=message) for message in messages)
+        )
+
+        booked = [result for result in results if "appointments" in result]
+        assert len(booked) == 1
+        assert all("error" in result for result in results if "appointments" not in result)
+        assert await Appointment.filter(slot_id=slot.id).count() == 1
+        assert (await Slot.get(id=slot.id)).status == "booked"
+        assert slot.id not in availability._slots
+
+    run(test)
+
+
+def test_parallel_bookings_of_different_slots(run):
+    async def test():
+        slots = await Slot.filter(status="available", date__gte=date.today()).limit(CLIENTS)
+        messages = await make_users(len(slots))
+
+        results = await asyncio.gather(
+            *(
+                create_record(**booking(slot, [slot.service_id]), message=message)
+                for slot, message in zip(slots, messages)
+            )
+        )
+
+        assert all("appointments" in result for result in results)
+        assert await Appointment.filter(slot_id__in=[slot.id for slot in slots]).count() == len(slots)
+
+    run(test)
+
+
+def test_failed_booking_restores_free_slot(run):
+    async def test():
+        first = await free_slot()
+        service = first.service_id  # Услуга свободного слота в базе и в индексе
+        booked_service = await Service.exclude(id=service).first()  # Запись меняет услугу слота
+        # Второй слот записи уже занят, поэтому вся запись откатывается
+        second_start = datetime.combine(first.date, first.time) + timedelta(minutes=booked_service.duration)
+        await Slot.create(
+            master_id=first.master_id,
+            date=second_start.date(),
+            time=second_start.time(),
+            service_id=service,
+            status="booked",
+        )
+        [message] = await make_users(1)
+
+        result = await create_record(**booking(first, [booked_service.id, service]), message=message)
+
+        assert "error" in result
+        stored = await Slot.get(id=first.id)
+        assert stored.status == "available" and stored.service_id == service
+        assert availability._slots[first.id].service_id == service  # Индекс совпадает с базой
+
+    run(test)
+
+
+
+def test_turn_cache_is_dropped_after_booking(run):
+    async def test():
+        slot = await free_slot()
+        [message] = await make_users(1)
+        day = slot.date.isoformat()
+        search = {"min_slot_duration": 0, "start_date": day, "end_date": day, "staff_id": slot.master_id}
+        tool_cache = {}
+
+        before = await execute_tool_call(get_free_time_slots, "get_free_time_slots", search, message, tool_cache)
+        assert slot.id in [found["id"] for found in before["slots"]]
+        await execute_tool_call(
+            create_record, "create_record", booking(slot, [slot.service_id]), message, tool_cache
+        )
+        after = await execute_tool_call(get_free_time_slots, "get_free_time_slots", search, message, tool_cache)
+        assert slot.id not in [found["id"] for found in after["slots"]]  # Не старый результат из кэша хода
+
+    run(test)
@@ -0,0 +1,61 @@
+"""
+JSON-кодек app.utils.codec: запасной бэкенд на стандартном json пишет то же, что и orjson.
+Каждый бэкенд загружается отдельной копией модуля, потому что выбирается при импорте.
+"""
+
+import importlib.util
+import sys
+from datetime import date, datetime, time, timezone
+
+import pytest
+
+from app.utils import codec
+
+VALUE = {
+    "name": "Стрижка",
+    "refs": {"master": {1: {"name": "Анна"}, 2: {"name": "Олена"}}},
+    "date": date(2024, 5, 1),
+    "time": time(10, 30, tzinfo=timezone.utc),  # TimeField Tortoise отдаёт время с tzinfo
+    "datetime": datetime(2024, 5, 1, 10, 30),
+    "price": 450.5,
+    "tags": ["a", None, True],
+}
+
+
+def load_codec(monkeypatch, orjson: bool):
+    """Новая копия app.utils.codec: без orjson (импорт запрещён) или с ним."""
+    if not orjson:
+        monkeypatch.setitem(sys.modules, "orjson", None)
+    spec = importlib.util.spec_from_file_location(f"codec_{orjson}", codec.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_json_fallback(monkeypatch):
+    json_codec = load_codec(monkeypatch, orjson=False)
+    assert json_codec.BACKEND == "json"
+
+    encoded = json_codec.dumps(VALUE)
+    assert '"name":"Стрижка"' in encoded  # Без пробелов и без экранирования кириллицы
+    assert '"master":{"1":{"name":"Анна"},"2":{"name":"Олена"}}' in encoded  # Ключи-числа - строками
+    assert '"date":"2024-05-01"' in encoded
+    assert '"time":"10:30:00+00:00"' in encoded
+    assert '"datetime":"2024-05-01T10:30:00"' in encoded
+    assert json_codec.dumps({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+    assert json_codec.loads(encoded.encode())["refs"]["master"]["1"] == {"name": "Анна"}
+
+    with pytest.raises(TypeError):
+        json_codec.dumps({"value": object()})
+
+
+def test_backends_write_the_same(monkeypatch):
+    pytest.importorskip("orjson")
+    orjson_codec = load_codec(monkeypatch, orjson=True)
+    json_codec = load_codec(monkeypatch, orjson=False)
+    assert orjson_codec.BACKEND == "orjson"
+
+    for sort_keys in (False, True):
+        encoded = orjson_codec.dumps(VALUE, sort_keys=sort_keys)
+        assert encoded == json_codec.dumps(VALUE, sort_keys=sort_keys)
+        assert orjson_codec.loads(encoded) == json_codec.loads(encoded)
@@ -0,0 +1,40 @@
+"""Обрезка результатов инструментов по бюджету токенов (encode_tool_result)."""
+
+from app.llm import encoder
+from app.llm.encoder import encode_tool_result
+from app.utils import codec
+
+BUDGET = 800  # Бюджет get_free_time_slots в app.config
+
+
+def test_truncated_result_fits_budget(runner, monkeypatch, free_slots):
+    counted = []
+
+    async def count_chars(messages):
+        """Токен - символ: оценка в 2 символа на токен заведомо щедрая, и обрезка уточняется."""
+        counted.extend(message["content"] for message in messages)
+        return [len(message["content"]) for message in messages]
+
+    monkeypatch.setattr(encoder, "count_tokens_batch", count_chars)
+    result = free_slots(7, 100)
+    content = runner.run(encode_tool_result("get_free_time_slots", result))
+
+    assert len(content) <= BUDGET and content == counted[-1]
+    encoded = codec.loads(content)
+    shown = len(encoded["slots"]["rows"])
+    assert 0 < shown and shown + encoded["more_available"] == 100
+    assert encoded["next_offset"] == shown  # Следующая страница - с первого невошедшего слота
+
+
+def test_small_result_is_counted_once(runner, monkeypatch, free_slots):
+    counted = []
+
+    async def count_chars(messages):
+        counted.extend(messages)
+        return [len(message["content"]) // 2 for message in messages]
+
+    monkeypatch.setattr(encoder, "count_tokens_batch", count_chars)
+    result = free_slots(1, 3)
+    content = runner.run(encode_tool_result("get_free_time_slots", result))
+
+    assert "more_available" not in codec.loads(content) and len(counted) == 1
@@ -0,0 +1,74 @@
+"""Отложенная запись сообщений (flush_pending): сообщения видны load_messages до и после записи."""
+
+import asyncio
+
+import pytest
+
+from app.utils import history_store
+from app.utils.history_store import create_chat_history, flush_pending, load_messages, queue_messages
+
+MESSAGES = [{"role": "user", "content": "Привіт"}, {"role": "assistant", "content": "Вітаю!"}]
+
+
+def contents(messages: list[dict]) -> list[str]:
+    return [message["content"] for message in messages if message["role"] != "system"]
+
+
+async def count_chars(messages: list[dict]) -> list[int]:
+    """Подсчёт токенов без словаря tiktoken (его нужно скачивать): здесь важна только запись."""
+    return [len(message["content"] or "") for message in messages]
+
+
+@pytest.fixture(autouse=True)
+def pending(monkeypatch):
+    """Очередь и токенизатор - свои на каждый тест."""
+    monkeypatch.setattr(history_store, "_pending", {})
+    monkeypatch.setattr(history_store, "count_tokens_batch", count_chars)
+
+
+def test_queued_messages_stay_visible_during_flush(run, monkeypatch):
+    async def test():
+        chat_history = await create_chat_history()
+        queue_messages(chat_history, MESSAGES)
+
+        counted = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_count(messages):
+            counted.set()
+            await release.wait()
+            return await count_chars(messages)
+
+        monkeypatch.setattr(history_store, "count_tokens_batch", slow_count)
+        flush = asyncio.create_task(flush_pending())
+        await counted.wait()
+        assert contents(await load_messages(chat_history)) == ["Привіт", "Вітаю!"]
+
+        release.set()
+        await flush
+        assert contents(await load_messages(chat_history)) == ["Привіт", "Вітаю!"]
+        assert chat_history.next_seq == 2
+        assert chat_history.id not in history_store._pending
+
+    run(test)
+
+
+def test_failed_flush_keeps_messages_queued(run, monkeypatch):
+    async def test():
+        chat_history = await create_chat_history()
+        queue_messages(chat_history, MESSAGES)
+
+        async def broken_count(messages):
+            raise RuntimeError("tokenizer failed")
+
+        monkeypatch.setattr(history_store, "count_tokens_batch", broken_count)
+        with pytest.raises(RuntimeError):
+            await flush_pending()
+        assert contents(await load_messages(chat_history)) == ["Привіт", "Вітаю!"]
+
+        monkeypatch.setattr(history_store, "count_tokens_batch", count_chars)
+        await flush_pending()
+        assert chat_history.next_seq == 2
+        assert contents(await load_messages(chat_history)) == ["Привіт", "Вітаю!"]
+
+    run(test)
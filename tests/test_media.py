@@ -0,0 +1,67 @@
+"""Конвейер медиа и голосовые: ошибки скачивания доходят до пользователя, спул у каждого процесса свой."""
+
+import asyncio
+from types import SimpleNamespace
+
+from fntypes.option import Nothing, Some
+
+from app.handlers.voice import voice_handler
+from app.utils.media import MediaFile, MediaPipeline, MediaTooLarge, media_pipeline
+
+
+def test_failed_download_calls_on_error(runner, tmp_path):
+    async def test():
+        pipeline = MediaPipeline(spool_dir=tmp_path, workers=1, max_file_size=10)
+        errors = []
+
+        async def on_ready(path):
+            raise AssertionError("file must not be downloaded")
+
+        async def on_error(error):
+            errors.append(error)
+
+        assert pipeline.submit(None, MediaFile("id", "unique", 100), on_ready, on_error)
+        await asyncio.wait_for(pipeline._queue.join(), 1)
+        await pipeline.close()
+        assert len(errors) == 1 and isinstance(errors[0], MediaTooLarge)
+
+    runner.run(test())
+
+
+def test_spool_directory_is_per_pipeline(runner, tmp_path):
+    async def test():
+        first, second = MediaPipeline(spool_dir=tmp_path), MediaPipeline(spool_dir=tmp_path)
+        first_dir, second_dir = first._spool(), second._spool()
+        assert first_dir != second_dir and first_dir.parent == second_dir.parent == tmp_path
+        (second_dir / "file").write_bytes(b"data")
+
+        await first.close()
+        assert not first_dir.exists() and (second_dir / "file").exists()  # Чужой спул не тронут
+        await second.close()
+
+    runner.run(test())
+
+
+def test_voice_download_failure_is_reported(runner):
+    async def test():
+        answers = []
+
+        class API:
+            async def get_file(self, file_id):
+                raise ConnectionError("Telegram is unavailable")
+
+        voice = SimpleNamespace(
+            file_id="voice", file_unique_id="voice-unique", file_size=Nothing(), duration=3
+        )
+        message = SimpleNamespace(voice=Some(voice), ctx_api=API(), answer=lambda text: answered(answers, text))
+
+        await voice_handler(message, None)  # Размера нет в сообщении: файл качается в фоне
+        await asyncio.wait_for(media_pipeline._queue.join(), 1)
+        await media_pipeline.close()
+        assert answers == ["Could not download the voice message, please send it again."]
+
+    runner.run(test())
+
+
+async def answered(answers: list[str], text: str) -> None:
+    answers.append(text)
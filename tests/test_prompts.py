@@ -0,0 +1,48 @@
+"""
+Версии системных промптов: история закрепляет версию при создании,
+и закреплённая версия остаётся доступной после перезапуска.
+"""
+
+from app.database.prompt_version import PromptVersion
+from app.llm import prompts
+from app.llm.prompts import PromptType, reload_prompts, resolve_prompt, sync_prompt_versions
+from app.utils.history_store import create_chat_history, system_message
+
+
+def test_history_pins_prompt_version(run, monkeypatch):
+    async def test():
+        current = resolve_prompt(PromptType.ENTRY)
+        old_history = await create_chat_history()
+        assert (old_history.prompt, old_history.prompt_version) == ("ENTRY", current.version)
+
+        # Новая версия entry.txt действует только для новых разговоров
+        monkeypatch.setattr(prompts, "get_prompt", lambda prompt_type: "Новий промпт")
+        monkeypatch.setattr(prompts, "_versions", {key: dict(value) for key, value in prompts._versions.items()})
+        monkeypatch.setattr(prompts, "_latest", {})
+        reload_prompts()
+        new_history = await create_chat_history()
+
+        assert system_message(old_history)["content"] == current.content
+        assert system_message(new_history)["content"] == "Новий промпт"
+
+    run(test)
+
+
+def test_pinned_version_survives_restart(run, monkeypatch):
+    async def test():
+        current = resolve_prompt(PromptType.ENTRY)
+        assert await PromptVersion.filter(type="ENTRY", version=current.version).exists()
+        await PromptVersion.create(type="ENTRY", version="old", content="Попередній промпт")
+
+        # Перезапуск: реестр в памяти пуст, версии читаются из базы
+        monkeypatch.setattr(prompts, "_versions", {})
+        monkeypatch.setattr(prompts, "_latest", {})
+        reload_prompts()
+        await sync_prompt_versions()
+
+        assert resolve_prompt("ENTRY", "old").content == "Попередній промпт"
+        assert resolve_prompt("ENTRY").version == current.version
+        assert resolve_prompt("ENTRY", "missing").version == current.version  # Неизвестная версия - текущая
+        assert await PromptVersion.filter(type="ENTRY").count() == 2
+
+    run(test)
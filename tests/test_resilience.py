@@ -0,0 +1,109 @@
+"""Дублирующие запросы и выключатель app.llm.resilience без модели: invoke - заглушка с задержкой."""
+
+import asyncio
+
+from app.llm import resilience as resilience_module
+from app.llm.admission import AdmissionController
+from app.llm.resilience import CircuitBreaker, LatencyTracker, ResilientCaller
+
+MODEL = "primary"
+
+
+def slow_caller() -> ResilientCaller:
+    """p95 уже известен и мал, поэтому медленный ответ сразу дублируется."""
+    caller = ResilientCaller(attempt_timeout=5, retries=0, hedge_min_delay=0.01, hedge_min_samples=1)
+    caller.latencies[MODEL] = LatencyTracker()
+    caller.latencies[MODEL].add(0.01)
+    return caller
+
+
+async def slow_invoke(model: str) -> str:
+    await asyncio.sleep(0.1)
+    return "answer"
+
+
+def test_hedge_takes_admission_slot(runner, monkeypatch):
+    async def test():
+        admission = AdmissionController(max_concurrent=2, requests_per_minute=None, tokens_per_minute=None)
+        monkeypatch.setattr(resilience_module, "admission", admission)
+        caller = slow_caller()
+
+        await admission.acquire(1, 100)  # Место основного запроса
+        in_flight = []
+
+        async def invoke(model):
+            in_flight.append(admission.in_flight)
+            return await slow_invoke(model)
+
+        assert await caller.call(MODEL, invoke, hedge_tokens=100) == ("answer", MODEL)
+        assert caller.counts["hedges"] == 1 and in_flight == [1, 2]
+        await asyncio.sleep(0.01)  # Проигравший отменён, его место освобождается
+        assert admission.in_flight == 1
+
+    runner.run(test())
+
+
+def test_hedge_skipped_without_free_slot(runner, monkeypatch):
+    async def test():
+        admission = AdmissionController(max_concurrent=1, requests_per_minute=None, tokens_per_minute=None)
+        monkeypatch.setattr(resilience_module, "admission", admission)
+        caller = slow_caller()
+
+        await admission.acquire(1, 100)
+        assert await caller.call(MODEL, slow_invoke, hedge_tokens=100) == ("answer", MODEL)
+        assert caller.counts["hedges"] == 0 and caller.counts["hedges_skipped"] == 1
+        assert admission.in_flight == 1
+
+    runner.run(test())
+
+
+def test_half_open_allows_single_probe(runner):
+    async def test():
+        caller = ResilientCaller(retries=0, hedge=False, fallbacks={MODEL: "fallback"})
+        breaker = caller.breaker(MODEL)
+        breaker.opened_at = 0.0  # Разомкнут давно: пора пробовать основную модель
+        assert breaker.state == "half_open"
+
+        release = asyncio.Event()
+
+        async def invoke(model):
+            if model == MODEL:
+                await release.wait()
+            return model
+
+        probe = asyncio.create_task(caller.call(MODEL, invoke))
+        await asyncio.sleep(0)
+        others = await asyncio.gather(*(caller.call(MODEL, invoke) for _ in range(3)))
+        assert [model for _, model in others] == ["fallback"] * 3
+
+        release.set()
+        assert (await probe)[1] == MODEL
+        assert breaker.state == "closed" and not breaker.probing
+
+    runner.run(test())
+
+
+def test_probe_released_after_non_retryable_error(runner):
+    async def test():
+        caller = ResilientCaller(retries=0, hedge=False)
+        breaker = caller.breaker(MODEL)
+        breaker.opened_at = 0.0
+
+        async def invoke(model):
+            raise ValueError("bad request")
+
+        try:
+            await caller.call(MODEL, invoke)
+        except ValueError:
+            pass
+        assert breaker.state == "half_open" and breaker.allows()
+
+    runner.run(test())
+
+
+def test_breaker_probe_is_marked_once():
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    breaker.failure()
+    assert breaker.begin() and not breaker.allows() and not breaker.begin()
+    breaker.failure()  # Пробный запрос не удался: цепь снова разомкнута, после cooldown - новая проба
+    assert breaker.allows() and breaker.begin()
@@ -0,0 +1,67 @@
+"""Выбор модели: запись (create_record) после инструментов остаётся на сильной модели."""
+
+import time
+from types import SimpleNamespace
+
+from app.config import LLM_FAST_MODEL, LLM_MODEL
+from app.database.appointment import Appointment
+from app.enums import Error
+from app.llm import wrapper
+from app.llm.resilience import ResilientCaller
+from app.llm.router import ModelRouter, Route
+from app.utils.history_store import create_chat_history
+
+CHEAP_MODEL = "cheap"
+ROUTES = {Route.AFTER_TOOLS: CHEAP_MODEL, Route.DEFAULT: LLM_MODEL, Route.ESCALATED: LLM_MODEL}
+
+
+def call(name: str, arguments: str = "{}") -> dict:
+    return {"id": "call", "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def test_write_tool_call_escalates():
+    router = ModelRouter(ROUTES)
+    route, model = router.choose("На 10:00, будь ласка", iterations=1)
+    assert (route, model) == (Route.AFTER_TOOLS, CHEAP_MODEL)
+
+    assert router.should_escalate(model, [call("create_record")]) == ["create_record: writes data"]
+    assert router.choose("На 10:00, будь ласка", iterations=1, escalated=True)[1] == LLM_MODEL
+    assert router.escalations == 1
+
+
+def test_read_tool_calls_stay_on_cheap_model():
+    router = ModelRouter(ROUTES)
+    assert router.should_escalate(CHEAP_MODEL, [call("get_free_time_slots"), call("get_staff")]) == []
+    assert router.should_escalate(LLM_MODEL, [call("create_record")]) == []  # Уже сильная модель
+    assert router.escalations == 0
+
+
+def test_write_from_fallback_model_is_not_executed(run, monkeypatch):
+    """Выключатель gpt-4o разомкнут: запись предлагает запасная дешёвая модель, и выполнять её нельзя."""
+
+    async def test():
+        requested = []
+
+        class Client:
+            def __init__(self, model):
+                self.model = model
+
+            async def ainvoke(self, input):
+                requested.append(self.model)
+                tool_call = {"id": "call", "type": "function", "function": {"name": "create_record", "arguments": "{}"}}
+                return SimpleNamespace(content="", additional_kwargs={"tool_calls": [tool_call]}, usage_metadata={})
+
+        resilience = ResilientCaller(hedge=False)
+        resilience.breaker(LLM_MODEL).opened_at = time.monotonic()  # Основная модель недоступна
+        monkeypatch.setattr(wrapper, "resilience", resilience)
+        monkeypatch.setattr(wrapper, "get_client", Client)
+
+        chat_history = await create_chat_history()
+        message = SimpleNamespace(from_user=SimpleNamespace(id=1))
+        result = await wrapper.make_completion(chat_history, message, "Запишіть мене на 10:00", use_answer_cache=False)
+
+        assert result == Error.LLM_BUSY
+        assert requested == [LLM_FAST_MODEL, LLM_FAST_MODEL]  # И повтор на сильной модели ушёл на запасную
+        assert await Appointment.all().count() == 0
+
+    run(test)
@@ -0,0 +1,37 @@
+"""Загрузка демо-данных: новая версия фикстур не удаляет записи клиентов."""
+
+from app.database.appointment import Appointment
+from app.database.slot import Slot
+from app.database.system import System
+from app.database.user import User
+from app.utils.seeding import seed_demo_data
+
+
+async def reseed() -> None:
+    """Версия фикстур в базе старше файла (как в базе, созданной до колонки fixtures_version)."""
+    await System.filter(id=1).update(fixtures_version=0)
+    await seed_demo_data()
+
+
+def test_reseed_replaces_catalog_without_appointments(run):
+    async def test():
+        slot_ids = set(await Slot.all().values_list("id", flat=True))
+        await reseed()
+        assert (await System.get(id=1)).fixtures_version > 0
+        assert slot_ids.isdisjoint(await Slot.all().values_list("id", flat=True))
+
+    run(test)
+
+
+def test_reseed_keeps_client_appointments(run):
+    async def test():
+        user = await User.create(uid=1, name="Client")
+        slot = await Slot.first()
+        appointment = await Appointment.create(user=user, slot=slot)
+
+        await reseed()
+        assert await Appointment.filter(id=appointment.id).exists()
+        assert await Slot.filter(id=slot.id).exists()
+        assert (await System.get(id=1)).fixtures_version == 0  # Загрузится, когда записей не будет
+
+    run(test)
@@ -0,0 +1,59 @@
+"""Стриминг ответа: показанный текст заменяется итоговым или удаляется, время до первых токенов - в метриках."""
+
+from types import SimpleNamespace
+
+from app.utils import streaming
+from app.utils.metrics import Metrics
+from app.utils.streaming import StreamingReply
+
+
+class Chat:
+    """Сообщение пользователя с API бота, которое записывает отправки, правки и удаления."""
+
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(id=1)
+        self.ctx_api = self
+
+    async def answer(self, text):
+        self.calls.append(("send", text))
+        return SimpleNamespace(unwrap=lambda: SimpleNamespace(message_id=10))
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        self.calls.append(("edit", text))
+        return True
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(("delete", message_id))
+        return True
+
+
+def streamed(runner, monkeypatch) -> tuple[Chat, StreamingReply, Metrics]:
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(streaming, "metrics", metrics)
+    chat = Chat()
+    reply = StreamingReply(chat, interval=0)
+    runner.run(reply.update("Зараз перевірю"))
+    return chat, reply, metrics
+
+
+def test_streamed_text_is_replaced(runner, monkeypatch):
+    chat, reply, metrics = streamed(runner, monkeypatch)
+    runner.run(reply.finish("Зараз багато звернень"))
+    assert chat.calls == [("send", "Зараз перевірю"), ("edit", "Зараз багато звернень")]
+    assert metrics.histograms[("stream_ttfb_seconds", ())].count == 1
+
+
+def test_streamed_text_is_discarded(runner, monkeypatch):
+    chat, reply, metrics = streamed(runner, monkeypatch)
+    runner.run(reply.discard())
+    assert chat.calls == [("send", "Зараз перевірю"), ("delete", 10)]
+    assert metrics.histograms[("stream_ttfb_seconds", ())].count == 1
+
+
+def test_discard_without_streamed_text(runner, monkeypatch):
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(streaming, "metrics", metrics)
+    chat = Chat()
+    runner.run(StreamingReply(chat).discard())
+    assert chat.calls == [] and not metrics.histograms
@@ -0,0 +1,136 @@
+"""
+Сводка старых сообщений: имя, телефон и записи клиента переживают очистку истории,
+сводка дописывается по частям, модель-суммаризатор идёт через допуск и выключатель, как запросы хода.
+"""
+
+import time
+from types import SimpleNamespace
+
+from app.config import LLM_FAST_MODEL, LLM_MODEL
+from app.database.chat_message import SUMMARY_SEQ, ChatMessage
+from app.llm import summarizer as summarizer_module
+from app.llm.admission import AdmissionController
+from app.llm.resilience import ResilientCaller
+from app.llm.router import ModelRouter, Route
+from app.llm.summarizer import LocalSummarizer, ModelSummarizer, parse_summary, update_summary
+from app.utils import auto_cleaner, codec, history_store
+from app.utils.auto_cleaner import TrimPolicy, clean_chat_history
+from app.utils.history_store import append_messages, create_chat_history
+
+BOOKING = {
+    "role": "tool",
+    "name": "create_record",
+    "content": codec.dumps(
+        {
+            "appointments": [
+                {"id": 7, "service": {"name": "Haircut"}, "master": {"name": "Anna"}, "datetime": "2024-05-01 10:00"}
+            ]
+        }
+    ),
+}
+
+
+def user(text: str) -> dict:
+    return {"role": "user", "content": text}
+
+
+def count_chars(message: dict) -> int:
+    """Подсчёт токенов без словаря tiktoken (его нужно скачивать)."""
+    return len(message["content"] or "")
+
+
+async def count_chars_batch(messages: list[dict]) -> list[int]:
+    return [count_chars(message) for message in messages]
+
+
+def test_facts_survive_eviction(runner):
+    async def test():
+        summarizer = LocalSummarizer(max_lines=3)
+        summary = await summarizer(None, [user("Меня зовут Олена, телефон +380 50 123 45 67"), BOOKING])
+        for i in range(5):  # Реплики клиента вытесняются первыми
+            summary = await summarizer(summary, [user(f"Question {i}")])
+
+        assert summary.splitlines() == [
+            "- Phone: +380501234567",
+            "- Name: Олена",
+            "- Booked appointment 7: Haircut with Anna at 2024-05-01 10:00",
+        ]
+
+    runner.run(test())
+
+
+def test_summary_is_updated_incrementally(runner, monkeypatch):
+    async def test():
+        calls = []
+
+        async def summarizer(summary, messages):
+            calls.append((summary, [message["content"] for message in messages]))
+            return await LocalSummarizer()(summary, messages)
+
+        monkeypatch.setattr(summarizer_module, "_summarizer", summarizer)
+        first = await update_summary(None, [user("My name is Oleg")])
+        second = await update_summary(first, [user("+380 67 765 43 21")])
+
+        # Второй раз суммаризатор получает прошлую сводку и только новые сообщения
+        assert calls[1] == (first, ["+380 67 765 43 21"])
+        assert set(first.splitlines()) < set(second.splitlines()) and "- Phone: +380677654321" in second
+
+    runner.run(test())
+
+
+def test_clean_chat_history_writes_summary(run, monkeypatch):
+    async def test():
+        monkeypatch.setattr(history_store, "count_tokens_batch", count_chars_batch)
+        monkeypatch.setattr(auto_cleaner, "count_tokens", count_chars)
+        monkeypatch.setattr(summarizer_module, "_summarizer", LocalSummarizer())
+        policy = TrimPolicy(max_messages=4, max_tokens=10**6, max_function_messages=None, block=0)
+
+        chat_history = await create_chat_history()
+        await append_messages(chat_history, [user("My name is Oleg"), *(user(f"Question {i}") for i in range(4))])
+        await clean_chat_history(chat_history, policy)
+        await append_messages(chat_history, [user("+380 67 765 43 21"), *(user(f"More {i}") for i in range(3))])
+        await clean_chat_history(chat_history, policy)
+
+        messages = await ChatMessage.filter(chat_history_id=chat_history.id).order_by("seq")
+        assert [message.seq for message in messages] == [SUMMARY_SEQ, 6, 7, 8]  # Промпт + три последних
+        summary = parse_summary(messages[0].content)
+        assert "- Name: Oleg" in summary and "- Phone: +380677654321" in summary
+        # Счётчик токенов истории совпадает с суммой по строкам (сводка вместо удалённых сообщений)
+        total = sum(message.tokens for message in messages)
+        assert chat_history.total_tokens == total
+        await chat_history.refresh_from_db()
+        assert chat_history.total_tokens == total
+
+    run(test)
+
+
+def test_model_summary_is_admitted_and_recorded(runner, monkeypatch):
+    async def test():
+        admission = AdmissionController(max_concurrent=1, requests_per_minute=None, tokens_per_minute=None)
+        resilience = ResilientCaller(hedge=False)
+        resilience.breaker(LLM_FAST_MODEL).opened_at = time.monotonic()  # Модель сводки недоступна
+        router = ModelRouter()
+        monkeypatch.setattr(summarizer_module, "admission", admission)
+        monkeypatch.setattr(summarizer_module, "resilience", resilience)
+        monkeypatch.setattr(summarizer_module, "router", router)
+
+        in_flight = []
+
+        class Client:
+            def __init__(self, model):
+                self.model = model
+
+            async def ainvoke(self, input):
+                in_flight.append(admission.in_flight)
+                usage = {"input_tokens": 100, "output_tokens": 10}
+                return SimpleNamespace(content=f" summary by {self.model} ", usage_metadata=usage)
+
+        summarizer = ModelSummarizer(LLM_FAST_MODEL)
+        monkeypatch.setattr(summarizer, "client", Client)
+
+        summary = await summarizer(None, [{"role": "user", "content": "Hi"}])
+        assert summary == f"summary by {LLM_MODEL}"  # Ответила запасная модель
+        assert in_flight == [1] and admission.in_flight == 0
+        assert router.stats()["routes"][f"{Route.SUMMARY}/{LLM_MODEL}"]["input_tokens"] == 100
+
+    runner.run(test())
@@ -0,0 +1,38 @@
+"""Дневной бюджет токенов: расход из базы и ещё не записанные токены."""
+
+import asyncio
+from datetime import date, timedelta
+
+from app.database.token_usage import TokenUsage
+from app.utils.token_budget import TokenBudget
+
+UID = 1
+
+
+def test_parallel_first_requests_load_once(run):
+    async def test():
+        await TokenUsage.create(uid=UID, day=date.today(), tokens=100)
+        budget = TokenBudget()
+
+        assert await asyncio.gather(*(budget.used(UID) for _ in range(5))) == [100] * 5
+        assert await budget.used(UID) == 100
+
+    run(test)
+
+
+def test_unwritten_tokens_count_after_day_change(run):
+    async def test():
+        await TokenUsage.create(uid=UID, day=date.today(), tokens=100)
+        budget = TokenBudget()
+        budget._day = date.today() - timedelta(days=1)  # Бот работает со вчерашнего дня
+
+        budget.add(UID, 50)  # Ещё не загружен из базы и не записан в неё
+        assert await budget.used(UID) == 150
+        budget.add(UID, 10)
+        assert await budget.used(UID) == 160
+
+        await budget.flush()
+        assert (await TokenUsage.get(uid=UID, day=date.today())).tokens == 160
+        assert await TokenBudget().used(UID) == 160
+
+    run(test)
@@ -0,0 +1,49 @@
+"""Выполнение вызовов инструментов хода: инструменты с run_serially - барьеры в порядке модели."""
+
+import asyncio
+
+from app.llm import wrapper
+from app.utils import codec
+
+
+def test_serial_tool_is_a_barrier(runner, monkeypatch):
+    async def test():
+        events = []
+
+        def make_tool(name: str, serial: bool = False):
+            async def tool(step: int):
+                events.append(f"start {name}{step}")
+                await asyncio.sleep(0.01)
+                events.append(f"end {name}{step}")
+                return step
+
+            tool._run_serially = serial
+            return tool
+
+        async def encode(tool_name, result):
+            return codec.dumps(result)
+
+        monkeypatch.setitem(wrapper.tool_objects, "read", make_tool("read"))
+        monkeypatch.setitem(wrapper.tool_objects, "write", make_tool("write", serial=True))
+        monkeypatch.setattr(wrapper, "encode_tool_result", encode)
+
+        calls = [
+            {"function": {"name": name, "arguments": codec.dumps({"step": step})}}
+            for step, name in enumerate(["read", "read", "write", "read"])
+        ]
+        messages, _ = await wrapper.handle_tool_calls(calls, message=None)
+
+        assert [message["content"] for message in messages] == ["0", "1", "2", "3"]
+        # Чтения до записи идут одновременно и завершаются до неё, чтение после записи - после
+        assert events == [
+            "start read0",
+            "start read1",
+            "end read0",
+            "end read1",
+            "start write2",
+            "end write2",
+            "start read3",
+            "end read3",
+        ]
+
+    runner.run(test())